@@ -0,0 +1,89 @@
+"""Benchmark JSON backends on a large listsinceblock response.
+
+    python -m benchmarks.codec --transactions 5000 -o result.json
+
+The response is built by EthereumProxy against the fake node, then
+encoded and decoded ``--rounds`` times with every installed backend.
+"""
+import asyncio
+import json
+import sys
+import time
+
+import click
+
+from ethereumd import codec
+from ethereumd.proxy import create_ethereumd_proxy
+
+from .fakenode import FakeChain, FakeNode
+
+
+async def listsinceblock_response(chain, loop):
+    node = FakeNode(chain, loop=loop)
+    server = await node.start_http('127.0.0.1', 0)
+    uri = 'http://127.0.0.1:%s' % server.sockets[0].getsockname()[1]
+    proxy = await create_ethereumd_proxy(uri, loop=loop)
+    try:
+        result = await proxy.listsinceblock(chain.blocks[0]['hash'])
+    finally:
+        proxy._rpc.close()
+        node.close()
+    return {'id': 1, 'result': result, 'error': None}
+
+
+def bench_backend(backend, response, rounds):
+    codec.use(backend)
+    encoded = codec.dumps(response)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        codec.dumps(response)
+    encode = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for _ in range(rounds):
+        codec.loads(encoded)
+    decode = (time.perf_counter() - started) / rounds
+    return {'bytes': len(encoded), 'encode': encode, 'decode': decode}
+
+
+def run(chain, rounds, loop):
+    response = loop.run_until_complete(listsinceblock_response(chain, loop))
+    results = {}
+    for backend in codec.BACKENDS:
+        try:
+            results[backend] = bench_backend(backend, response, rounds)
+        except ImportError:
+            continue
+    codec.use()
+    baseline = results['json']
+    for result in results.values():
+        result['speedup'] = ((baseline['encode'] + baseline['decode']) /
+                             (result['encode'] + result['decode']))
+    return {'transactions': len(response['result']['transactions']),
+            'backends': results}
+
+
+@click.command()
+@click.option('--transactions', default=5000,
+              help='Wallet transactions in response.')
+@click.option('--rounds', default=20, help='Encodings per backend.')
+@click.option('--seed', default=0, help='Chain generator seed.')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='Write JSON result to file (default: stdout).')
+def main(transactions, rounds, seed, output):
+    """Run codec benchmark and print JSON result."""
+    loop = asyncio.get_event_loop()
+    # every other transaction of fake chain touches the wallet
+    chain = FakeChain(blocks=max(transactions // 10, 1),
+                      txs_per_block=20, seed=seed)
+    result = run(chain, rounds, loop)
+    result['config'] = {
+        'rounds': rounds,
+        'seed': seed,
+        'python': sys.version.split()[0],
+    }
+    json.dump(result, output, indent=4, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Fake geth node speaking JSON-RPC over HTTP and IPC.
+
+The node serves a synthetic chain generated from a seed, so runs are
+comparable, and answers every request after a configurable latency.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+
+import click
+from aiohttp import web
+
+
+WEI = 10 ** 18
+
+
+def _hex(value):
+    return hex(value)
+
+
+class RPCError(Exception):
+
+    def __init__(self, message, code=-32000):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class FakeChain:
+    """Synthetic chain of ``blocks`` blocks with ``txs_per_block``
+    transactions each. Half of the transactions touch one of
+    ``accounts`` wallet accounts, the rest move ether between outsiders.
+    """
+
+    def __init__(self, blocks=1000, txs_per_block=10, accounts=10, seed=0):
+        self._random = random.Random(seed)
+        self.accounts = [self._address() for _ in range(accounts)]
+        self._outsiders = [self._address() for _ in range(100)]
+        self.blocks = []
+        self._by_hash = {}
+        self._transactions = {}
+        self._receipts = {}
+        self._filters = {}
+        self._balances = {}
+        self._nonce = 0
+        parent = '0x' + '0' * 64
+        for _ in range(blocks):
+            parent = self.mine(txs_per_block, parent)['hash']
+
+    @property
+    def head(self):
+        return self.blocks[-1]
+
+    @property
+    def wallet_transactions(self):
+        return [txid for txid, tr in self._transactions.items()
+                if tr['from'] in self.accounts or tr['to'] in self.accounts]
+
+    def _address(self):
+        return '0x%040x' % self._random.getrandbits(160)
+
+    def _hash(self):
+        return '0x%064x' % self._random.getrandbits(256)
+
+    def mine(self, txs_per_block=10, parent=None):
+        number = len(self.blocks)
+        block = {
+            'number': _hex(number),
+            'hash': self._hash(),
+            'parentHash': parent or self.head['hash'],
+            'timestamp': _hex(1500000000 + number * 15),
+            'difficulty': _hex(131072 + number),
+            'totalDifficulty': _hex(131072 * (number + 1)),
+            'gasLimit': _hex(4712388),
+            'gasUsed': _hex(21000 * txs_per_block),
+            'miner': self._outsiders[0],
+            'nonce': '0x%016x' % self._random.getrandbits(64),
+            'mixHash': self._hash(),
+            'sha3Uncles': self._hash(),
+            'stateRoot': self._hash(),
+            'transactionsRoot': self._hash(),
+            'receiptsRoot': self._hash(),
+            'logsBloom': '0x' + '0' * 512,
+            'extraData': '0x',
+            'size': _hex(540 + 110 * txs_per_block),
+            'uncles': [],
+            'transactions': [],
+        }
+        for index in range(txs_per_block):
+            block['transactions'].append(self._transaction(block, index))
+        self.blocks.append(block)
+        self._by_hash[block['hash']] = block
+        for filter_ in self._filters.values():
+            if filter_['type'] == 'block':
+                filter_['changes'].append(block['hash'])
+        return block
+
+    def _transaction(self, block, index):
+        if index % 2:
+            from_, to = self._random.sample(self._outsiders, 2)
+        else:
+            from_ = self._random.choice(self._outsiders)
+            to = self._random.choice(self.accounts)
+        self._nonce += 1
+        tr = {
+            'hash': self._hash(),
+            'blockHash': block['hash'],
+            'blockNumber': block['number'],
+            'transactionIndex': _hex(index),
+            'from': from_,
+            'to': to,
+            'value': _hex(self._random.randint(1, 10) * WEI // 100),
+            'gas': _hex(90000),
+            'gasPrice': _hex(20 * 10 ** 9),
+            'input': '0x',
+            'nonce': _hex(self._nonce),
+            'v': '0x1b',
+            'r': self._hash(),
+            's': self._hash(),
+        }
+        self._transactions[tr['hash']] = tr
+        self._balances[to] = (self._balances.get(to, 0) +
+                              int(tr['value'], 16))
+        self._receipts[tr['hash']] = {
+            'transactionHash': tr['hash'],
+            'transactionIndex': tr['transactionIndex'],
+            'blockHash': block['hash'],
+            'blockNumber': block['number'],
+            'from': from_,
+            'to': to,
+            'gasUsed': _hex(21000),
+            'cumulativeGasUsed': _hex(21000 * (index + 1)),
+            'contractAddress': None,
+            'logs': [],
+            'status': '0x1',
+        }
+        return tr
+
+    def _block(self, block, tx_objects):
+        if block is None or tx_objects:
+            return block
+        return dict(block, transactions=[
+            tr['hash'] for tr in block['transactions']])
+
+    def _by_number(self, height):
+        if height in ('latest', 'pending'):
+            return self.head
+        if height == 'earliest':
+            return self.blocks[0]
+        number = int(height, 16)
+        return self.blocks[number] if number < len(self.blocks) else None
+
+    def _new_filter(self, type_):
+        filter_id = _hex(len(self._filters) + 1)
+        self._filters[filter_id] = {'type': type_, 'changes': []}
+        return filter_id
+
+    def _filter_changes(self, filter_id):
+        try:
+            filter_ = self._filters[filter_id]
+        except KeyError:
+            raise RPCError('filter not found')
+        changes, filter_['changes'] = filter_['changes'], []
+        return changes
+
+    def call(self, method, params):
+        params = params or []
+        try:
+            if method == 'eth_accounts':
+                return self.accounts
+            elif method == 'eth_coinbase':
+                return self.accounts[0]
+            elif method == 'eth_blockNumber':
+                return self.head['number']
+            elif method == 'eth_getBlockByNumber':
+                return self._block(self._by_number(params[0]), params[1])
+            elif method == 'eth_getBlockByHash':
+                return self._block(self._by_hash.get(params[0]), params[1])
+            elif method == 'eth_getTransactionByHash':
+                return self._transactions.get(params[0])
+            elif method == 'eth_getTransactionReceipt':
+                return self._receipts.get(params[0])
+            elif method == 'eth_getBalance':
+                return _hex(self._balances.get(params[0], 0))
+            elif method == 'eth_gasPrice':
+                return _hex(20 * 10 ** 9)
+            elif method == 'eth_hashrate':
+                return _hex(0)
+            elif method == 'eth_syncing':
+                return False
+            elif method == 'net_version':
+                return '15'
+            elif method == 'eth_newBlockFilter':
+                return self._new_filter('block')
+            elif method == 'eth_newPendingTransactionFilter':
+                return self._new_filter('pending')
+            elif method == 'eth_getFilterChanges':
+                return self._filter_changes(params[0])
+            elif method in ('personal_unlockAccount',
+                            'personal_lockAccount'):
+                return True
+        except IndexError:
+            raise RPCError('missing value for required argument %s'
+                           % len(params), -32602)
+        raise RPCError('The method %s does not exist/is not available'
+                       % method, -32601)
+
+
+class FakeNode:
+    """Serves :class:`FakeChain` answering each request (a whole batch
+    counts as one) after ``latency`` seconds.
+    """
+
+    def __init__(self, chain, latency=0, *, loop=None):
+        self._log = logging.getLogger('fakenode')
+        self.chain = chain
+        self.latency = latency
+        self._loop = loop or asyncio.get_event_loop()
+        self._servers = []
+        self.requests = 0
+
+    async def handle(self, payload):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency, loop=self._loop)
+        if isinstance(payload, list):
+            return [self._response(data) for data in payload]
+        return self._response(payload)
+
+    def _response(self, data):
+        response = {'jsonrpc': '2.0', 'id': data.get('id')}
+        try:
+            response['result'] = self.chain.call(data['method'],
+                                                 data.get('params'))
+        except RPCError as e:
+            response['error'] = {'code': e.code, 'message': e.message}
+        return response
+
+    async def start_http(self, host='127.0.0.1', port=8545):
+        async def handler(request):
+            payload = await request.json()
+            return web.json_response(await self.handle(payload))
+
+        app = web.Application(loop=self._loop)
+        app.router.add_post('/', handler)
+        server = await self._loop.create_server(app.make_handler(),
+                                                host, port)
+        self._servers.append(server)
+        return server
+
+    async def start_ipc(self, path):
+        decoder = json.JSONDecoder()
+
+        async def handler(reader, writer):
+            buf = ''
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buf += chunk.decode('utf-8')
+                while buf.strip():
+                    try:
+                        payload, end = decoder.raw_decode(buf.lstrip())
+                    except ValueError:
+                        break
+                    buf = buf.lstrip()[end:]
+                    response = await self.handle(payload)
+                    writer.write(json.dumps(response).encode('utf-8') +
+                                 b'\n')
+            writer.close()
+
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(handler, path,
+                                                 loop=self._loop)
+        self._servers.append(server)
+        return server
+
+    async def mine_forever(self, interval, txs_per_block=10):
+        while True:
+            await asyncio.sleep(interval, loop=self._loop)
+            block = self.chain.mine(txs_per_block)
+            self._log.info('Mined block %s', block['hash'])
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        self._servers = []
+
+
+@click.command()
+@click.option('--blocks', default=1000, help='Blocks in generated chain.')
+@click.option('--txs-per-block', default=10,
+              help='Transactions in every block.')
+@click.option('--accounts', default=10, help='Wallet accounts.')
+@click.option('--latency', default=0.0,
+              help='Seconds before each request is answered.')
+@click.option('--block-time', default=0.0,
+              help='Mine new block every N seconds (0 - never).')
+@click.option('--seed', default=0, help='Chain generator seed.')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8545)
+@click.option('--ipc', default=None, help='Also listen on this IPC path.')
+def main(blocks, txs_per_block, accounts, latency, block_time, seed, host,
+         port, ipc):
+    """Run fake node until interrupted."""
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.get_event_loop()
+    node = FakeNode(FakeChain(blocks, txs_per_block, accounts, seed),
+                    latency, loop=loop)
+    loop.run_until_complete(node.start_http(host, port))
+    if ipc:
+        loop.run_until_complete(node.start_ipc(ipc))
+    if block_time:
+        asyncio.ensure_future(node.mine_forever(block_time, txs_per_block),
+                              loop=loop)
+    click.echo('Fake node on http://%s:%s%s' % (
+        host, port, ' and %s' % ipc if ipc else ''))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.close()
+
+
+if __name__ == '__main__':
+    main()
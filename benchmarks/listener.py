@@ -0,0 +1,146 @@
+"""Benchmark round trips to the proxy over TCP and unix socket.
+
+    python -m benchmarks.listener --requests 2000 -o result.json
+
+RPCServer listens on both in its own process against the fake node,
+then ``--requests`` sequential ``getblockcount`` calls, answered from
+the response cache, are sent over each transport, once reusing one
+connection and once opening a new connection per call.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+import click
+
+from ethereumd.server import RPCServer
+
+from .fakenode import FakeChain, FakeNode
+from .run import percentile
+
+
+PAYLOAD = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'getblockcount',
+                      'params': []})
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def serve_proxy(chain, port, path, logfile):
+    """Run fake node and RPCServer listening on ``port`` and ``path``,
+    target of the spawned server process.
+    """
+    loop = asyncio.get_event_loop()
+    node = FakeNode(chain, loop=loop)
+    node_server = loop.run_until_complete(node.start_http('127.0.0.1', 0))
+    RPCServer(rpcport=node_server.sockets[0].getsockname()[1],
+              ethpport=port, ethpsocket=path, logfile=logfile,
+              loop=loop).run()
+
+
+async def wait_ready(connector, url, loop, timeout=30):
+    """Wait until server answers and its chain head is fresh, so calls
+    are served from the response cache.
+    """
+    deadline = loop.time() + timeout
+    async with aiohttp.ClientSession(connector=connector,
+                                     loop=loop) as session:
+        while True:
+            try:
+                async with session.get(url + '_stats/') as response:
+                    if (await response.json())['head']['fresh']:
+                        return
+            except (aiohttp.ClientError, OSError, ValueError):
+                if loop.time() > deadline:
+                    raise
+            await asyncio.sleep(0.1, loop=loop)
+
+
+async def bench_transport(connector, url, requests, loop):
+    latencies = []
+    async with aiohttp.ClientSession(connector=connector,
+                                     loop=loop) as session:
+        started = time.perf_counter()
+        for _ in range(requests):
+            sent = time.perf_counter()
+            async with session.post(url, data=PAYLOAD) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'rps': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def run(chain, requests, loop):
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'ethereumd.sock')
+    port = free_port()
+    # spawned, so server doesn't share event loop or selector with client
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve_proxy,
+        args=(chain, port, path, os.path.join(tmpdir, 'ethereumd.log')))
+    process.start()
+    transports = {
+        'tcp': (lambda **kw: aiohttp.TCPConnector(loop=loop, **kw),
+                'http://127.0.0.1:%s/' % port),
+        'unix': (lambda **kw: aiohttp.UnixConnector(path, loop=loop, **kw),
+                 'http://localhost/'),
+    }
+    results = {}
+    try:
+        for name, (connector, url) in transports.items():
+            loop.run_until_complete(wait_ready(connector(), url, loop))
+            results[name] = {
+                mode: loop.run_until_complete(bench_transport(
+                    connector(force_close=force_close), url, requests,
+                    loop))
+                for mode, force_close in (('keepalive', False),
+                                          ('connect', True))
+            }
+    finally:
+        process.terminate()
+        process.join()
+        if os.path.exists(path):
+            os.unlink(path)
+    for mode in ('keepalive', 'connect'):
+        results['unix'][mode]['speedup'] = (results['tcp'][mode]['p50'] /
+                                            results['unix'][mode]['p50'])
+    return {'transports': results}
+
+
+@click.command()
+@click.option('--requests', default=2000, help='Calls per transport.')
+@click.option('--seed', default=0, help='Chain generator seed.')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='Write JSON result to file (default: stdout).')
+def main(requests, seed, output):
+    """Run listener benchmark and print JSON result."""
+    loop = asyncio.get_event_loop()
+    chain = FakeChain(blocks=100, seed=seed)
+    result = run(chain, requests, loop)
+    result['config'] = {
+        'requests': requests,
+        'seed': seed,
+        'python': sys.version.split()[0],
+    }
+    json.dump(result, output, indent=4, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
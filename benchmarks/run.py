@@ -0,0 +1,163 @@
+"""Benchmark EthereumProxy methods and Poller against the fake node.
+
+    python -m benchmarks.run --blocks 2000 --latency 0.001 -o result.json
+
+Reports requests per second, p50 and p99 latency per proxy method and
+blocks per second processed by the Poller, as JSON.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import click
+
+from ethereumd.poller import Poller
+from ethereumd.proxy import create_ethereumd_proxy
+
+from .fakenode import FakeChain, FakeNode
+
+
+def discard(name, data):
+    """Notification sink used while benchmarking the Poller."""
+
+
+def percentile(latencies, pct):
+    latencies = sorted(latencies)
+    index = min(int(round(pct / 100 * len(latencies))), len(latencies) - 1)
+    return latencies[index]
+
+
+def scenarios(chain, rand):
+    """Map of method to factory of its arguments."""
+    hashes = [block['hash'] for block in chain.blocks]
+    txids = chain.wallet_transactions
+    since = chain.blocks[max(len(chain.blocks) - 100, 0)]['hash']
+    return {
+        'getblockcount': lambda: (),
+        'getbestblockhash': lambda: (),
+        'getblockhash': lambda: (rand.randrange(len(hashes)),),
+        'getblock': lambda: (rand.choice(hashes),),
+        'getdifficulty': lambda: (),
+        'estimatefee': lambda: (),
+        'validateaddress': lambda: (rand.choice(chain.accounts),),
+        'getbalance': lambda: (),
+        'listaccounts': lambda: (),
+        'gettransaction': lambda: (rand.choice(txids),),
+        'listsinceblock': lambda: (since,),
+    }
+
+
+async def bench_method(proxy, method, args, requests, concurrency, loop):
+    latencies = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            await getattr(proxy, method)(*args())
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)), loop=loop)
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'rps': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+
+async def bench_poller(proxy, chain, chunk, loop):
+    sink = 'python:benchmarks.run:discard'
+    poller = Poller(proxy, cmds={'blocknotify': sink, 'walletnotify': sink},
+                    loop=loop)
+    proxy._cache.clear()
+    hashes = [block['hash'] for block in chain.blocks]
+    started = time.perf_counter()
+    for i in range(0, len(hashes), chunk):
+        await poller._process_blocks(hashes[i:i + chunk])
+    while not poller.defqueue.empty() or poller._inflight:
+        await asyncio.sleep(0, loop=loop)
+    elapsed = time.perf_counter() - started
+    poller.stop()
+    return {
+        'blocks': len(hashes),
+        'blocks_per_second': len(hashes) / elapsed,
+    }
+
+
+async def run(chain, latency, transport, requests, concurrency, methods,
+              seed, loop):
+    node = FakeNode(chain, latency, loop=loop)
+    if transport == 'ipc':
+        path = os.path.join(tempfile.mkdtemp(), 'geth.ipc')
+        await node.start_ipc(path)
+        uri = 'unix://%s' % path
+    else:
+        server = await node.start_http('127.0.0.1', 0)
+        uri = 'http://127.0.0.1:%s' % server.sockets[0].getsockname()[1]
+
+    proxy = await create_ethereumd_proxy(uri, loop=loop)
+    rand = random.Random(seed)
+    results = {}
+    try:
+        for method, args in scenarios(chain, rand).items():
+            if methods and method not in methods:
+                continue
+            results[method] = await bench_method(proxy, method, args,
+                                                 requests, concurrency, loop)
+        poller = await bench_poller(proxy, chain, 10, loop)
+    finally:
+        proxy._rpc.close()
+        node.close()
+    return {'methods': results, 'poller': poller,
+            'upstream_requests': node.requests}
+
+
+@click.command()
+@click.option('--blocks', default=1000, help='Blocks in generated chain.')
+@click.option('--txs-per-block', default=10,
+              help='Transactions in every block.')
+@click.option('--accounts', default=10, help='Wallet accounts.')
+@click.option('--latency', default=0.0,
+              help='Seconds before node answers each request.')
+@click.option('--transport', type=click.Choice(['http', 'ipc']),
+              default='http')
+@click.option('--requests', default=1000, help='Calls per method.')
+@click.option('--concurrency', default=10,
+              help='Concurrent callers per method.')
+@click.option('--method', 'methods', multiple=True,
+              help='Benchmark only these methods.')
+@click.option('--seed', default=0, help='Chain and arguments seed.')
+@click.option('-o', '--output', type=click.File('w'), default='-',
+              help='Write JSON result to file (default: stdout).')
+def main(blocks, txs_per_block, accounts, latency, transport, requests,
+         concurrency, methods, seed, output):
+    """Run benchmark and print JSON result."""
+    loop = asyncio.get_event_loop()
+    chain = FakeChain(blocks, txs_per_block, accounts, seed)
+    result = loop.run_until_complete(run(
+        chain, latency, transport, requests, concurrency, methods, seed,
+        loop))
+    result['config'] = {
+        'blocks': blocks,
+        'txs_per_block': txs_per_block,
+        'accounts': accounts,
+        'latency': latency,
+        'transport': transport,
+        'requests': requests,
+        'concurrency': concurrency,
+        'seed': seed,
+        'python': sys.version.split()[0],
+    }
+    json.dump(result, output, indent=4, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import os
 import sys
 import signal
+import socket
 import json
+import http.client
 from collections import Mapping
 
 import requests
@@ -67,6 +69,34 @@ def read_config_file(filename: str) -> {}:
     return cfg
 
 
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        super().__init__('localhost')
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+def post_rpc(conf, data):
+    """POST ``data`` to proxy over unix socket when ``ethpsocket`` is
+    set, over TCP otherwise. Returns decoded response.
+    """
+    if conf.get('ethpsocket'):
+        conn = UnixHTTPConnection(conf['ethpsocket'])
+        try:
+            conn.request('POST', '/', body=data,
+                         headers={'Content-Type': 'application/json'})
+            return json.loads(conn.getresponse().read().decode('utf-8'))
+        finally:
+            conn.close()
+    return requests.post(
+        'http://%s:%s' % (conf['ethpconnect'], conf['ethpport']),
+        data=data).json()
+
+
 def _refine_datadir(ctx, param, value):
     return os.path.realpath(value)
 
@@ -87,6 +117,9 @@ def _refine_conf(ctx, param, value):
         if 'ipcconnect' in settings:
             settings['ipcconnect'] = os.path.join(datadir,
                                                   settings['ipcconnect'])
+        if 'ethpsocket' in settings:
+            settings['ethpsocket'] = os.path.join(datadir,
+                                                  settings['ethpsocket'])
         settings.setdefault('ethpconnect', '127.0.0.1')
         settings.setdefault('ethpport', 9500)
         settings.setdefault('rpcconnect', '127.0.0.1')
@@ -127,6 +160,8 @@ def setup_server(config):
         click.echo('Error: unix socket not found. Is it node started?')
     except ConnectionRefusedError:
         click.echo('Error: node not started yet. Abort.')
+    except ValueError as e:
+        click.echo('Error: %s.' % e)
 
     sys.exit(1)
 
@@ -137,8 +172,10 @@ class AliasedGroup(click.Group):
         return """Ethereum Core proxy v0.1
 
 Usage:
-  ethereum-cli [options] <command> [params]  Send command to Ethereum Core proxy
-  ethereum-cli [options] -named <command> [name=value] ... Send command to Ethereum Core proxy (with named arguments)
+  ethereum-cli [options] <command> [params]
+       Send command to Ethereum Core proxy
+  ethereum-cli [options] -named <command> [name=value] ...
+       Send command to Ethereum Core proxy (with named arguments)
   ethereum-cli [options] help                List commands
   ethereum-cli [options] help <command>      Get help for a command
 
@@ -173,22 +210,19 @@ Options:
         def _rpc_result(ctx, params):
             conf = ctx.parent.params['conf']
             try:
-                response = requests.post(
-                    'http://%s:%s' % (conf['ethpconnect'], conf['ethpport']),
-                    data=json.dumps({
-                        'id': 'ethereum-cli',
-                        'method': cmd_name,
-                        'params': params,
-                    })
-                )
-            except requests.exceptions.ConnectionError:
+                response = post_rpc(conf, json.dumps({
+                    'jsonrpc': '2.0',
+                    'id': 'ethereum-cli',
+                    'method': cmd_name,
+                    'params': params,
+                }))
+            except (requests.exceptions.ConnectionError, OSError):
                 click.echo('error: couldn\'t connect to server: '
                            'unknown (code -1)')
                 click.echo('(make sure server is running and you are '
                            'connecting to the correct RPC port)')
                 return
             else:
-                response = response.json()
                 if response['error']:
                     error = response['error']
                     click.echo('error code: %s' % error['code'])
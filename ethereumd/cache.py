@@ -0,0 +1,310 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from .codec import dumps, RawJSON
+from .utils import hex_to_dec
+
+
+class BlockCache:
+    """Bounded LRU cache of blocks by hash and by height.
+
+    A block fetched by hash never changes, so hash entries only leave the
+    cache on LRU eviction. The height index is what a reorg can rewrite:
+    heights deeper than ``depth`` confirmations are treated as immutable,
+    recent ones are dropped on every head change.
+
+    Cached blocks are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, maxsize=1024, depth=12):
+        self._log = logging.getLogger('block-cache')
+        self._maxsize = maxsize
+        self._depth = depth
+        self._blocks = OrderedDict()
+        self._heights = {}
+        self._head = (None, None)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def head(self):
+        return self._head[0]
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._blocks),
+            'maxsize': self._maxsize,
+            'depth': self._depth,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def is_final(self, height):
+        if self.head is None:
+            return False
+        return self.head - height >= self._depth
+
+    def get_by_hash(self, bhash, tx_objects=True):
+        block = self._lookup((bhash, tx_objects))
+        if block is None and not tx_objects:
+            full = self._lookup((bhash, True))
+            if full is not None:
+                block = dict(full, transactions=[
+                    tr['hash'] for tr in full['transactions']])
+        if block is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return block
+
+    def get_by_number(self, height, tx_objects=True):
+        bhash = self._heights.get(height)
+        if bhash is None:
+            self.misses += 1
+            return None
+        return self.get_by_hash(bhash, tx_objects)
+
+    def put(self, block, tx_objects=True, canonical=False):
+        """Store block, ``canonical`` marks that it was fetched by height
+        and may back the height index.
+        """
+        if not block or not block.get('hash') or not block.get('number'):
+            # pending blocks have neither hash nor number yet
+            return
+        key = (block['hash'], tx_objects)
+        self._blocks[key] = block
+        self._blocks.move_to_end(key)
+        if canonical:
+            self._heights[hex_to_dec(block['number'])] = block['hash']
+        while len(self._blocks) > self._maxsize:
+            (bhash, _), evicted = self._blocks.popitem(last=False)
+            height = hex_to_dec(evicted['number'])
+            if self._heights.get(height) == bhash:
+                del self._heights[height]
+
+    def set_head(self, height, bhash=None):
+        """Move head, recent heights are forgotten when it changes.
+        """
+        prev_height, prev_hash = self._head
+        if height == prev_height and (bhash is None or bhash == prev_hash):
+            return
+        if prev_height is not None and (
+            height < prev_height or
+            (height == prev_height and prev_hash is not None)
+        ):
+            self._log.warning('Chain reorg detected at height %s (was %s).',
+                              height, prev_height)
+        self._head = (height, bhash or
+                      (prev_hash if height == prev_height else None))
+        for h in [h for h in self._heights if not self.is_final(h)]:
+            del self._heights[h]
+
+    def clear(self):
+        self._blocks.clear()
+        self._heights.clear()
+
+    def _lookup(self, key):
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+        return block
+
+
+class BalanceCache:
+    """Bounded LRU cache of account balances by address and height.
+
+    Like the height index of :class:`BlockCache`, balances at heights
+    deeper than ``depth`` confirmations never change, recent ones are
+    dropped on every head change.
+    """
+
+    def __init__(self, maxsize=65536, depth=12):
+        self._maxsize = maxsize
+        self._depth = depth
+        self._balances = OrderedDict()
+        self._recent = set()
+        self._head = (None, None)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._balances),
+            'maxsize': self._maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def is_final(self, height):
+        if self._head[0] is None:
+            return False
+        return self._head[0] - height >= self._depth
+
+    def get(self, address, height):
+        key = (address, height)
+        balance = self._balances.get(key)
+        if balance is None:
+            self.misses += 1
+            return None
+        self._balances.move_to_end(key)
+        self.hits += 1
+        return balance
+
+    def put(self, address, height, balance):
+        if not self._maxsize:
+            return
+        key = (address, height)
+        self._balances[key] = balance
+        self._balances.move_to_end(key)
+        if not self.is_final(height):
+            self._recent.add(key)
+        while len(self._balances) > self._maxsize:
+            self._recent.discard(self._balances.popitem(last=False)[0])
+
+    def set_head(self, height, bhash=None):
+        prev_height, prev_hash = self._head
+        if height == prev_height and (bhash is None or bhash == prev_hash):
+            return
+        self._head = (height, bhash or
+                      (prev_hash if height == prev_height else None))
+        for key in self._recent:
+            if not self.is_final(key[1]):
+                self._balances.pop(key, None)
+        self._recent.clear()
+
+    def clear(self):
+        self._balances.clear()
+        self._recent.clear()
+
+
+class ResponseCache:
+    """Bounded LRU cache of serialized results of proxy methods keyed by
+    method name and bound arguments.
+
+    The cache policy of a call (see ``MethodSpec.cache_policy``) decides
+    how long its result is valid: "ttl" for ``ttl`` seconds, "head" while
+    the chain head is the one seen before the call, "confirmed" forever
+    once result confirmations reach ``depth`` (and like "head" before).
+    Confirmations of such results are stored aside and spliced into the
+    bytes on every hit.
+    """
+
+    _CONFIRMATIONS = '@confirmations@'
+
+    def __init__(self, head=None, maxsize=1024, max_bytes=64 * 1024 * 1024,
+                 ttl=1, depth=12, *, loop=None):
+        self._head = head
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._depth = depth
+        self._loop = loop or asyncio.get_event_loop()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self._maxsize,
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def head_state(self):
+        """Snapshot of head to pass to ``put`` of result computed after
+        it was taken.
+        """
+        if self._head is None or not self._head.fresh:
+            return None
+        return self._head.number, self._head.hash
+
+    def get(self, spec, args):
+        """Cached :class:`RawJSON` result or None."""
+        if spec.cache is None or not self._maxsize:
+            return None
+        key = self._key(spec, args)
+        entry = self._entries.get(key) if key is not None else None
+        body = self._render(entry) if entry is not None else None
+        if body is None:
+            if entry is not None:
+                self._evict(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, spec, args, result, head=None):
+        """Serialize ``result`` and cache it if policy allows, ``head``
+        is the ``head_state`` taken before result was computed.
+        """
+        body = RawJSON(dumps(result))
+        key = self._key(spec, args) if self._maxsize else None
+        policy = spec.cache_policy(args)
+        if key is None or policy is None:
+            return body
+        if policy == 'ttl':
+            entry = ('ttl', body, None, self._loop.time() + self._ttl, None)
+        elif head is None:
+            return body
+        elif policy == 'confirmed' and self._is_deep(result):
+            entry = self._deep_entry(result, body, head[0])
+        else:
+            entry = ('head', body, None, head[1], None)
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = entry
+        self._bytes += len(entry[1]) + len(entry[2] or b'')
+        while (len(self._entries) > self._maxsize or
+               self._bytes > self._max_bytes):
+            self._evict(next(iter(self._entries)))
+        return body
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _key(self, spec, args):
+        for arg in args:
+            if not isinstance(arg, (str, int, float, type(None))):
+                return None
+        return (spec.name,) + tuple(args)
+
+    def _is_deep(self, result):
+        if not isinstance(result, dict) or 'confirmations' not in result:
+            return True
+        return result['confirmations'] >= self._depth
+
+    def _deep_entry(self, result, body, head_number):
+        if not isinstance(result, dict) or 'confirmations' not in result:
+            return ('deep', body, None, None, None)
+        marked = dumps(dict(result, confirmations=self._CONFIRMATIONS))
+        prefix, _, suffix = marked.partition(
+            ('"%s"' % self._CONFIRMATIONS).encode('utf-8'))
+        return ('deep', prefix, suffix, head_number, result['confirmations'])
+
+    def _render(self, entry):
+        policy, body, suffix, stamp, confirmations = entry
+        if policy == 'ttl':
+            return body if self._loop.time() < stamp else None
+        if policy == 'head':
+            head = self.head_state()
+            return body if head is not None and head[1] == stamp else None
+        if suffix is None:
+            return body
+        head = self.head_state()
+        if head is None:
+            return None
+        return RawJSON(b'%s%d%s' % (
+            body, confirmations + head[0] - stamp, suffix))
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[1]) + len(entry[2] or b'')
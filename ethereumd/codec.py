@@ -0,0 +1,88 @@
+"""JSON codec shared by server, upstream clients and notifications.
+
+The fastest installed backend of ``BACKENDS`` is used: orjson, ujson or
+the stdlib json. ``dumps`` always returns utf-8 encoded bytes, ``loads``
+accepts bytes or str. Values a native backend refuses to encode, such as
+integers over 64 bits for orjson, are encoded by the stdlib instead.
+"""
+import json
+
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+
+class RawJSON(bytes):
+    """Value serialized in advance, embedded into responses as is."""
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _orjson():
+    import orjson
+    return orjson.dumps, orjson.loads
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False).encode('utf-8')
+    return dumps, ujson.loads
+
+
+def _json():
+    return _stdlib_dumps, _stdlib_loads
+
+
+_LOADERS = {'orjson': _orjson, 'ujson': _ujson, 'json': _json}
+
+name = None
+_dumps = _loads = None
+
+
+def use(backend=None):
+    """Switch to ``backend`` or, if None, to the first installed one.
+    Raises ImportError if the requested backend is not installed.
+    """
+    global name, _dumps, _loads
+    if backend is None or backend == 'auto':
+        for candidate in BACKENDS:
+            try:
+                return use(candidate)
+            except ImportError:
+                continue
+    if backend not in _LOADERS:
+        raise ValueError('Unknown json backend %s' % backend)
+    _dumps, _loads = _LOADERS[backend]()
+    name = backend
+    return name
+
+
+def dumps(obj):
+    try:
+        return _dumps(obj)
+    except (TypeError, OverflowError):
+        if _dumps is _stdlib_dumps:
+            raise
+        return _stdlib_dumps(obj)
+
+
+def loads(data):
+    try:
+        return _loads(data)
+    except ValueError:
+        if _loads is _stdlib_loads:
+            raise
+        # ujson refuses integers over 64 bits
+        return _stdlib_loads(data)
+
+
+use()
@@ -0,0 +1,172 @@
+"""Table of RPC methods compiled once from ``Method.registry``.
+
+Each entry knows the positional and named parameters of its proxy
+method, how to coerce incoming values to the annotated type (or the
+type of the default value) and the method flags. Resolving a call is one
+dict lookup and binding its params never raises, malformed calls are
+answered with bitcoind error codes.
+"""
+import inspect
+import re
+from itertools import zip_longest
+
+from .proxy import EthereumProxy, Method
+
+
+# bitcoind error codes
+RPC_MISC_ERROR = -1
+RPC_TYPE_ERROR = -3
+RPC_INVALID_PARAMS = -32602
+
+# Methods exposed besides the registered ones
+EXTRA_METHODS = ('help',)
+
+_INVALID = object()
+_MISSING = object()
+_INT_RE = re.compile(r'-?\d+\Z')
+_FLOAT_RE = re.compile(r'-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\Z')
+_BOOLS = {'true': True, 'false': False, '1': True, '0': False}
+
+
+def _to_int(value):
+    if type(value) is int:
+        return value
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and _INT_RE.match(value):
+        return int(value)
+    return _INVALID
+
+
+def _to_float(value):
+    if type(value) in (int, float):
+        return value
+    if isinstance(value, str) and _FLOAT_RE.match(value):
+        return float(value)
+    return _INVALID
+
+
+def _to_bool(value):
+    if type(value) is bool:
+        return value
+    if type(value) is int and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        return _BOOLS.get(value.lower(), _INVALID)
+    return _INVALID
+
+
+def _to_str(value):
+    return value if isinstance(value, str) else _INVALID
+
+
+COERCERS = {int: _to_int, float: _to_float, bool: _to_bool, str: _to_str}
+
+
+class Param:
+
+    __slots__ = ('name', 'type', 'coerce', 'default')
+
+    def __init__(self, parameter):
+        self.name = parameter.name
+        self.default = parameter.default
+        type_ = parameter.annotation
+        if type_ is inspect.Parameter.empty:
+            type_ = (type(self.default)
+                     if self.default not in (None, parameter.empty) else None)
+        self.type = type_
+        self.coerce = COERCERS.get(type_)
+
+    @property
+    def required(self):
+        return self.default is inspect.Parameter.empty
+
+
+class MethodSpec:
+    """Compiled signature and flags of one RPC method."""
+
+    __slots__ = ('name', 'params', 'readonly', 'cache', 'concurrency',
+                 '_names', '_required', '_pending')
+
+    def __init__(self, name, func, readonly=True, cache=None, pending=None,
+                 concurrency='parallel'):
+        self.name = name
+        self.params = tuple(
+            Param(p) for p in list(inspect.signature(func).parameters
+                                   .values())[1:])
+        self.readonly = readonly
+        self.cache = cache
+        self.concurrency = concurrency
+        self._names = frozenset(p.name for p in self.params)
+        self._required = sum(1 for p in self.params if p.required)
+        self._pending = ([p.name for p in self.params].index(pending)
+                         if pending is not None else None)
+
+    def cache_policy(self, args):
+        """Cache policy of call with bound ``args``."""
+        if self._pending is not None and self.cache is not None:
+            value = args[self._pending]
+            if isinstance(value, int) and value < 1:
+                return 'ttl'
+        return self.cache
+
+    def _error(self, code, message):
+        return None, {'message': message, 'code': code}
+
+    def bind(self, params):
+        """Return ``(args, None)`` with coerced positional arguments,
+        defaults included so equal calls bind equally, or
+        ``(None, error)`` with JSON-RPC error of malformed ``params``.
+        """
+        if isinstance(params, dict):
+            for name in params:
+                if name not in self._names:
+                    return self._error(RPC_MISC_ERROR, '%s: unknown named '
+                                       'parameter %s' % (self.name, name))
+            values = [params.get(p.name, _MISSING) for p in self.params]
+        elif isinstance(params, list):
+            if not self._required <= len(params) <= len(self.params):
+                expected = ('%s to %s' % (self._required, len(self.params))
+                            if self._required < len(self.params)
+                            else self._required)
+                return self._error(RPC_MISC_ERROR, '%s: expected %s params, '
+                                   'got %s' % (self.name, expected,
+                                               len(params)))
+            values = params
+        else:
+            return self._error(RPC_INVALID_PARAMS,
+                               'Params must be array or object')
+
+        args = []
+        for param, value in zip_longest(self.params, values,
+                                        fillvalue=_MISSING):
+            if value is _MISSING:
+                if param.required:
+                    return self._error(RPC_MISC_ERROR, '%s: missing required '
+                                       'parameter %s' % (self.name,
+                                                         param.name))
+                value = param.default
+            elif param.coerce is not None and not (
+                    value is None and param.default is None):
+                value = param.coerce(value)
+                if value is _INVALID:
+                    return self._error(RPC_TYPE_ERROR, '%s: expected type %s '
+                                       'for %s' % (self.name,
+                                                   param.type.__name__,
+                                                   param.name))
+            args.append(value)
+        return args, None
+
+
+def build_table(proxy_cls=EthereumProxy):
+    """Map every exposed method name to its :class:`MethodSpec`, private
+    helpers of ``proxy_cls`` are never part of it.
+    """
+    table = {}
+    for _, names in Method.get_categories():
+        for name in names:
+            table[name] = MethodSpec(name, getattr(proxy_cls, name),
+                                     **Method._flags.get(name, {}))
+    for name in EXTRA_METHODS:
+        table[name] = MethodSpec(name, getattr(proxy_cls, name))
+    return table
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import deque
+
+from .utils import hex_to_dec
+
+
+class HeadTracker:
+    """Keeps the latest block number, hash and timestamp in memory.
+
+    ``update`` is run periodically next to the Poller. Head-dependent
+    proxy methods answer from the tracker while it is not older than
+    ``max_staleness`` seconds and fall back to a live call otherwise.
+    """
+
+    def __init__(self, proxy, max_staleness=3, *, loop=None):
+        self._log = logging.getLogger('head-tracker')
+        self._proxy = proxy
+        self._max_staleness = max_staleness
+        self._loop = loop or asyncio.get_event_loop()
+        self.number = None
+        self.hash = None
+        self.timestamp = None
+        self._updated_at = None
+
+    @property
+    def fresh(self):
+        return (self._updated_at is not None and
+                self._loop.time() - self._updated_at <= self._max_staleness)
+
+    @property
+    def stats(self):
+        return {
+            'number': self.number,
+            'hash': self.hash,
+            'timestamp': self.timestamp,
+            'fresh': self.fresh,
+        }
+
+    def set_block(self, block):
+        number = hex_to_dec(block['number'])
+        if number != self.number or block['hash'] != self.hash:
+            self._log.debug('New head %s: %s', number, block['hash'])
+        self.number = number
+        self.hash = block['hash']
+        self.timestamp = hex_to_dec(block['timestamp'])
+        self._updated_at = self._loop.time()
+
+    async def update(self):
+        # proxy feeds fetched latest block back through set_block
+        await self._proxy._get_block_by_number(tx_objects=False)
+
+
+class RecentHeaders:
+    """Ring buffer of the last ``size`` headers seen by the Poller.
+
+    Every added block must extend the newest header through its parent
+    hash. When it does not, headers at its height and above, and the
+    one it should have pointed to, are orphaned and returned to caller.
+    Wallet transactions recorded with a header are returned with it.
+    """
+
+    def __init__(self, size=128):
+        self._headers = deque(maxlen=size)
+        self.reorgs = 0
+        self.orphaned = 0
+
+    def __contains__(self, bhash):
+        return any(h[1] == bhash for h in self._headers)
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._headers),
+            'maxsize': self._headers.maxlen,
+            'reorgs': self.reorgs,
+            'orphaned': self.orphaned,
+        }
+
+    def add(self, block, txids=()):
+        """Append block, returns list of ``(hash, txids)`` for orphaned
+        headers, newest first.
+        """
+        height = hex_to_dec(block['number'])
+        orphaned = []
+        while self._headers and self._headers[-1][0] >= height:
+            orphaned.append(self._headers.pop())
+        if (self._headers and self._headers[-1][0] == height - 1 and
+                self._headers[-1][1] != block['parentHash']):
+            orphaned.append(self._headers.pop())
+        self._headers.append((height, block['hash'], block['parentHash'],
+                              tuple(txids)))
+        if orphaned:
+            self.reorgs += 1
+            self.orphaned += len(orphaned)
+        return [(bhash, txids) for _, bhash, _, txids in orphaned]
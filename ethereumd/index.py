@@ -0,0 +1,145 @@
+import logging
+import sqlite3
+
+from . import codec
+from .utils import hex_to_dec
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    height INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    txid TEXT PRIMARY KEY,
+    height INTEGER NOT NULL,
+    blocktime INTEGER NOT NULL,
+    from_address TEXT,
+    to_address TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_height
+    ON transactions (height);
+CREATE INDEX IF NOT EXISTS transactions_from
+    ON transactions (from_address);
+CREATE INDEX IF NOT EXISTS transactions_to
+    ON transactions (to_address);
+"""
+
+
+class TransactionIndex:
+    """On-disk index of wallet transactions backed by sqlite.
+
+    Every block is written in a single sqlite transaction together with
+    the last indexed height, so after a crash the index resumes from the
+    last block it fully stored. Only the hashes of the last ``keep``
+    blocks are kept for walking back on reorgs.
+    """
+
+    def __init__(self, path, start_height=None, keep=1024):
+        self._log = logging.getLogger('txindex')
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._keep = keep
+        if start_height is not None and self.start_height is None:
+            self.reset(start_height)
+
+    @property
+    def start_height(self):
+        return self._get_meta('start_height')
+
+    @property
+    def height(self):
+        """Last indexed height.
+        """
+        return self._get_meta('height')
+
+    @property
+    def hash(self):
+        """Hash of last indexed block.
+        """
+        return self.block_hash(self.height)
+
+    def block_hash(self, height):
+        row = self._db.execute('SELECT hash FROM blocks WHERE height = ?',
+                               (height,)).fetchone()
+        return row['hash'] if row else None
+
+    def covers(self, height):
+        start_height = self.start_height
+        return start_height is not None and start_height <= height
+
+    def add_block(self, block, transactions):
+        """Store wallet ``transactions`` of ``block`` and move index to it.
+        """
+        height = hex_to_dec(block['number'])
+        blocktime = hex_to_dec(block['timestamp'])
+        with self._db:
+            self._db.execute('DELETE FROM transactions WHERE height >= ?',
+                             (height,))
+            self._db.executemany(
+                'INSERT OR REPLACE INTO transactions '
+                '(txid, height, blocktime, from_address, to_address, data) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                ((tr['hash'], height, blocktime, tr['from'], tr['to'],
+                  codec.dumps(tr).decode('utf-8')) for tr in transactions))
+            self._db.execute('INSERT OR REPLACE INTO blocks (height, hash) '
+                             'VALUES (?, ?)', (height, block['hash']))
+            self._db.execute('DELETE FROM blocks WHERE height <= ?',
+                             (height - self._keep,))
+            self._set_meta('height', height)
+
+    def rollback(self, height):
+        """Forget everything indexed above ``height``.
+        """
+        with self._db:
+            self._db.execute('DELETE FROM transactions WHERE height > ?',
+                             (height,))
+            self._db.execute('DELETE FROM blocks WHERE height > ?',
+                             (height,))
+            self._set_meta('height', height)
+
+    def reset(self, start_height):
+        """Drop whole index and start it again from ``start_height``.
+        """
+        with self._db:
+            self._db.execute('DELETE FROM transactions')
+            self._db.execute('DELETE FROM blocks')
+            self._set_meta('start_height', start_height)
+            self._set_meta('height', start_height - 1)
+
+    def get(self, txid):
+        row = self._db.execute(
+            'SELECT data FROM transactions WHERE txid = ?',
+            (txid,)).fetchone()
+        return codec.loads(row['data']) if row else None
+
+    def since(self, height, until):
+        """Yield ``(transaction, blocktime)`` for heights in
+        ``(height, until]`` ordered as in chain.
+        """
+        cursor = self._db.execute(
+            'SELECT data, blocktime FROM transactions '
+            'WHERE height > ? AND height <= ? ORDER BY height, rowid',
+            (height, until))
+        for row in cursor:
+            yield codec.loads(row['data']), row['blocktime']
+
+    def close(self):
+        self._db.close()
+
+    def _get_meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?',
+                               (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO meta (key, value) '
+                         'VALUES (?, ?)', (key, value))
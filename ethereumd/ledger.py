@@ -0,0 +1,66 @@
+import logging
+
+from .utils import hex_to_dec
+
+
+class BalanceLedger:
+    """Balances of wallet accounts in wei as of one block, kept in memory.
+
+    The ledger is filled once by ``reset`` with balances of every
+    account, after that each next block only needs balances of accounts
+    returned by ``touched``: senders and receivers of its transactions,
+    its miner and accounts added to the wallet since.
+
+    Transfers made by contracts (internal transactions) don't show up
+    in block transactions, balances they change stay stale until the
+    next ``reset``.
+    """
+
+    def __init__(self):
+        self._log = logging.getLogger('balance-ledger')
+        self.balances = {}
+        self.height = None
+        self.hash = None
+        self.loads = 0
+        self.updates = 0
+
+    @property
+    def stats(self):
+        return {
+            'accounts': len(self.balances),
+            'height': self.height,
+            'loads': self.loads,
+            'updates': self.updates,
+        }
+
+    def touched(self, block, accounts):
+        """Wallet ``accounts`` whose balance may differ after ``block``."""
+        touched = {block.get('miner')}
+        for tr in block['transactions']:
+            touched.add(tr['from'])
+            touched.add(tr['to'])
+        return [address for address in accounts
+                if address in touched or address not in self.balances]
+
+    def reset(self, block, balances):
+        """Replace all balances by ``balances`` as of ``block``."""
+        self.balances = dict(balances)
+        self.height = hex_to_dec(block['number'])
+        self.hash = block['hash']
+        self.loads += 1
+        self._log.info('Loaded %s balances at block %s.',
+                       len(self.balances), self.height)
+
+    def add_block(self, block, balances, accounts):
+        """Move ledger to ``block`` with refetched ``balances`` of touched
+        accounts, accounts not in ``accounts`` any more are dropped.
+        """
+        self.balances.update(balances)
+        if len(self.balances) != len(accounts):
+            accounts = set(accounts)
+            for address in list(self.balances):
+                if address not in accounts:
+                    del self.balances[address]
+        self.height = hex_to_dec(block['number'])
+        self.hash = block['hash']
+        self.updates += len(balances)
@@ -0,0 +1,126 @@
+import json
+import logging
+import logging.handlers
+import queue
+
+from . import metrics
+
+
+PLAIN_FORMAT = ('[%(asctime)s %(levelname)s %(process)d %(name)s - '
+                '%(module)s:%(funcName)s:%(lineno)d] %(message)s')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, traceback goes to ``exc`` field."""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'pid': record.process,
+            'logger': record.name,
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts records to bounded queue without waiting, records which
+    don't fit are counted and dropped.
+
+    Only message arguments are merged on the caller thread, formatting
+    and tracebacks are rendered by handlers of the listener thread.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # wait for room, records before the sentinel are still written
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Root logger setup writing to ``fname`` in ``fmt`` ("plain" or
+    "json") without colors.
+
+    With ``queue_size`` the file is written by a background thread
+    which has to be started with ``start`` once the process won't fork
+    any more. ``max_bytes`` rotates the file keeping ``backups`` old
+    ones, zero disables rotation.
+    """
+
+    def __init__(self, level=logging.WARNING,
+                 fname='/tmp/ethereumd-proxy.log', fmt='plain',
+                 queue_size=10000, max_bytes=10485760, backups=5):
+        if fmt not in ('plain', 'json'):
+            raise ValueError('Unknown log format %s' % fmt)
+        self.handler = logging.handlers.RotatingFileHandler(
+            fname, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.handler.setFormatter(JsonFormatter() if fmt == 'json'
+                                  else logging.Formatter(PLAIN_FORMAT))
+        self.handler.setLevel(level)
+        self._queue_handler = None
+        self._listener = None
+        if queue_size:
+            q = queue.Queue(queue_size)
+            self._queue_handler = DroppingQueueHandler(q)
+            self._queue_handler.setLevel(level)
+            self._listener = _Listener(q, self.handler,
+                                       respect_handler_level=True)
+        self._level = level
+        metrics.gauge('ethereumd_log_records_dropped',
+                      'Log records dropped because log queue was full.',
+                      lambda: self.dropped)
+
+    @property
+    def dropped(self):
+        return self._queue_handler.dropped if self._queue_handler else 0
+
+    @property
+    def stats(self):
+        return {
+            'queued': self._queue_handler is not None,
+            'queue': (self._queue_handler.queue.qsize()
+                      if self._queue_handler else 0),
+            'dropped': self.dropped,
+        }
+
+    def install(self):
+        """Replace handlers of root logger by this pipeline."""
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+            handler.close()
+        root.addHandler(self._queue_handler or self.handler)
+        root.setLevel(self._level)
+        return self
+
+    def start(self):
+        if self._listener is not None and self._listener._thread is None:
+            self._listener.start()
+
+    def stop(self):
+        if self._listener is not None and self._listener._thread is not None:
+            self._listener.stop()
+        self.handler.close()
@@ -0,0 +1,163 @@
+import asyncio
+from bisect import bisect_left
+
+
+# Latency buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs)
+
+
+class Counter:
+
+    type = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self._labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        for labels, value in self._values.items():
+            yield '%s%s %s' % (self.name,
+                               _format_labels(self._labels, labels), value)
+
+
+class Histogram:
+    """Histogram with fixed buckets. Observations only bump one slot,
+    buckets are made cumulative when exposed.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self._labels = tuple(labels)
+        self._buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, *labels):
+        slots = self._values.get(labels)
+        if slots is None:
+            # per bucket counts, +Inf and sum
+            slots = self._values[labels] = [0] * (len(self._buckets) + 2)
+        slots[bisect_left(self._buckets, value)] += 1
+        slots[-1] += value
+
+    def count(self, *labels):
+        slots = self._values.get(labels)
+        return sum(slots[:-1]) if slots else 0
+
+    def collect(self):
+        for labels, slots in self._values.items():
+            total = 0
+            for bound, count in zip(self._buckets + ('+Inf',), slots):
+                total += count
+                yield '%s_bucket%s %s' % (
+                    self.name,
+                    _format_labels(self._labels, labels, [('le', bound)]),
+                    total)
+            yield '%s_count%s %s' % (
+                self.name, _format_labels(self._labels, labels), total)
+            yield '%s_sum%s %s' % (
+                self.name, _format_labels(self._labels, labels), slots[-1])
+
+
+class Gauge:
+    """Gauge read from ``func`` on exposition, ``func`` returns value or
+    dict of label values to value.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, doc, func, labels=()):
+        self.name = name
+        self.doc = doc
+        self._func = func
+        self._labels = tuple(labels)
+
+    def collect(self):
+        value = self._func()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, v in value.items():
+            yield '%s%s %s' % (self.name,
+                               _format_labels(self._labels, labels), v)
+
+
+class Registry:
+    """Collection of metrics exposed in Prometheus text format.
+
+    Metrics are updated from the event loop thread only, so recording is
+    plain dict arithmetic without locks.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append('# HELP %s %s' % (metric.name, metric.doc))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, doc, labels=()):
+    return REGISTRY.register(Counter(name, doc, labels))
+
+
+def histogram(name, doc, labels=(), buckets=BUCKETS):
+    return REGISTRY.register(Histogram(name, doc, labels, buckets))
+
+
+def gauge(name, doc, func, labels=()):
+    return REGISTRY.register(Gauge(name, doc, func, labels))
+
+
+LOOP_LAG = histogram('ethereumd_event_loop_lag_seconds',
+                     'Delay of event loop wake-ups past their deadline.')
+
+
+async def monitor_loop_lag(interval=1, *, loop=None):
+    """Sleep ``interval`` seconds forever and record how late the loop
+    woke up.
+    """
+    loop = loop or asyncio.get_event_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval, loop=loop)
+        LOOP_LAG.observe(max(loop.time() - started - interval, 0))
@@ -1,8 +1,19 @@
 import asyncio
 import logging
 import functools
+from collections import deque
 
-from aioethereum.errors import BadResponseError
+from aioethereum.errors import BadResponseError, BadJsonError
+
+from . import codec, metrics
+from .head import RecentHeaders
+from .sinks import create_sink
+from .utils import hex_to_dec
+
+
+NOTIFY_LATENCY = metrics.histogram(
+    'ethereumd_notification_seconds',
+    'Time taken by notification sinks by notification.', ['notification'])
 
 
 def alertnotify(func_or_none=None, *, exceptions=(Exception,)):
@@ -20,15 +31,7 @@ def alertnotify(func_or_none=None, *, exceptions=(Exception,)):
                 return await func(self, *args, **kwargs)
             except exceptions as e:
                 err_msg = 'Error from: %s' % e
-                cmd = self._cmds['alertnotify'] % err_msg
-                cmdp = await asyncio.create_subprocess_exec(
-                    *cmd.split(),
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.STDOUT
-                )
-                stdout, _ = await cmdp.communicate()
-                if stdout:
-                    logging.warning('ALERTNOTIFY: %s', stdout)
+                await self._sinks['alertnotify'].send('alertnotify', err_msg)
                 logging.warning('Send alertnotify error msg "%s"', err_msg)
         return wrapper
 
@@ -44,17 +47,35 @@ class Poller:
         'pending': 'eth_newPendingTransactionFilter',
     }
 
-    def __init__(self, proxy, cmds=None, *, loop=None):
+    def __init__(self, proxy, cmds=None, *, workers=1, timeout=None,
+                 batch_size=100, batch_delay=0, reorg_buffer=128,
+                 max_pending=100, loop=None):
         self._log = logging.getLogger('poller')
         self._proxy = proxy
         self._rpc = proxy._rpc
         self._cmds = cmds or {}
         self._loop = loop or asyncio.get_event_loop()
+        self._sinks = {
+            name: create_sink(spec, timeout, batch_size, batch_delay,
+                              loop=self._loop)
+            for name, spec in self._cmds.items()
+        }
         self._queue = {
             'default': asyncio.Queue(maxsize=100, loop=self._loop)
         }
-        self._ctask = asyncio.ensure_future(self.poll(),
-                                            loop=self._loop)
+        self._blocks = 0
+        self._block_calls = 0
+        self._headers = RecentHeaders(reorg_buffer)
+        self._reorg_buffer = reorg_buffer
+        # last notified height, blocks missed after it are notified too
+        self.height = None
+        self._keys = {}
+        self._max_pending = max_pending
+        self._dropped = 0
+        self._inflight = 0
+        self._latency = {}
+        self._ctasks = [asyncio.ensure_future(self.poll(), loop=self._loop)
+                        for _ in range(workers)]
 
     @property
     def has_blocknotify(self):
@@ -68,50 +89,314 @@ class Poller:
     def has_alertnotify(self):
         return bool(self._cmds.get('alertnotify', False))
 
+    @property
+    def has_rollbacknotify(self):
+        return bool(self._cmds.get('rollbacknotify', False))
+
+    @property
+    def has_txindex(self):
+        return self._proxy._index is not None
+
+    @property
+    def stats(self):
+        return {
+            'blocks': self._blocks,
+            'height': self.height,
+            'upstream_calls': self._block_calls,
+            'upstream_calls_per_block': (
+                self._block_calls / self._blocks if self._blocks else 0),
+            'workers': len(self._ctasks),
+            'queue': self.defqueue.qsize(),
+            'pending': sum(len(pending) for pending in self._keys.values()),
+            'dropped': self._dropped,
+            'inflight': self._inflight,
+            'headers': self._headers.stats,
+            'latency': {
+                name: {
+                    'count': count,
+                    'avg': total / count,
+                    'max': max_,
+                } for name, (count, total, max_) in self._latency.items()
+            },
+        }
+
     def stop(self):
-        self._ctask.cancel()
+        for task in self._ctasks:
+            task.cancel()
+        for sink in self._sinks.values():
+            sink.close()
 
     @property
     def defqueue(self):
         return self._queue['default']
 
     async def poll(self):
+        """Notification worker, several of them share default queue.
+        Notifications with the same key are run in order they were queued:
+        while one runs, later ones wait in pending deque of its key and
+        are run next by the same worker, other workers stay free. A deque
+        holds at most ``max_pending`` notifications, the oldest one is
+        dropped for a new one, so a slow command skips old blocks.
+        """
         while True:
-            coro = await self.defqueue.get()
+            name, key, coro = await self.defqueue.get()
+            if key is not None:
+                if key in self._keys:
+                    pending = self._keys[key]
+                    if len(pending) >= self._max_pending:
+                        dropped, old = pending.popleft()
+                        old.close()
+                        self._dropped += 1
+                        self._log.warning('%s notification dropped, %s '
+                                          'are pending.', dropped,
+                                          len(pending))
+                    pending.append((name, coro))
+                    continue
+                self._keys[key] = deque()
+            while True:
+                await self._run(name, coro)
+                if key is None:
+                    break
+                pending = self._keys[key]
+                if not pending:
+                    del self._keys[key]
+                    break
+                name, coro = pending.popleft()
+
+    async def _notify(self, cmd_name, data, key=None):
+        await self.defqueue.put((cmd_name, key,
+                                 self._exec_command(cmd_name, data)))
+
+    async def _run(self, name, coro):
+        self._inflight += 1
+        started = self._loop.time()
+        try:
             await coro
+        except Exception as e:
+            self._log.error('%s notification failed.', name)
+            self._log.exception(e)
+        finally:
+            self._inflight -= 1
+            elapsed = self._loop.time() - started
+            NOTIFY_LATENCY.observe(elapsed, name)
+            count, total, max_ = self._latency.get(name, (0, 0, 0))
+            self._latency[name] = (count + 1, total + elapsed,
+                                   max(max_, elapsed))
+
+    def start(self, min_interval=0.1, max_interval=1):
+        """Start following new blocks and transactions for configured
+        notifications.
+        """
+        if (self.has_blocknotify or self.has_walletnotify or
+                self.has_rollbacknotify):
+            self._ctasks.append(asyncio.ensure_future(
+                self.follow(min_interval, max_interval), loop=self._loop))
+
+    async def follow(self, min_interval=0.1, max_interval=1):
+        """Receive pushed heads and pending transactions over IPC
+        subscription, fall back to adaptive polling of filters when node
+        does not support them.
+        """
+        if self._rpc.unix_path is not None:
+            try:
+                return await self.subscribe(max_interval)
+            except BadResponseError as e:
+                self._log.warning('Subscriptions are not supported (%s), '
+                                  'poll filters instead.', e)
+
+        jobs = []
+        if self.has_blocknotify or self.has_rollbacknotify:
+            jobs.append(self.watch(self.blocknotify, min_interval,
+                                   max_interval))
+        if self.has_walletnotify:
+            jobs.append(self.watch(self.walletnotify, min_interval,
+                                   max_interval))
+        await asyncio.gather(*jobs, loop=self._loop)
+
+    async def watch(self, job, min_interval=0.1, max_interval=1):
+        """Run ``job`` every ``min_interval`` seconds while it finds
+        something, interval doubles up to ``max_interval`` while idle.
+        """
+        interval = min_interval
+        while True:
+            try:
+                found = await job()
+            except Exception as e:
+                self._log.exception(e)
+                found = 0
+            if found:
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+            await asyncio.sleep(interval, loop=self._loop)
+
+    async def subscribe(self, retry_interval=1):
+        """Follow ``newHeads`` and ``newPendingTransactions`` over own
+        IPC connection, reconnecting after it is lost.
+        """
+        topics = {}
+        if self.has_blocknotify or self.has_rollbacknotify:
+            topics['newHeads'] = self._on_head
+        if self.has_walletnotify:
+            topics['newPendingTransactions'] = self._on_pending
+        while True:
+            try:
+                await self._subscribe(topics)
+            except (ConnectionError, OSError, BadJsonError) as e:
+                self._log.warning('Subscription connection lost: %s', e)
+            await asyncio.sleep(retry_interval, loop=self._loop)
+
+    async def _subscribe(self, topics):
+        reader, writer = await asyncio.open_unix_connection(
+            self._rpc.unix_path, loop=self._loop)
+        try:
+            handlers = {}
+            for i, (topic, handler) in enumerate(topics.items()):
+                writer.write(codec.dumps({
+                    'jsonrpc': '2.0',
+                    'id': i,
+                    'method': 'eth_subscribe',
+                    'params': [topic],
+                }) + b'\n')
+                response = await self._read_message(reader)
+                if 'error' in response:
+                    raise BadResponseError(response['error']['message'],
+                                           response['error']['code'])
+                handlers[response['result']] = handler
+            self._log.info('Subscribed to %s', ', '.join(topics))
+
+            while True:
+                message = await self._read_message(reader)
+                params = message.get('params') or {}
+                handler = handlers.get(params.get('subscription'))
+                if handler is None:
+                    continue
+                try:
+                    await handler(params['result'])
+                except Exception as e:
+                    self._log.exception(e)
+        finally:
+            writer.close()
+
+    async def _read_message(self, reader):
+        b = await reader.readline()
+        if not b:
+            raise ConnectionError('Subscription connection closed.')
+        try:
+            return codec.loads(b)
+        except ValueError:
+            raise BadJsonError('Invalid received json from node.')
+
+    @alertnotify(exceptions=(ConnectionError, TimeoutError, BadResponseError))
+    async def _on_head(self, header):
+        self._proxy._set_head(header)
+        return await self._process_blocks([header['hash']])
+
+    @alertnotify(exceptions=(ConnectionError, TimeoutError, BadResponseError))
+    async def _on_pending(self, txid):
+        return await self._process_transactions([txid])
 
     @alertnotify(exceptions=(ConnectionError, BadResponseError))
     async def blocknotify(self):
         bhashes = await self._poll_with_reconnect('latest')
+        return await self._process_blocks(bhashes)
+
+    async def _process_blocks(self, bhashes):
         if not bhashes:
-            return
+            return 0
         self._log.info('New blocks: %s', bhashes)
-        accounts = await self._rpc.eth_accounts()
-        for bhash in bhashes:
-            block = await self._rpc.eth_getBlockByHash(bhash, False)
-            for txid in block['transactions']:
-                if (await self._is_account_trans(txid, accounts)):
-                    await self.defqueue \
-                        .put(self._exec_command('walletnotify', txid))
-                    break
+        accounts = set(await self._rpc.eth_accounts())
+        # filter changes and accounts
+        self._block_calls += 2
+        blocks = await self._get_blocks(bhashes)
+        bhashes, blocks = await self._fill_gap(bhashes, blocks)
+        for bhash, block in zip(bhashes, blocks):
+            if block is None:
+                self._log.warning('Block %s not found', bhash)
+                continue
+            self._blocks += 1
+            txids = [tr['hash'] for tr in block['transactions']
+                     if tr['from'] in accounts or tr['to'] in accounts]
+            if txids:
+                self._log.info('Found account transaction %s', txids[0])
+                await self._notify('walletnotify', txids[0], key=txids[0])
+            for orphan, orphan_txids in self._headers.add(block, txids):
+                self._log.warning('Block %s orphaned by %s', orphan, bhash)
+                if self.has_rollbacknotify:
+                    await self._notify('rollbacknotify',
+                                       ' '.join((orphan,) + orphan_txids),
+                                       key='blocknotify')
             self._log.info('Block: %s' % bhash)
-            await self.defqueue.put(self._exec_command('blocknotify', bhash))
+            self.height = hex_to_dec(block['number'])
+            if self.has_blocknotify:
+                await self._notify('blocknotify', bhash, key='blocknotify')
+        if self.has_txindex:
+            await self._proxy._index_blocks(
+                [block for block in blocks if block is not None])
+        if self._proxy._ledger is not None:
+            await self._proxy._sync_ledger()
+        return len(bhashes)
+
+    async def _fill_gap(self, bhashes, blocks):
+        """Prepend blocks between last notified height and the first of
+        ``blocks``, which were mined while filter was recreated or before
+        this worker took over notifications. At most ``reorg_buffer``
+        blocks are caught up.
+        """
+        heights = [hex_to_dec(block['number'])
+                   for block in blocks if block is not None]
+        if self.height is None or not heights or \
+                min(heights) <= self.height + 1:
+            return bhashes, blocks
+        start = max(self.height + 1, min(heights) - self._reorg_buffer)
+        fetched = await asyncio.gather(*(
+            self._proxy._get_block_by_number(height)
+            for height in range(start, min(heights))), loop=self._loop)
+        missed = [block for block in fetched if block is not None]
+        self._block_calls += len(missed)
+        self._log.warning('Notifying %s blocks missed after height %s.',
+                          len(missed), self.height)
+        return ([block['hash'] for block in missed] + list(bhashes),
+                missed + list(blocks))
+
+    async def _get_blocks(self, bhashes):
+        """Get blocks with transaction objects, not cached ones are
+        fetched concurrently.
+        """
+        cache = self._proxy._cache
+        blocks = [cache.get_by_hash(bhash) for bhash in bhashes]
+        missing = [i for i, block in enumerate(blocks) if block is None]
+        fetched = await asyncio.gather(*(
+            self._rpc.eth_getBlockByHash(bhashes[i]) for i in missing))
+        self._block_calls += len(missing)
+        for i, block in zip(missing, fetched):
+            cache.put(block)
+            blocks[i] = block
+        return blocks
 
     @alertnotify(exceptions=(ConnectionError, TimeoutError, BadResponseError))
     async def walletnotify(self):
         txids = await self._poll_with_reconnect('pending')
+        return await self._process_transactions(txids)
+
+    async def _process_transactions(self, txids):
         if not txids:
-            return
+            return 0
         self._log.info('New transactions: %s', txids)
-        accounts = await self._rpc.eth_accounts()
+        accounts = set(await self._rpc.eth_accounts())
 
         async def _tr_sender(txid):
             if (await self._is_account_trans(txid, accounts)):
                 self._log.info('Trans: %s' % txid)
-                await self.defqueue \
-                    .put(self._exec_command('walletnotify', txid))
+                await self._notify('walletnotify', txid, key=txid)
 
         await asyncio.gather(*(_tr_sender(txid) for txid in txids))
+        return len(txids)
+
+    @alertnotify(exceptions=(ConnectionError, TimeoutError, BadResponseError))
+    async def indexblocks(self):
+        height = await self._proxy._sync_index()
+        self._log.debug('Transaction index synced to %s', height)
 
     async def _is_account_trans(self, txid, accounts=None):
         accounts = accounts or (await self._rpc.eth_accounts())
@@ -132,23 +417,13 @@ class Poller:
 
     async def _exec_command(self, cmd_name, data):
         try:
-            cmd = self._cmds[cmd_name] % data
+            sink = self._sinks[cmd_name]
         except KeyError:
-            cmd = None
             self._log.warning('%s command not found', cmd_name)
-
-        if not cmd:
             return False
 
         try:
-            cmdp = await asyncio.create_subprocess_exec(
-                *cmd.split(),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.STDOUT
-            )
-            stdout, _ = await cmdp.communicate()
-            if stdout:
-                self._log.warning('%s: %s', cmd_name.upper(), stdout)
+            await sink.send(cmd_name, data)
         except Exception as e:
             self._log.error('%s command exec error.', cmd_name)
             self._log.exception(e)
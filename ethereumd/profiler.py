@@ -0,0 +1,94 @@
+import asyncio
+import marshal
+import os
+import sys
+import time
+from collections import Counter
+
+
+def _current_task(loop):
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task(loop)
+    return asyncio.Task.current_task(loop)
+
+
+class SamplingProfiler:
+    """Statistical profiler of the event loop thread.
+
+    ``run`` is called from another thread and samples the loop thread
+    stack every ``interval`` seconds, so the profiled code is never
+    traced. Each stack is rooted at the coroutine of the task which was
+    running, idle loop time shows up without task root.
+    """
+
+    def __init__(self, thread_id, interval=0.005, *, loop=None):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._loop = loop
+        self._samples = Counter()
+        self.count = 0
+
+    def run(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._sample(frame)
+            del frame
+            time.sleep(self._interval)
+
+    def _sample(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno,
+                          code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        task = _current_task(self._loop) if self._loop else None
+        coro = getattr(task, '_coro', None)
+        name = getattr(coro, '__qualname__', None)
+        self._samples[(name, tuple(stack))] += 1
+        self.count += 1
+
+    def collapsed(self):
+        """Stacks in collapsed format accepted by flamegraph.pl and
+        speedscope, one ``frame;frame;... count`` line per stack.
+        """
+        lines = []
+        for (task, stack), count in self._samples.most_common():
+            frames = ['%s (%s:%d)' % (name, os.path.basename(filename),
+                                      lineno)
+                      for filename, lineno, name in stack]
+            if task is not None:
+                frames.insert(0, 'task %s' % task)
+            lines.append('%s %d' % (';'.join(frames), count))
+        return '\n'.join(lines) + '\n'
+
+    def pstats(self):
+        """Marshalled stats readable by ``pstats.Stats``, times are
+        sample counts multiplied by interval. Tasks are pseudo functions
+        calling the sampled stacks.
+        """
+        stats = {}
+
+        def entry(func):
+            if func not in stats:
+                stats[func] = [0, 0, 0.0, 0.0, {}]
+            return stats[func]
+
+        for (task, stack), count in self._samples.items():
+            if task is not None:
+                stack = (('~', 0, 'task %s' % task),) + stack
+            elapsed = count * self._interval
+            entry(stack[-1])[2] += elapsed
+            for func in set(stack):
+                e = entry(func)
+                e[0] += count
+                e[1] += count
+                e[3] += elapsed
+            for caller, callee in set(zip(stack, stack[1:])):
+                callers = entry(callee)[4]
+                cc, nc, tt, ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (cc + count, nc + count, tt, ct + elapsed)
+        return marshal.dumps({func: tuple(e) for func, e in stats.items()})
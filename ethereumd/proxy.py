@@ -7,6 +7,10 @@ from enum import IntEnum
 from aioethereum import create_ethereum_client
 from aioethereum.errors import BadResponseError
 
+from .cache import BlockCache, BalanceCache
+from .index import TransactionIndex
+from .ledger import BalanceLedger
+from .upstream import UpstreamClient, UpstreamNode, UpstreamPool
 from .utils import hex_to_dec, wei_to_ether, ether_to_gwei, ether_to_wei
 
 
@@ -28,12 +32,30 @@ class Category(IntEnum):
 
 class Method:
     _r = {}
+    _flags = {}
 
     @classmethod
-    def registry(cls, category):
+    def registry(cls, category, *, readonly=True, cache=None,
+                 pending=None, concurrency='parallel'):
+        """Expose decorated proxy method over RPC. ``readonly`` methods
+        don't change node state. ``cache`` is the policy of cached
+        responses: "head" until chain head changes, "ttl" for a few
+        seconds, "confirmed" forever once the result has enough
+        confirmations (until new head before that). ``pending`` names
+        the parameter whose value below one asks for pending state,
+        which changes between heads, such calls get "ttl" policy.
+        Methods of one ``concurrency`` class other than "parallel" are
+        executed one at a time.
+        """
         def decorator(fn):
             cls._r.setdefault('category_%s' % int(category), []) \
                 .append(fn.__name__)
+            cls._flags[fn.__name__] = {
+                'readonly': readonly,
+                'cache': cache,
+                'pending': pending,
+                'concurrency': concurrency,
+            }
             return fn
         return decorator
 
@@ -46,8 +68,20 @@ class Method:
 
 class EthereumProxy:
 
-    def __init__(self, rpc):
+    def __init__(self, rpc, cache=None, index=None, ledger=None, *,
+                 scan_chunk_size=100, scan_concurrency=10,
+                 balance_concurrency=10, balance_cache=None):
         self._rpc = rpc
+        self._index = index
+        self._index_lock = None
+        self._ledger = ledger
+        self._ledger_lock = None
+        self._balance_concurrency = balance_concurrency
+        self._balance_cache = balance_cache or BalanceCache()
+        self._scan_chunk_size = scan_chunk_size
+        self._scan_concurrency = scan_concurrency
+        self._cache = cache or BlockCache()
+        self._head = None
         self._log = logging.getLogger('ethereum-proxy')
 
     async def help(self, command=None):
@@ -81,7 +115,7 @@ Result:
         return result
 
     @Method.registry(Category.Util)
-    async def validateaddress(self, address):
+    async def validateaddress(self, address: str):
         """validateaddress "address"
 
 Return information about the given ethereum address.
@@ -134,8 +168,8 @@ Examples:
                 'isvalid': False
             }
 
-    @Method.registry(Category.Wallet)
-    async def listsinceblock(self, blockhash, target_confirmations=1,
+    @Method.registry(Category.Wallet, cache='head')
+    async def listsinceblock(self, blockhash: str, target_confirmations=1,
                              include_watchonly=False):
         """listsinceblock ( "blockhash" target_confirmations include_watchonly)
 
@@ -175,15 +209,14 @@ Examples:
 > ethereum-cli listsinceblock "0x2a7f92d11cf8194f2bc8976e0532a9d7735e60e99e3339cb2316bd4c5b4137ce"
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "listsinceblock", "params": ["0x2a7f92d11cf8194f2bc8976e0532a9d7735e60e99e3339cb2316bd4c5b4137ce"] }'  http://127.0.0.01:9500/
         """
-        # TODO: Optimization??
         # TODO: Correct return data
         if target_confirmations < 1:
             raise BadResponseError('Invalid parameter', code=-8)
         transactions = []
 
         latest_block, from_block, addresses = await asyncio.gather(
-            self._rpc.eth_getBlockByNumber(),
-            self._rpc.eth_getBlockByHash(blockhash),
+            self._get_block_by_number(),
+            self._get_block_by_hash(blockhash),
             self._rpc.eth_accounts()
         )
         if target_confirmations == 1:
@@ -191,7 +224,7 @@ Examples:
         else:
             need_height = hex_to_dec(latest_block['number']) + 1 - \
                 target_confirmations
-            lst_hash = (await self._rpc.eth_getBlockByNumber(need_height))['hash']
+            lst_hash = (await self._get_block_by_number(need_height))['hash']
         if not from_block:
             return {
                 'transactions': transactions,
@@ -201,7 +234,7 @@ Examples:
         start_height = hex_to_dec(from_block['number']) + 1
         end_height = hex_to_dec(latest_block['number'])
 
-        def _fetch_block_transacs(addresses, block, tr):
+        def _fetch_block_transacs(addresses, blocktime, tr):
             category = None
             if tr['from'] in addresses:
                 address = tr['to']
@@ -222,9 +255,9 @@ Examples:
                                       hex_to_dec(tr['blockNumber'])),
                     'blockhash': tr['blockHash'],
                     'blockindex': None,  # TODO
-                    'blocktime': hex_to_dec(block['timestamp']),
+                    'blocktime': blocktime,
                     'txid': tr['hash'],
-                    'time': hex_to_dec(block['timestamp']),
+                    'time': blocktime,
                     'timereceived': None,  # TODO
                     'abandoned': False,  # TODO
                     'comment': None,  # TODO
@@ -232,29 +265,56 @@ Examples:
                     'to': None,  # TODO
                 }
 
-        blocks = [from_block]
-        blocks.extend(filter(lambda b: b is not None,
-                             await asyncio.gather(*(
-                                 self._rpc.eth_getBlockByNumber(height)
-                                 for height in range(start_height,
-                                                     end_height)))))
-        blocks.append(latest_block)
-        for block in blocks:
+        def _filter_transaction(tr, blocktime):
+            if not (
+                tr['to'] in addresses and tr['from'] in addresses
+            ):
+                fetched_tr = _fetch_block_transacs(addresses, blocktime, tr)
+                if fetched_tr:
+                    transactions.append(fetched_tr)
+
+        def _filter_block(block):
+            blocktime = hex_to_dec(block['timestamp'])
             for tr in block['transactions']:
-                if not (
-                    tr['to'] in addresses and tr['from'] in addresses
-                ):
-                    fetched_tr = _fetch_block_transacs(addresses, block, tr)
-                    if fetched_tr:
-                        transactions.append(fetched_tr)
+                _filter_transaction(tr, blocktime)
+
+        semaphore = asyncio.Semaphore(self._scan_concurrency)
+
+        async def _fetch_block(height):
+            with (await semaphore):
+                return await self._get_block_by_number(height)
+
+        _filter_block(from_block)
+        scan_height = start_height
+        if self._index is not None and self._index.covers(start_height):
+            # already indexed part of range is read from disk,
+            # only not yet indexed tail is scanned
+            indexed_height = min(self._index.height, end_height - 1)
+            for tr, blocktime in self._index.since(start_height - 1,
+                                                   indexed_height):
+                _filter_transaction(tr, blocktime)
+            scan_height = max(start_height, indexed_height + 1)
+
+        # scan range by chunks, so only one chunk of blocks is kept
+        # in memory and at most scan_concurrency requests are in flight
+        for chunk_start in range(scan_height, end_height,
+                                 self._scan_chunk_size):
+            chunk_end = min(chunk_start + self._scan_chunk_size, end_height)
+            for block in await asyncio.gather(*(
+                    _fetch_block(height)
+                    for height in range(chunk_start, chunk_end))):
+                if block is not None:
+                    _filter_block(block)
+        _filter_block(latest_block)
 
         return {
             'transactions': transactions,
             'lastblock': lst_hash,
         }
 
-    @Method.registry(Category.Wallet)
-    async def walletpassphrase(self, address, passphrase, timeout):
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def walletpassphrase(self, address: str, passphrase: str,
+                               timeout: int):
         """walletpassphrase "passphrase" timeout
 
 Stores the wallet decryption key in memory for 'timeout' seconds.
@@ -283,8 +343,8 @@ As json rpc call
         return await self._rpc.personal_unlockAccount(address, passphrase,
                                                       timeout)
 
-    @Method.registry(Category.Wallet)
-    async def walletlock(self, address):
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def walletlock(self, address: str):
         """walletlock
 
 Removes the wallet encryption key from memory, locking the wallet.
@@ -304,8 +364,8 @@ As json rpc call
         """
         return await self._rpc.personal_lockAccount(address)
 
-    @Method.registry(Category.Blockchain)
-    async def getblockhash(self, height):
+    @Method.registry(Category.Blockchain, cache='head')
+    async def getblockhash(self, height: int):
         """getblockhash height
 
 Returns hash of block in best-block-chain at height provided.
@@ -323,13 +383,13 @@ Examples:
         if height < 0:
             raise BadResponseError('Block height out of range', code=-8)
 
-        block = await self._rpc.eth_getBlockByNumber(height)
+        block = await self._get_block_by_number(height)
         if block is None:
             raise BadResponseError('Block height out of range', code=-8)
 
         return block['hash']
 
-    @Method.registry(Category.Blockchain)
+    @Method.registry(Category.Blockchain, cache='ttl')
     async def getdifficulty(self):
         """getdifficulty
 
@@ -344,7 +404,7 @@ Examples:
         """
         return await self._rpc.eth_hashrate()
 
-    @Method.registry(Category.Util)
+    @Method.registry(Category.Util, cache='ttl')
     async def estimatefee(self, nblocks=1):
         """estimatefee nblocks
 
@@ -363,8 +423,8 @@ Example:
         gas = await self._paytxfee_to_etherfee()
         return wei_to_ether(gas['gas_amount'] * gas['gas_price'])
 
-    @Method.registry(Category.Wallet)
-    async def getbalance(self, account=None, minconf=1,
+    @Method.registry(Category.Wallet, cache='head', pending='minconf')
+    async def getbalance(self, account: str = None, minconf=1,
                          include_watchonly=True):
         """getbalance ( "account" minconf include_watchonly )
 
@@ -403,22 +463,14 @@ The total amount in the wallet at least 5 blocks confirmed
 As a json rpc call
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "getbalance", "params": ["*", 6] }'  http://127.0.0.01:9500/
         """
-        # NOTE: minconf nt work curently
-        async def _get_balance(address):
-            balance = (await self._rpc.eth_getBalance(address)) or 0
-            if not isinstance(balance, (int, float)):
-                balance = hex_to_dec(balance)
-            return wei_to_ether(balance)
-
-        if account:
-            return await _get_balance(account)
-
-        addresses = await self._rpc.eth_accounts()
-        return sum(await asyncio.gather(*(_get_balance(address)
-                                          for address in addresses)))
-
-    @Method.registry(Category.Wallet)
-    async def settxfee(self, amount):
+        if account and account != '*':
+            balances = await self._get_balances(minconf, [account])
+            return wei_to_ether(balances[account])
+        balances = await self._get_balances(minconf)
+        return sum(wei_to_ether(balance) for balance in balances.values())
+
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def settxfee(self, amount: float):
         """settxfee amount
 
 Set the transaction fee for transactions only. Overwrites the paytxfee parameter.
@@ -443,7 +495,7 @@ Examples:
         else:
             return True
 
-    @Method.registry(Category.Wallet)
+    @Method.registry(Category.Wallet, cache='head', pending='minconf')
     async def listaccounts(self, minconf=1, include_watchonly=True):
         """listaccounts ( minconf include_watchonly)
 
@@ -471,20 +523,12 @@ List account balances for 6 or more confirmations
 As json rpc call
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "listaccounts", "params": [6] }'  http://127.0.0.01:9500/
         """
-        # NOTE: minconf nt work curently
-        addresses = await self._rpc.eth_accounts()
-        accounts = {}
-        for i, address in enumerate(addresses):
-            # account = 'Account #{0}'.format(i)
-            balance = (await self._rpc.eth_getBalance(address)) or 0
-            if not isinstance(balance, (int, float)):
-                balance = hex_to_dec(balance)
-            accounts[address] = wei_to_ether(balance)
+        balances = await self._get_balances(minconf)
+        return {address: wei_to_ether(balance)
+                for address, balance in balances.items()}
 
-        return accounts
-
-    @Method.registry(Category.Wallet)
-    async def gettransaction(self, txid, include_watchonly=False):
+    @Method.registry(Category.Wallet, cache='confirmed')
+    async def gettransaction(self, txid: str, include_watchonly=False):
         """gettransaction "txid" ( include_watchonly )
 
 Get detailed information about in-wallet transaction <txid>
@@ -528,10 +572,15 @@ Examples:
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "gettransaction", "params": ["0xa4cb352eaff243fc962db84c1ab9e180bf97857adda51e2a417bf8015f05def3"] }'  http://127.0.0.01:9500/
         """
         # TODO: Make workable include_watchonly flag
-        transaction, addresses = await asyncio.gather(
-            self._rpc.eth_getTransactionByHash(txid),
-            self._rpc.eth_accounts()
-        )
+        indexed = self._index.get(txid) if self._index is not None else None
+        if indexed is not None:
+            transaction = indexed
+            addresses = await self._rpc.eth_accounts()
+        else:
+            transaction, addresses = await asyncio.gather(
+                self._rpc.eth_getTransactionByHash(txid),
+                self._rpc.eth_accounts()
+            )
         if transaction is None:
             raise BadResponseError('Invalid or non-wallet transaction id',
                                    code=-5)
@@ -551,7 +600,11 @@ Examples:
             'hex': transaction['input'],
             'fee': DEFAUT_FEE,
         }
-        if hex_to_dec(transaction['blockHash']) != 0:
+        if indexed is not None:
+            trans_info['confirmations'] = (
+                await self._get_block_number() -
+                hex_to_dec(transaction['blockNumber']))
+        elif hex_to_dec(transaction['blockHash']) != 0:
             block = await self.getblock(transaction['blockHash'])
             trans_info['confirmations'] = block['confirmations']
         else:
@@ -573,7 +626,11 @@ Examples:
                 'abandoned': False,
                 'fee': DEFAUT_FEE,
             }
-            if hex_to_dec(transaction['blockHash']):
+            if indexed is not None:
+                from_['fee'] = (hex_to_dec(transaction['gasPrice']) *
+                                wei_to_ether(
+                                    hex_to_dec(transaction['gasUsed'])))
+            elif hex_to_dec(transaction['blockHash']):
                 tr_hash, tr_receipt = await asyncio.gather(
                     self._rpc.eth_getTransactionByHash(transaction['hash']),
                     self._rpc.eth_getTransactionReceipt(transaction['hash'])
@@ -584,8 +641,77 @@ Examples:
             trans_info['details'].append(from_)
         return trans_info
 
-    @Method.registry(Category.Wallet)
-    async def getnewaddress(self, passphrase):
+    @Method.registry(Category.Wallet, readonly=False)
+    async def rescanblockchain(self, start_height: int = None):
+        """rescanblockchain ( start_height )
+
+Rescan the local blockchain for wallet related transactions and rebuild
+transaction index from the given height. The index is reset at once and
+rebuilt in background, transactions below the rescanned height are not
+found until it gets there.
+
+Arguments:
+1. start_height    (numeric, optional) Block height where the rescan should start.
+                   Default is the height the transaction index was started from.
+
+Result:
+{
+  "start_height"     (numeric) The block height where the rescan has started.
+  "stop_height"      (numeric) The chain height the rescan runs to.
+}
+
+Examples:
+> ethereum-cli rescanblockchain 100000
+> curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "rescanblockchain", "params": [100000] }'  http://127.0.0.01:9500/
+        """
+        if self._index is None:
+            raise BadResponseError('Transaction index is disabled', code=-4)
+
+        head = await self._get_block_number()
+        if start_height is None:
+            start_height = self._index.start_height
+        if start_height is None:
+            start_height = head
+        if start_height < 0 or start_height > head:
+            raise BadResponseError('Invalid start_height', code=-8)
+
+        with (await self._get_index_lock()):
+            self._index.reset(start_height)
+        return {
+            'start_height': start_height,
+            'stop_height': head,
+        }
+
+    @Method.registry(Category.Wallet, readonly=False)
+    async def refreshbalances(self):
+        """refreshbalances
+
+Reload balances of all wallet accounts from the node. getbalance and
+listaccounts answer from balances kept in memory, which follow only
+transactions and mining of every new block, use this after balances
+changed otherwise (for example by contract calls).
+
+Result:
+{
+  "accounts"     (numeric) Number of reloaded accounts.
+  "height"       (numeric) The block height balances were reloaded at.
+}
+
+Examples:
+> ethereum-cli refreshbalances
+> curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "refreshbalances", "params": [] }'  http://127.0.0.01:9500/
+        """
+        if self._ledger is None:
+            raise BadResponseError('Balance ledger is disabled', code=-4)
+
+        await self._sync_ledger(reload=True)
+        return {
+            'accounts': len(self._ledger.balances),
+            'height': self._ledger.height,
+        }
+
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def getnewaddress(self, passphrase: str):
         """getnewaddress ( "passphrase" )
 
 Returns a new Ethereum address for receiving payments.
@@ -602,8 +728,8 @@ Examples:
         """
         return await self._rpc.personal_newAccount(passphrase)
 
-    @Method.registry(Category.Wallet)
-    async def sendfrom(self, fromaccount, toaddress, amount,
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def sendfrom(self, fromaccount: str, toaddress: str, amount: float,
                        minconf=1, comment="", comment_to=""):
         """sendfrom "fromaccount" "toaddress" amount ( minconf "comment" "comment_to" )
 
@@ -658,8 +784,8 @@ As a json rpc call
                 raise BadResponseError('Insufficient funds', code=-6)
             raise
 
-    @Method.registry(Category.Wallet)
-    async def sendtoaddress(self, address, amount, comment="",
+    @Method.registry(Category.Wallet, readonly=False, concurrency='wallet')
+    async def sendtoaddress(self, address: str, amount: float, comment="",
                             comment_to="", subtractfeefromamount=False):
         """sendtoaddress "address" amount ( "comment" "comment_to" subtractfeefromamount )
 
@@ -690,7 +816,7 @@ Examples:
         return await self.sendfrom((await self._rpc.eth_coinbase()),
                                    address, amount)
 
-    @Method.registry(Category.Blockchain)
+    @Method.registry(Category.Blockchain, cache='head')
     async def getblockcount(self):
         """getblockcount
 
@@ -704,9 +830,9 @@ Examples:
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "getblockcount", "params": [] }'  http://127.0.0.01:9500/
         """
         # TODO: What happen when no blocks in db?
-        return await self._rpc.eth_blockNumber()
+        return await self._get_block_number()
 
-    @Method.registry(Category.Blockchain)
+    @Method.registry(Category.Blockchain, cache='head')
     async def getbestblockhash(self):
         """getbestblockhash
 
@@ -720,14 +846,16 @@ Examples:
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "getbestblockhash", "params": [] }'  http://127.0.0.01:9500/
         """
         # TODO: What happen when no blocks in db?
-        block = await self._rpc.eth_getBlockByNumber(tx_objects=False)
+        if self._head is not None and self._head.fresh:
+            return self._head.hash
+        block = await self._get_block_by_number(tx_objects=False)
         if block is None:
             raise BadResponseError('Block not found', code=-5)
 
         return block['hash']
 
-    @Method.registry(Category.Blockchain)
-    async def getblock(self, blockhash, verbose=True):
+    @Method.registry(Category.Blockchain, cache='confirmed')
+    async def getblock(self, blockhash: str, verbose=True):
         """getblock "blockhash" ( verbose )
 
 If verbose is false, returns a string that is serialized, hex-encoded data for block 'hash'.
@@ -769,7 +897,7 @@ Examples:
 > ethereum-cli getblock "0x8b22f9aa6c27231fb4acc587300abadd259f501ba99ef18d11e9e4dfa741eb39"
 > curl -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "1.0", "id":"curltest", "method": "getblock", "params": ["0x8b22f9aa6c27231fb4acc587300abadd259f501ba99ef18d11e9e4dfa741eb39"] }'  http://127.0.0.01:9500/
         """
-        block = await self._rpc.eth_getBlockByHash(blockhash, False)
+        block = await self._get_block_by_hash(blockhash, False)
         if block is None:
             raise BadResponseError('Block not found', code=-5)
 
@@ -777,14 +905,14 @@ Examples:
             return block['hash']
 
         next_block, confirmations = await asyncio.gather(
-            self._rpc.eth_getBlockByNumber(
+            self._get_block_by_number(
                 hex_to_dec(block['number']) + 1, False),
             self._get_confirmations(block),
         )
 
         data = {
             'hash': block['hash'],
-            'confirmations': (await self._get_confirmations(block)),
+            'confirmations': confirmations,
             'strippedsize': None,
             'size': None,
             'weight': None,
@@ -818,12 +946,224 @@ Examples:
                 'gas_price': gas_price,
             }
 
+    async def _get_block_by_hash(self, bhash, tx_objects=True):
+        block = self._cache.get_by_hash(bhash, tx_objects)
+        if block is None:
+            block = await self._rpc.eth_getBlockByHash(bhash, tx_objects)
+            self._cache.put(block, tx_objects)
+        return block
+
+    async def _get_block_by_number(self, height='latest', tx_objects=True):
+        if isinstance(height, int):
+            block = self._cache.get_by_number(height, tx_objects)
+            if block is not None:
+                return block
+        block = await self._rpc.eth_getBlockByNumber(height, tx_objects)
+        self._cache.put(block, tx_objects, canonical=True)
+        if height == 'latest' and block:
+            self._set_head(block)
+        return block
+
+    def _set_head(self, block):
+        number = hex_to_dec(block['number'])
+        if self._cache.head is not None and number < self._cache.head:
+            # late answer or node behind, reorg shows as new block at
+            # same or greater height
+            return
+        if self._head is not None:
+            self._head.set_block(block)
+        self._cache.set_head(number, block['hash'])
+        self._balance_cache.set_head(number, block['hash'])
+
+    async def _get_block_number(self):
+        if self._head is not None and self._head.fresh:
+            return self._head.number
+        number = await self._rpc.eth_blockNumber()
+        if number and self._cache.head is not None and \
+                number < self._cache.head:
+            return self._cache.head
+        if number:
+            self._cache.set_head(number)
+            self._balance_cache.set_head(number)
+        return number
+
+    def _get_index_lock(self):
+        if self._index_lock is None:
+            self._index_lock = asyncio.Lock()
+        return self._index_lock
+
+    async def _sync_index(self):
+        """Index wallet transactions of blocks up to current head.
+
+        Index lock is taken per chunk, so ``rescanblockchain`` and
+        ``_index_blocks`` do not wait for a long rebuild.
+        """
+        head = await self._get_block_number()
+        while True:
+            with (await self._get_index_lock()):
+                if self._index.height is None:
+                    self._index.reset(head)
+                if self._index.height >= head:
+                    return self._index.height
+                start = self._index.height + 1
+                stop = min(start + self._scan_chunk_size, head + 1)
+                addresses = set(await self._rpc.eth_accounts())
+                blocks = await asyncio.gather(*(
+                    self._get_block_by_number(height)
+                    for height in range(start, stop)))
+                for block in blocks:
+                    if block is None:
+                        return self._index.height
+                    if not (await self._index_block(block, addresses)):
+                        self._log.warning('Reorg below height %s, '
+                                          'rolled back index.',
+                                          hex_to_dec(block['number']))
+                        self._index.rollback(self._index.height - 1)
+                        break
+
+    async def _index_blocks(self, blocks):
+        """Index ``blocks`` already fetched by Poller when they extend
+        the index, anything else is left to ``_sync_index``.
+        """
+        lock = self._get_index_lock()
+        if lock.locked():
+            return
+        with (await lock):
+            if self._index.height is None:
+                return
+            addresses = None
+            by_height = {hex_to_dec(block['number']): block
+                         for block in blocks}
+            for height in sorted(by_height):
+                block = by_height[height]
+                if height <= self._index.height:
+                    continue
+                if height > self._index.height + 1:
+                    break
+                if addresses is None:
+                    addresses = set(await self._rpc.eth_accounts())
+                if not (await self._index_block(block, addresses)):
+                    break
+
+    async def _index_block(self, block, addresses):
+        """Store wallet transactions of ``block``, False when it does not
+        extend the last indexed block.
+        """
+        parent_hash = self._index.hash
+        if parent_hash is not None and block['parentHash'] != parent_hash:
+            return False
+        transactions = [tr for tr in block['transactions']
+                        if tr['from'] in addresses or tr['to'] in addresses]
+        receipts = await asyncio.gather(*(
+            self._rpc.eth_getTransactionReceipt(tr['hash'])
+            for tr in transactions))
+        self._index.add_block(block, [
+            dict(tr, gasUsed=receipt['gasUsed'])
+            for tr, receipt in zip(transactions, receipts)])
+        return True
+
+    async def _get_balances(self, minconf=1, addresses=None):
+        """Map of ``addresses`` (wallet accounts by default) to balances
+        in wei with at least ``minconf`` confirmations, that is balances
+        at height ``head - minconf + 1``. Zero minconf means pending
+        balances.
+
+        Wallet balances at head come from balance ledger when it is
+        enabled, older ones from balance cache.
+        """
+        if minconf <= 0:
+            if addresses is None:
+                addresses = await self._rpc.eth_accounts()
+            return dict(zip(addresses, await self._fetch_balances(
+                addresses, 'pending')))
+        if self._ledger is not None:
+            await self._sync_ledger()
+            ledger = self._ledger.balances
+            if minconf == 1 and addresses is None:
+                return ledger
+            if minconf == 1 and all(address in ledger
+                                    for address in addresses):
+                return {address: ledger[address] for address in addresses}
+            if addresses is None:
+                addresses = list(ledger)
+        elif addresses is None:
+            addresses = await self._rpc.eth_accounts()
+        height = await self._get_block_number() - minconf + 1
+        if height < 0:
+            return {address: 0 for address in addresses}
+
+        balances = {address: self._balance_cache.get(address, height)
+                    for address in addresses}
+        missing = [address for address, balance in balances.items()
+                   if balance is None]
+        for address, balance in zip(missing, await self._fetch_balances(
+                missing, height)):
+            self._balance_cache.put(address, height, balance)
+            balances[address] = balance
+        return balances
+
+    async def _fetch_balances(self, addresses, block='latest'):
+        semaphore = asyncio.Semaphore(self._balance_concurrency)
+
+        async def _fetch_balance(address):
+            with (await semaphore):
+                balance = (await self._rpc.eth_getBalance(address,
+                                                          block)) or 0
+            if not isinstance(balance, (int, float)):
+                balance = hex_to_dec(balance)
+            return balance
+
+        return await asyncio.gather(*(_fetch_balance(address)
+                                      for address in addresses))
+
+    def _get_ledger_lock(self):
+        if self._ledger_lock is None:
+            self._ledger_lock = asyncio.Lock()
+        return self._ledger_lock
+
+    async def _sync_ledger(self, reload=False):
+        """Bring balance ledger to current head refetching only accounts
+        touched by new blocks. All balances are reloaded on ``reload``,
+        on reorg or when ledger is more than scan_chunk_size blocks behind.
+        """
+        with (await self._get_ledger_lock()):
+            ledger = self._ledger
+            head = await self._get_block_number()
+            if not reload and ledger.height is not None and \
+                    ledger.height >= head:
+                return ledger.height
+            addresses = await self._rpc.eth_accounts()
+            if not reload and ledger.height is not None and \
+                    head - ledger.height <= self._scan_chunk_size:
+                blocks = await asyncio.gather(*(
+                    self._get_block_by_number(height)
+                    for height in range(ledger.height + 1, head + 1)))
+                for block in blocks:
+                    if block is None:
+                        return ledger.height
+                    if block['parentHash'] != ledger.hash:
+                        self._log.warning('Reorg below height %s, '
+                                          'reloading balances.',
+                                          hex_to_dec(block['number']))
+                        break
+                    touched = ledger.touched(block, addresses)
+                    ledger.add_block(block, dict(zip(
+                        touched, await self._fetch_balances(
+                            touched, hex_to_dec(block['number'])))),
+                        addresses)
+                else:
+                    return ledger.height
+            block = await self._get_block_by_number(head, tx_objects=False)
+            ledger.reset(block, zip(addresses, await self._fetch_balances(
+                addresses, head)))
+            return ledger.height
+
     async def _calculate_confirmations(self, response):
-        return (await self._rpc.eth_blockNumber() -
+        return (await self._get_block_number() -
                 hex_to_dec(response['number']))
 
     async def _get_confirmations(self, block):
-        last_block_number = await self._rpc.eth_blockNumber()
+        last_block_number = await self._get_block_number()
         if not last_block_number:
             raise RuntimeError('Blockchain not synced.')
 
@@ -832,6 +1172,32 @@ Examples:
         return (last_block_number - hex_to_dec(block['number']))
 
 
-async def create_ethereumd_proxy(uri, timeout=60, *, loop=None):
-    rpc = await create_ethereum_client(uri, timeout, loop=loop)
-    return EthereumProxy(rpc)
+async def create_ethereumd_proxy(uri, timeout=60, *, cache_size=1024,
+                                 cache_depth=12, batch_size=100,
+                                 batch_delay=0, scan_chunk_size=100,
+                                 scan_concurrency=10, txindex=None,
+                                 txindex_start=None, upstreams=(),
+                                 max_lag=3, hedge_percentile=95,
+                                 hedge_budget=0.05, balance_ledger=False,
+                                 balance_concurrency=10,
+                                 balance_cache_size=65536, loop=None):
+    client = await create_ethereum_client(uri, timeout, loop=loop)
+    rpc = UpstreamClient(client, batch_size, batch_delay, loop=loop)
+    if upstreams:
+        nodes = [UpstreamNode(uri, rpc)]
+        for upstream in upstreams:
+            client = await create_ethereum_client(upstream, timeout,
+                                                  loop=loop)
+            nodes.append(UpstreamNode(upstream, UpstreamClient(
+                client, batch_size, batch_delay, loop=loop)))
+        rpc = UpstreamPool(nodes, max_lag, hedge_percentile, hedge_budget,
+                           loop=loop)
+    index = (TransactionIndex(txindex, txindex_start)
+             if txindex else None)
+    ledger = BalanceLedger() if balance_ledger else None
+    return EthereumProxy(rpc, BlockCache(cache_size, cache_depth), index,
+                         ledger, scan_chunk_size=scan_chunk_size,
+                         scan_concurrency=scan_concurrency,
+                         balance_concurrency=balance_concurrency,
+                         balance_cache=BalanceCache(balance_cache_size,
+                                                    cache_depth))
@@ -1,19 +1,38 @@
 import logging
 import asyncio
+import os
+import signal
+import threading
 
 from aioethereum.errors import BadResponseError
 from sanic import Sanic, response
+from sanic.exceptions import InvalidUsage
 from sanic.handlers import ErrorHandler
 from sanic.server import serve
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from . import codec, metrics
+from .dispatch import build_table
 from .proxy import create_ethereumd_proxy
 from .poller import Poller
-from .utils import create_default_logger, GREETING
+from .profiler import SamplingProfiler
+from .cache import ResponseCache
+from .head import HeadTracker
+from .logs import LogPipeline
+from .upstream import UpstreamPool
+from .utils import GREETING
+from .workers import supervise, bind_unix_socket, ElectionLock
 
 
-create_default_logger(logging.WARNING)
+def encode_response(data):
+    """Serialize JSON-RPC response, pre-serialized results are
+    embedded without encoding them again.
+    """
+    if isinstance(data.get('result'), codec.RawJSON):
+        return b'{"id":%s,"result":%s,"error":null}' % (
+            codec.dumps(data['id']), data['result'])
+    return codec.dumps(data)
 
 
 class SentryErrorHandler(ErrorHandler):
@@ -28,26 +47,100 @@ class SentryErrorHandler(ErrorHandler):
         pass
 
 
+REQUESTS = metrics.counter(
+    'ethereumd_requests_total',
+    'Proxy requests by method and status.', ['method', 'status'])
+REQUEST_LATENCY = metrics.histogram(
+    'ethereumd_request_seconds',
+    'Latency of proxy requests by method.', ['method'])
+
+
 class RPCServer:
 
     def __init__(self, ethpconnect='127.0.0.1', ethpport=9500,
                  rpcconnect='127.0.0.1', rpcport=8545,
                  ipcconnect=None, blocknotify=None, walletnotify=None,
-                 alertnotify=None, tls=False, *, loop=None):
+                 alertnotify=None, tls=False, blockcache=1024,
+                 blockcachedepth=12, rpcbatchsize=100, rpcbatchdelay=0,
+                 ethpbatchconcurrency=16, headstaleness=3,
+                 scanchunksize=100, scanconcurrency=10, txindex=None,
+                 txindexstart=None, notifyworkers=1, notifytimeout=None,
+                 notifybatchsize=100, notifybatchdelay=0, pollinterval=100,
+                 pollmaxinterval=1000, rollbacknotify=None, reorgbuffer=128,
+                 upstreams=None, upstreammaxlag=3, upstreamcheckinterval=5,
+                 hedgepercentile=95, hedgebudget=5, workers=1,
+                 workerlock='ethereumd.lock', jsoncodec='auto',
+                 loglevel='warning', logfile='/tmp/ethereumd-proxy.log',
+                 logformat='plain', logqueuesize=10000,
+                 logmaxbytes=10485760, logbackups=5, responsecache=1024,
+                 responsecachebytes=67108864, responsecachettl=1,
+                 balanceledger=0, balanceconcurrency=10, balancecache=65536,
+                 ethpsocket=None, *, loop=None):
+        # every worker writes the file, rollover of one process would
+        # rename it under the others
+        self._logging = LogPipeline(
+            logging.getLevelName(loglevel.upper()), logfile, logformat,
+            int(logqueuesize), int(logmaxbytes) if int(workers) < 2 else 0,
+            int(logbackups))
         self._loop = loop or asyncio.get_event_loop()
         self._app = Sanic(__name__,
                           log_config=None,
                           error_handler=SentryErrorHandler())
         self._host = ethpconnect
-        self._port = ethpport
+        self._port = int(ethpport)
+        self._socket_path = ethpsocket
+        self._socket = None
+        if not self._port and not self._socket_path:
+            raise ValueError('Either ethpport or ethpsocket must be set')
         self._rpc_host = rpcconnect
         self._rpc_port = rpcport
         self._unix_socket = ipcconnect
         self._blocknotify = blocknotify
         self._walletnotify = walletnotify
         self._alertnotify = alertnotify
+        self._rollbacknotify = rollbacknotify
+        self._reorgbuffer = int(reorgbuffer)
+        self._notifyworkers = int(notifyworkers)
+        self._notifytimeout = (float(notifytimeout)
+                               if notifytimeout is not None else None)
+        self._notifybatchsize = int(notifybatchsize)
+        self._notifybatchdelay = float(notifybatchdelay)
+        self._pollinterval = float(pollinterval)
+        self._pollmaxinterval = float(pollmaxinterval)
         self._tls = tls
+        self._ethpbatchconcurrency = int(ethpbatchconcurrency)
+        self._blockcache = int(blockcache)
+        self._blockcachedepth = int(blockcachedepth)
+        self._rpcbatchsize = int(rpcbatchsize)
+        self._rpcbatchdelay = int(rpcbatchdelay)
+        self._headstaleness = float(headstaleness)
+        self._scanchunksize = int(scanchunksize)
+        self._scanconcurrency = int(scanconcurrency)
+        self._txindex = txindex
+        self._txindexstart = (int(txindexstart)
+                              if txindexstart is not None else None)
+        self._upstreams = [uri.strip() for uri in (upstreams or '').split(',')
+                           if uri.strip()]
+        self._upstreammaxlag = int(upstreammaxlag)
+        self._upstreamcheckinterval = float(upstreamcheckinterval)
+        self._hedgepercentile = float(hedgepercentile)
+        self._hedgebudget = float(hedgebudget)
+        self._responsecache = int(responsecache)
+        self._responsecachebytes = int(responsecachebytes)
+        self._responsecachettl = float(responsecachettl)
+        self._balanceledger = bool(int(balanceledger))
+        self._balanceconcurrency = int(balanceconcurrency)
+        self._balancecache = int(balancecache)
+        self._workers = int(workers)
+        self._lock = (ElectionLock(os.path.abspath(workerlock))
+                      if self._workers > 1 else None)
+        self._leader = False
+        self._master = None
         self._log = logging.getLogger('rpc_server')
+        codec.use(jsoncodec)
+        self._methods = build_table()
+        self._locks = {}
+        self._profiling = False
         self.routes()
 
     @property
@@ -70,90 +163,314 @@ class RPCServer:
             cmds['walletnotify'] = self._walletnotify
         if self._alertnotify:
             cmds['alertnotify'] = self._alertnotify
+        if self._rollbacknotify:
+            cmds['rollbacknotify'] = self._rollbacknotify
         return cmds
 
     def before_server_start(self):
         @self._app.listener('before_server_start')
         async def initialize_scheduler(app, loop):
-            self._proxy = await create_ethereumd_proxy(self.endpoint,
-                                                       loop=loop)
-            self._poller = Poller(self._proxy, self.cmds, loop=loop)
+            self._proxy = await create_ethereumd_proxy(
+                self.endpoint,
+                cache_size=self._blockcache,
+                cache_depth=self._blockcachedepth,
+                batch_size=self._rpcbatchsize,
+                batch_delay=self._rpcbatchdelay / 1000,
+                scan_chunk_size=self._scanchunksize,
+                scan_concurrency=self._scanconcurrency,
+                txindex=self._txindex,
+                txindex_start=self._txindexstart,
+                upstreams=self._upstreams,
+                max_lag=self._upstreammaxlag,
+                hedge_percentile=self._hedgepercentile,
+                hedge_budget=self._hedgebudget / 100,
+                balance_ledger=self._balanceledger,
+                balance_concurrency=self._balanceconcurrency,
+                balance_cache_size=self._balancecache,
+                loop=loop)
+            self._poller = Poller(self._proxy, self.cmds,
+                                  workers=self._notifyworkers,
+                                  timeout=self._notifytimeout,
+                                  batch_size=self._notifybatchsize,
+                                  batch_delay=self._notifybatchdelay / 1000,
+                                  reorg_buffer=self._reorgbuffer,
+                                  loop=loop)
+            self._head = HeadTracker(self._proxy, self._headstaleness,
+                                     loop=loop)
+            self._proxy._head = self._head
+            self._responses = ResponseCache(
+                self._head, self._responsecache, self._responsecachebytes,
+                self._responsecachettl, self._blockcachedepth, loop=loop)
             self._scheduler = AsyncIOScheduler({'event_loop': loop})
-            if self._poller.has_blocknotify:
-                self._scheduler.add_job(self._poller.blocknotify, 'interval',
-                                        id='blocknotify',
-                                        seconds=1)
-            if self._poller.has_walletnotify:
-                self._scheduler.add_job(self._poller.walletnotify, 'interval',
-                                        id='walletnotify',
+            self._scheduler.add_job(self._head.update, 'interval',
+                                    id='headtracker',
+                                    seconds=1)
+            if isinstance(self._proxy._rpc, UpstreamPool):
+                self._scheduler.add_job(self._proxy._rpc.check, 'interval',
+                                        id='upstreams',
+                                        seconds=self._upstreamcheckinterval)
+            if self._lock is not None:
+                self._scheduler.add_job(self._elect, 'interval',
+                                        id='election',
                                         seconds=1)
             if self._scheduler.get_jobs():
                 self._scheduler.start()
+            await self._elect()
+            metrics.gauge('ethereumd_notification_queue_depth',
+                          'Notifications waiting for a worker.',
+                          self._poller.defqueue.qsize)
+            metrics.gauge('ethereumd_notifications_in_flight',
+                          'Notifications being sent.',
+                          lambda: self._poller._inflight)
+            self._lagtask = asyncio.ensure_future(
+                metrics.monitor_loop_lag(loop=loop), loop=loop)
         return initialize_scheduler
 
+    async def _elect(self):
+        """Run the Poller in this worker once it wins the election lock,
+        other workers only serve requests and track head on their own.
+        """
+        if self._master is not None and os.getppid() != self._master:
+            self._log.warning('Master process exited, stopping worker...')
+            self._loop.stop()
+            return
+        if self._leader:
+            if self._lock is not None and \
+                    self._poller.height != self._lock.height:
+                self._lock.record(self._poller.height)
+            return
+        if self._lock is not None and not self._lock.acquire():
+            return
+        self._leader = True
+        if self._lock is not None:
+            self._log.warning('Worker %s was elected to run poller, '
+                              'notified up to height %s.', os.getpid(),
+                              self._lock.height)
+            self._poller.height = self._lock.height
+        if self._poller.has_txindex:
+            self._scheduler.add_job(self._poller.indexblocks, 'interval',
+                                    id='txindex',
+                                    seconds=1)
+        self._poller.start(self._pollinterval / 1000,
+                           self._pollmaxinterval / 1000)
+
     def routes(self):
         self._app.add_route(self.handler_index, '/',
                             methods=['POST'])
         self._app.add_route(self.handler_log, '/_log/',
                             methods=['GET', 'POST'])
+        self._app.add_route(self.handler_stats, '/_stats/',
+                            methods=['GET'])
+        self._app.add_route(self.handler_metrics, '/metrics',
+                            methods=['GET'])
+        self._app.add_route(self.handler_profile, '/_profile/',
+                            methods=['GET'])
 
     async def handler_index(self, request):
-        data = request.json
+        try:
+            data = codec.loads(request.body)
+        except ValueError:
+            raise InvalidUsage('Failed when parsing body as json')
+        if isinstance(data, list):
+            responses = await self._call_batch(data)
+            if isinstance(responses, list):
+                body = b'[%s]' % b','.join(map(encode_response, responses))
+            else:
+                body = encode_response(responses)
+        else:
+            body = encode_response(await self._call(data))
+        return response.HTTPResponse(body_bytes=body,
+                                     content_type='application/json')
+
+    async def _call_batch(self, batch):
+        if not batch:
+            return {
+                'id': None,
+                'result': None,
+                'error': {
+                    'message': 'Invalid rpc 2.0 structure',
+                    'code': -32602
+                }
+            }
+        semaphore = asyncio.Semaphore(self._ethpbatchconcurrency,
+                                      loop=self._loop)
+
+        async def _limited_call(data):
+            with (await semaphore):
+                return await self._call(data)
+
+        return await asyncio.gather(*(_limited_call(data) for data in batch),
+                                    loop=self._loop)
+
+    async def _call(self, data):
+        started = self._loop.time()
+        result = await self._dispatch(data)
+        method = data.get('method') if isinstance(data, dict) else None
+        # anything but exposed methods is labeled as "unknown"
+        if not isinstance(method, str) or method not in self._methods:
+            method = 'unknown'
+        REQUESTS.inc(method, 'error' if result['error'] else 'ok')
+        REQUEST_LATENCY.observe(self._loop.time() - started, method)
+        return result
+
+    async def _dispatch(self, data):
         try:
             id_, method, params, _ = data['id'], \
                 data['method'], data['params'], data['jsonrpc']
-        except KeyError:
-            return response.json({
-                'id': data.get('id', 0),
+        except (KeyError, TypeError):
+            return {
+                'id': data.get('id', 0) if isinstance(data, dict) else None,
                 'result': None,
                 'error': {
                     'message': 'Invalid rpc 2.0 structure',
                     'code': -32602
                 }
-            })
+            }
+        spec = (self._methods.get(method) if isinstance(method, str)
+                else None)
+        if spec is None:
+            return {
+                'id': id_,
+                'result': None,
+                'error': {
+                    'message': 'Method not found',
+                    'code': -32601
+                }
+            }
+        args, error = spec.bind(params)
+        if error is not None:
+            return {
+                'id': id_,
+                'result': None,
+                'error': error
+            }
+        cached = self._responses.get(spec, args)
+        if cached is not None:
+            return {
+                'id': id_,
+                'result': cached,
+                'error': None
+            }
+        head = self._responses.head_state()
         try:
-            result = (await getattr(self._proxy, method)(*params))
+            result = await self._invoke(spec, args)
         except AttributeError as e:
             self._log.exception(e)
-            return response.json({
+            return {
                 'id': id_,
                 'result': None,
                 'error': {
                     'message': 'Method not found',
                     'code': -32601
                 }
-            })
+            }
         except TypeError as e:
             self._log.exception(e)
-            return response.json({
+            return {
                 'id': id_,
                 'result': None,
                 'error': {
                     'message': e.args[0],
                     'code': -1
                 }
-            })
+            }
         except BadResponseError as e:
-            return response.json({
+            return {
                 'id': id_,
                 'result': None,
                 'error': {
                     'message': e.msg,
                     'code': e.code
                 }
-            })
+            }
         else:
-            return response.json({
+            if not spec.readonly:
+                # wallet changes may show in any cached result
+                self._responses.clear()
+            return {
                 'id': id_,
-                'result': result,
+                'result': self._responses.put(spec, args, result, head),
                 'error': None
-            })
+            }
+
+    async def _invoke(self, spec, args):
+        if spec.concurrency == 'parallel':
+            return await getattr(self._proxy, spec.name)(*args)
+        lock = self._locks.get(spec.concurrency)
+        if lock is None:
+            lock = self._locks[spec.concurrency] = asyncio.Lock(
+                loop=self._loop)
+        with (await lock):
+            return await getattr(self._proxy, spec.name)(*args)
 
     async def handler_log(self, request):
         self._log.warning('\nRequest args: %s;\nRequest body: %s',
                           request.args, request.body)
         return response.json({'status': 'OK'})
 
+    async def handler_stats(self, request):
+        upstream = {
+            'batches': self._proxy._rpc.batches,
+            'deduplicated': self._proxy._rpc.deduplicated,
+        }
+        if isinstance(self._proxy._rpc, UpstreamPool):
+            upstream['nodes'] = self._proxy._rpc.stats
+            upstream['hedges'] = self._proxy._rpc.hedge_stats
+            upstream['retries'] = self._proxy._rpc.retries
+        return response.json({
+            'blockcache': self._proxy._cache.stats,
+            'head': self._head.stats,
+            'poller': self._poller.stats,
+            'upstream': upstream,
+            'worker': {
+                'pid': os.getpid(),
+                'workers': self._workers,
+                'poller': self._leader,
+            },
+            'log': self._logging.stats,
+            'ledger': (self._proxy._ledger.stats
+                       if self._proxy._ledger is not None else None),
+            'balancecache': self._proxy._balance_cache.stats,
+            'responsecache': self._responses.stats,
+        })
+
+    async def handler_metrics(self, request):
+        return response.text(metrics.REGISTRY.expose(),
+                             content_type='text/plain; version=0.0.4')
+
+    async def handler_profile(self, request):
+        """Sample event loop for ``seconds`` (at most 300) every
+        ``interval`` seconds and return stacks in ``collapsed`` or
+        ``pstats`` format.
+        """
+        try:
+            seconds = min(float(request.args.get('seconds', 10)), 300)
+            interval = max(float(request.args.get('interval', 0.005)),
+                           0.001)
+        except ValueError:
+            return response.json({'error': 'Invalid seconds or interval'},
+                                 status=400)
+        fmt = request.args.get('format', 'collapsed')
+        if fmt not in ('collapsed', 'pstats'):
+            return response.json({'error': 'Unknown format %s' % fmt},
+                                 status=400)
+        if self._profiling:
+            return response.json({'error': 'Profiler is already running'},
+                                 status=409)
+
+        self._profiling = True
+        try:
+            profiler = SamplingProfiler(threading.get_ident(), interval,
+                                        loop=self._loop)
+            await self._loop.run_in_executor(None, profiler.run, seconds)
+        finally:
+            self._profiling = False
+        if fmt == 'pstats':
+            return response.raw(profiler.pstats(), headers={
+                'Content-Disposition':
+                    'attachment; filename="ethereumd.pstats"'})
+        return response.text(profiler.collapsed())
+
     def serve(self):
         self.before_server_start()
         self._log.info(GREETING)
@@ -165,14 +482,68 @@ class RPCServer:
             backlog=100,
             run_async=True,
             has_log=False)
-        return serve(**server_settings)
+        servers = []
+        if self._port:
+            # every worker binds own socket, kernel spreads connections
+            server_settings['reuse_port'] = self._workers > 1
+            servers.append(serve(**server_settings))
+            server_settings['before_start'] = []
+        if self._socket_path:
+            if self._socket is None:
+                self._socket = bind_unix_socket(self._socket_path)
+            servers.append(serve(**dict(server_settings, host=None,
+                                        port=None, sock=self._socket,
+                                        reuse_port=False)))
+        return asyncio.gather(*servers, loop=self._loop)
+
+    def fork(self):
+        """Fork serving processes. The master only supervises them and
+        forks a new worker whenever one exits, it returns True once
+        stopped. Workers switch to a new event loop because the selector
+        of the loop created before fork is shared with the master.
+        """
+        if self._workers < 2:
+            return False
+        master = os.getpid()
+        # log thread doesn't survive fork, every process runs its own
+        if supervise(self._workers, self._logging.stop,
+                     self._logging.start):
+            return True
+        self._master = master
+        self._loop.close()
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.add_signal_handler(signal.SIGTERM, self._loop.stop)
+        return False
 
     def run(self):
+        # root logger is replaced only by the serving process, not by
+        # code which merely builds the server
+        self._logging.install()
+        self._logging.start()
+        if self._socket_path:
+            # unix socket can't be reused, workers share one bound here
+            self._socket = bind_unix_socket(self._socket_path)
+        if self.fork():
+            self._log.warning('Workers stopped.')
+            if self._socket is not None:
+                os.unlink(self._socket_path)
+            self._logging.stop()
+            return
         self._loop.run_until_complete(self.serve())
         try:
-            self._log.warning('Starting server on http://%s:%s/...',
-                              self._host, self._port)
+            if self._port:
+                self._log.warning('Starting server on http://%s:%s/...',
+                                  self._host, self._port)
+            if self._socket_path:
+                self._log.warning('Starting server on unix socket %s...',
+                                  self._socket_path)
             self._loop.run_forever()
         except Exception:
             self._log.warning('Stoping server...')
             self._poller.stop()
+            self._lagtask.cancel()
+        finally:
+            if self._socket is not None and self._master is None:
+                os.unlink(self._socket_path)
+            self._logging.stop()
@@ -0,0 +1,193 @@
+import asyncio
+import importlib
+import logging
+
+import aiohttp
+
+from . import codec
+
+
+def create_sink(spec, timeout=None, batch_size=100, batch_delay=0, *,
+                loop=None):
+    """Build notification sink from ``*notify`` option value:
+
+    * ``http://...`` or ``https://...`` - HTTP webhook;
+    * ``unix:<path>`` - line protocol over Unix socket;
+    * ``python:<module>:<callable>`` - callable imported in process;
+    * anything else - shell command, ``%s`` is replaced by data.
+    """
+    if spec.startswith(('http://', 'https://')):
+        return WebhookSink(spec, timeout, batch_size, batch_delay, loop=loop)
+    elif spec.startswith('unix:'):
+        return UnixSocketSink(spec[len('unix:'):], timeout, loop=loop)
+    elif spec.startswith('python:'):
+        return CallableSink(spec[len('python:'):], timeout, loop=loop)
+    return CommandSink(spec, timeout, loop=loop)
+
+
+class CommandSink:
+    """Runs shell command per notification, command is killed when it
+    does not finish in ``timeout`` seconds.
+    """
+
+    def __init__(self, cmd, timeout=None, *, loop=None):
+        self._log = logging.getLogger('sink')
+        self._cmd = cmd
+        self._timeout = timeout
+        self._loop = loop
+
+    async def send(self, name, data):
+        cmd = self._cmd % data
+        cmdp = await asyncio.create_subprocess_exec(
+            *cmd.split(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(cmdp.communicate(),
+                                               self._timeout,
+                                               loop=self._loop)
+        except asyncio.TimeoutError:
+            cmdp.kill()
+            await cmdp.wait()
+            raise asyncio.TimeoutError('%s command timed out after %s '
+                                       'seconds, killed.' %
+                                       (name, self._timeout))
+        if stdout:
+            self._log.warning('%s: %s', name.upper(), stdout)
+
+    def close(self):
+        pass
+
+
+class CallableSink:
+    """Calls ``module:callable`` with ``(name, data)`` in process.
+    Coroutine functions are awaited, plain ones must not block.
+    """
+
+    def __init__(self, path, timeout=None, *, loop=None):
+        module, _, attr = path.rpartition(':')
+        if not module:
+            module, _, attr = path.rpartition('.')
+        self._func = getattr(importlib.import_module(module), attr)
+        self._timeout = timeout
+        self._loop = loop
+
+    async def send(self, name, data):
+        result = self._func(name, data)
+        if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+            await asyncio.wait_for(result, self._timeout, loop=self._loop)
+
+    def close(self):
+        pass
+
+
+class WebhookSink:
+    """POSTs notifications as JSON array of ``{"event": ..., "data": ...}``
+    objects over keep-alive connection.
+
+    ``send`` only queues the notification and returns, background
+    flusher posts queued ones in order, at most ``batch_size`` per
+    request, waiting ``batch_delay`` seconds (or one loop iteration when
+    it is 0) for a batch to fill. Notifications queued while a request
+    is in flight go in the next one, so batches grow with load even when
+    notifications are sent one at a time. ``send`` waits only while
+    ``max_pending`` notifications are queued. Failed requests are logged,
+    their notifications are not retried.
+    """
+
+    def __init__(self, url, timeout=None, batch_size=100, batch_delay=0, *,
+                 max_pending=None, loop=None):
+        self._log = logging.getLogger('sink')
+        self._url = url
+        self._timeout = timeout
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._max_pending = max_pending or 10 * batch_size
+        self._loop = loop or asyncio.get_event_loop()
+        self._session = None
+        self._pending = []
+        self._drained = asyncio.Event(loop=self._loop)
+        self._flusher = None
+        self.batches = 0
+        self.failed = 0
+
+    async def send(self, name, data):
+        while len(self._pending) >= self._max_pending:
+            self._drained.clear()
+            await self._drained.wait()
+        self._pending.append({'event': name, 'data': data})
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush(),
+                                                  loop=self._loop)
+
+    async def _flush(self):
+        while self._pending:
+            if len(self._pending) < self._batch_size:
+                await asyncio.sleep(self._batch_delay, loop=self._loop)
+            items = self._pending[:self._batch_size]
+            del self._pending[:self._batch_size]
+            self._drained.set()
+            try:
+                await self._post(items)
+            except Exception as e:
+                self.failed += len(items)
+                self._log.error('Webhook dropped %s notifications: %r',
+                                len(items), e)
+
+    async def _post(self, items):
+        self.batches += 1
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(loop=self._loop)
+        r = await asyncio.wait_for(
+            self._session.post(
+                url=self._url,
+                data=codec.dumps(items),
+                headers={'Content-Type': 'application/json'}),
+            self._timeout, loop=self._loop)
+        try:
+            if r.status >= 300:
+                raise ConnectionError('Webhook responded with status %s'
+                                      % r.status)
+        finally:
+            await r.release()
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+        if self._session is not None:
+            self._session.close()
+
+
+class UnixSocketSink:
+    """Writes ``<event> <data>`` lines to Unix socket, connection is kept
+    open and re-established after failures.
+    """
+
+    def __init__(self, path, timeout=None, *, loop=None):
+        self._path = path
+        self._timeout = timeout
+        self._loop = loop or asyncio.get_event_loop()
+        self._writer = None
+        self._lock = asyncio.Lock(loop=self._loop)
+
+    async def send(self, name, data):
+        line = ('%s %s\n' % (name, data)).encode('utf-8')
+        with (await self._lock):
+            try:
+                if self._writer is None:
+                    _, self._writer = await asyncio.wait_for(
+                        asyncio.open_unix_connection(self._path,
+                                                     loop=self._loop),
+                        self._timeout, loop=self._loop)
+                self._writer.write(line)
+                await asyncio.wait_for(self._writer.drain(), self._timeout,
+                                       loop=self._loop)
+            except Exception:
+                self.close()
+                raise
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,544 @@
+import logging
+import asyncio
+from collections import deque
+from urllib.parse import urlparse
+
+import aiohttp
+import async_timeout
+from aioethereum import AsyncIOIPCClient
+from aioethereum.errors import BadResponseError, BadStatusError, BadJsonError
+from aioethereum.management import RpcMixin
+
+from . import codec, metrics
+
+
+# Calls without side effects, safe to share between callers
+IDEMPOTENT_METHODS = frozenset([
+    'eth_accounts',
+    'eth_blockNumber',
+    'eth_call',
+    'eth_coinbase',
+    'eth_estimateGas',
+    'eth_gasPrice',
+    'eth_getBalance',
+    'eth_getBlockByHash',
+    'eth_getBlockByNumber',
+    'eth_getBlockTransactionCountByHash',
+    'eth_getBlockTransactionCountByNumber',
+    'eth_getCode',
+    'eth_getStorageAt',
+    'eth_getTransactionByHash',
+    'eth_getTransactionCount',
+    'eth_getTransactionReceipt',
+    'eth_hashrate',
+    'eth_mining',
+    'eth_protocolVersion',
+    'eth_syncing',
+    'net_version',
+])
+
+
+# Calls depending on keys or filters living on one node
+WALLET_METHODS = frozenset([
+    'eth_accounts',
+    'eth_coinbase',
+    'eth_getFilterChanges',
+    'eth_getFilterLogs',
+    'eth_newBlockFilter',
+    'eth_newFilter',
+    'eth_newPendingTransactionFilter',
+    'eth_sendTransaction',
+    'eth_sign',
+    'eth_signTransaction',
+    'eth_uninstallFilter',
+])
+
+
+# Lookups a lagging node answers with null for what the wallet node has
+LOOKUP_METHODS = frozenset([
+    'eth_getBlockByHash',
+    'eth_getBlockByNumber',
+    'eth_getBlockTransactionCountByHash',
+    'eth_getBlockTransactionCountByNumber',
+    'eth_getTransactionByHash',
+    'eth_getTransactionReceipt',
+])
+
+
+# Reads of state at a block, index of their block parameter
+STATE_METHODS = {
+    'eth_call': 1,
+    'eth_getBalance': 1,
+    'eth_getCode': 1,
+    'eth_getStorageAt': 2,
+    'eth_getTransactionCount': 1,
+}
+
+
+def is_wallet_method(method):
+    return method in WALLET_METHODS or method.startswith('personal_')
+
+
+def is_head_read(method, params):
+    # head must not flap between nodes, nor 'latest' state read on it
+    return method == 'eth_blockNumber' or any(
+        param in ('latest', 'pending') for param in params or ())
+
+
+def state_height(method, params):
+    """Block number state read is pinned to, None for other calls and
+    for block tags.
+    """
+    index = STATE_METHODS.get(method)
+    if index is None or not params or len(params) <= index:
+        return None
+    block = params[index]
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith('0x'):
+        return int(block, 16)
+    return None
+
+
+UPSTREAM_CALLS = metrics.counter(
+    'ethereumd_upstream_calls_total',
+    'Calls made to node by method and status.', ['method', 'status'])
+UPSTREAM_HEDGES = metrics.counter(
+    'ethereumd_upstream_hedges_total',
+    'Hedged calls by method, fired and won by the backup node.',
+    ['method', 'outcome'])
+UPSTREAM_LATENCY = metrics.histogram(
+    'ethereumd_upstream_call_seconds',
+    'Latency of calls to node by method.', ['method'])
+
+
+class UpstreamClient(RpcMixin):
+    """Wrapper over aioethereum client which de-duplicates and packs
+    concurrent calls into JSON-RPC batch arrays.
+
+    While an idempotent call is in flight, identical calls (same method
+    and params) await its result instead of going upstream.
+
+    Calls made within ``batch_delay`` seconds (or within the same loop
+    iteration when it is 0) are sent as one batch of at most
+    ``batch_size`` members. A lone call is sent as a single request
+    object. Both are serialized by ``codec`` and sent over the transport
+    of the wrapped client.
+    """
+
+    def __init__(self, client, batch_size=100, batch_delay=0, *, loop=None):
+        self._log = logging.getLogger('upstream')
+        self._client = client
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = []
+        self._flusher = None
+        self._session = None
+        self._inflight = {}
+        self.batches = 0
+        self.deduplicated = 0
+
+    @property
+    def is_ipc(self):
+        return isinstance(self._client, AsyncIOIPCClient)
+
+    @property
+    def unix_path(self):
+        # IPC client keeps the whole unix:// uri it was created from
+        return urlparse(self._client._unix_path).path if self.is_ipc else None
+
+    async def _call(self, method, params=None, _id=None):
+        started = self._loop.time()
+        status = 'error'
+        try:
+            result = await self._dispatch(method, params, _id)
+            status = 'ok'
+            return result
+        finally:
+            UPSTREAM_CALLS.inc(method, status)
+            UPSTREAM_LATENCY.observe(self._loop.time() - started, method)
+
+    async def _dispatch(self, method, params=None, _id=None):
+        if method not in IDEMPOTENT_METHODS:
+            return await self._enqueue(method, params, _id)
+
+        key = (method, codec.dumps(params or []))
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.deduplicated += 1
+        else:
+            fut = self._enqueue(method, params, _id)
+            self._inflight[key] = fut
+            fut.add_done_callback(
+                lambda f: self._release_inflight(key, f))
+        # one caller's cancellation must not cancel the others
+        return await asyncio.shield(fut, loop=self._loop)
+
+    def _release_inflight(self, key, fut):
+        self._inflight.pop(key, None)
+        if not fut.cancelled():
+            # mark exception as retrieved when every caller went away
+            fut.exception()
+
+    def _enqueue(self, method, params=None, _id=None):
+        if self._batch_size <= 1:
+            return asyncio.ensure_future(
+                self._request(method, params, _id), loop=self._loop)
+
+        fut = self._loop.create_future()
+        self._pending.append((method, params or [], fut))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+        elif self._flusher is None:
+            if self._batch_delay > 0:
+                self._flusher = self._loop.call_later(self._batch_delay,
+                                                      self._flush)
+            else:
+                self._flusher = self._loop.call_soon(self._flush)
+        return fut
+
+    def _flush(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        calls, self._pending = self._pending, []
+        if len(calls) == 1:
+            asyncio.ensure_future(self._send_one(*calls[0]),
+                                  loop=self._loop)
+        elif calls:
+            asyncio.ensure_future(self._send_batch(calls), loop=self._loop)
+
+    async def _send_one(self, method, params, fut):
+        try:
+            result = await self._request(method, params)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _request(self, method, params=None, _id=None):
+        data = {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params or [],
+            'id': _id or 1,
+        }
+        if self.is_ipc:
+            response = await self._post_ipc(data)
+        else:
+            response = await self._post_http(data)
+        if not isinstance(response, dict):
+            raise BadJsonError('Invalid received json from node.')
+        try:
+            return response['result']
+        except KeyError:
+            raise BadResponseError(response['error']['message'],
+                                   response['error']['code'])
+
+    async def _send_batch(self, calls):
+        data = [{
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params,
+            'id': i,
+        } for i, (method, params, _) in enumerate(calls)]
+        self.batches += 1
+        try:
+            if self.is_ipc:
+                responses = await self._post_ipc(data)
+            else:
+                responses = await self._post_http(data)
+            if not isinstance(responses, list):
+                raise BadJsonError('Invalid received batch from node.')
+        except Exception as e:
+            for _, _, fut in calls:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        by_id = {r.get('id'): r for r in responses}
+        for i, (method, _, fut) in enumerate(calls):
+            if fut.done():
+                continue
+            response = by_id.get(i)
+            if response is None:
+                fut.set_exception(
+                    BadJsonError('No response for %s in batch.' % method))
+            elif 'result' in response:
+                fut.set_result(response['result'])
+            else:
+                fut.set_exception(
+                    BadResponseError(response['error']['message'],
+                                     response['error']['code']))
+
+    async def _post_http(self, data):
+        client = self._client
+        scheme = 'https' if client.tls else 'http'
+        url = '{}://{}:{}'.format(scheme, client.host, client.port)
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(loop=self._loop)
+        try:
+            # timeout covers reading the body too
+            with async_timeout.timeout(client._timeout, loop=self._loop):
+                r = await self._session.post(
+                    url=url,
+                    data=codec.dumps(data),
+                    headers={'Content-Type': 'application/json'})
+                try:
+                    if r.status != 200:
+                        raise BadStatusError(r.status)
+                    body = await r.read()
+                finally:
+                    await r.release()
+        except aiohttp.ClientConnectorError as e:
+            raise ConnectionError(e)
+
+        try:
+            return codec.loads(body)
+        except ValueError:
+            raise BadJsonError('Invalid received json from node.')
+
+    async def _post_ipc(self, data):
+        client = self._client
+        with (await client._lock):
+            client._writer.write(codec.dumps(data))
+            b = await asyncio.wait_for(self._read_line(client._reader),
+                                       client._timeout, loop=self._loop)
+        if not b:
+            raise ConnectionError('Didn\'t receive any data, '
+                                  'connection refused.')
+        try:
+            return codec.loads(b)
+        except ValueError:
+            raise BadJsonError('Invalid received json from node.')
+
+    async def _read_line(self, reader):
+        # batch responses easily outgrow the stream reader limit
+        chunks = []
+        while True:
+            try:
+                chunks.append(await reader.readuntil(b'\n'))
+            except asyncio.LimitOverrunError as e:
+                chunks.append(await reader.readexactly(e.consumed))
+            except asyncio.IncompleteReadError as e:
+                chunks.append(e.partial)
+            else:
+                return b''.join(chunks)
+            if not chunks[-1]:
+                return b''.join(chunks)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class UpstreamNode:
+
+    def __init__(self, uri, client):
+        self.uri = uri
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.head = None
+
+    @property
+    def stats(self):
+        return {
+            'uri': self.uri,
+            'outstanding': self.outstanding,
+            'healthy': self.healthy,
+            'head': self.head,
+        }
+
+
+class UpstreamPool(RpcMixin):
+    """Spreads calls over several nodes.
+
+    The first node is the wallet node, it gets every call depending on
+    keys or filters, head reads and reads of 'latest' or 'pending'
+    state. Other calls go to the healthy node with the least outstanding
+    requests, lookups answered with null there are retried on the wallet
+    node, which may know a block or transaction a lagging node does not.
+    Reads of state at a block number only go to nodes whose head seen by
+    the last ``check`` has that block, or to the wallet node.
+    ``check`` ejects nodes lagging more than ``max_lag`` blocks behind
+    the best one and brings them back once they catch up.
+
+    Idempotent reads not answered within ``hedge_percentile`` of recent
+    latencies of their method are sent to a second node too, the first
+    answer wins. Hedges are limited to ``hedge_budget`` share of reads.
+    """
+
+    # latencies kept per method and how often its hedge delay is refreshed
+    hedge_window = 1000
+    hedge_refresh = 50
+    hedge_min_samples = 20
+
+    def __init__(self, nodes, max_lag=3, hedge_percentile=95,
+                 hedge_budget=0.05, *, loop=None):
+        self._log = logging.getLogger('upstream')
+        self._nodes = nodes
+        self._wallet = nodes[0]
+        self._max_lag = max_lag
+        self._hedge_percentile = hedge_percentile
+        self._hedge_budget = hedge_budget
+        self._loop = loop or asyncio.get_event_loop()
+        self._latencies = {}
+        self.reads = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.retries = 0
+
+    @property
+    def is_ipc(self):
+        return self._wallet.client.is_ipc
+
+    @property
+    def unix_path(self):
+        return self._wallet.client.unix_path
+
+    @property
+    def batches(self):
+        return sum(node.client.batches for node in self._nodes)
+
+    @property
+    def deduplicated(self):
+        return sum(node.client.deduplicated for node in self._nodes)
+
+    @property
+    def stats(self):
+        return [node.stats for node in self._nodes]
+
+    @property
+    def hedge_stats(self):
+        return {
+            'reads': self.reads,
+            'fired': self.hedges,
+            'won': self.hedges_won,
+        }
+
+    async def _call(self, method, params=None, _id=None):
+        if is_wallet_method(method) or is_head_read(method, params):
+            return await self._call_node(self._wallet, method, params, _id)
+
+        height = state_height(method, params)
+        node = self._pick(height=height)
+        delay = self._hedge_delay(method)
+        if delay is None:
+            result = await self._call_node(node, method, params, _id)
+        else:
+            self.reads += 1
+            result = await self._hedged_call(node, method, params, _id,
+                                             delay, height)
+        if result is None and method in LOOKUP_METHODS and \
+                node is not self._wallet:
+            self.retries += 1
+            result = await self._call_node(self._wallet, method, params, _id)
+        return result
+
+    async def _call_node(self, node, method, params=None, _id=None):
+        node.outstanding += 1
+        started = self._loop.time()
+        try:
+            result = await node.client._call(method, params, _id)
+        finally:
+            node.outstanding -= 1
+        self._observe(method, self._loop.time() - started)
+        return result
+
+    async def _hedged_call(self, node, method, params, _id, delay,
+                           height=None):
+        first = asyncio.ensure_future(
+            self._call_node(node, method, params, _id), loop=self._loop)
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay,
+                                         loop=self._loop)
+            backup = self._pick(exclude=node, height=height)
+            if done or backup is None or \
+                    self.hedges >= self._hedge_budget * self.reads:
+                return await first
+
+            self.hedges += 1
+            UPSTREAM_HEDGES.inc(method, 'fired')
+            tasks.append(asyncio.ensure_future(
+                self._call_node(backup, method, params, _id),
+                loop=self._loop))
+            pending = tasks
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, loop=self._loop,
+                    return_when=asyncio.FIRST_COMPLETED)
+                # failed answer loses while the other may still succeed
+                succeeded = [task for task in done
+                             if task.exception() is None]
+                if succeeded or not pending:
+                    winner = succeeded[0] if succeeded else done.pop()
+                    break
+            if winner is not first:
+                self.hedges_won += 1
+                UPSTREAM_HEDGES.inc(method, 'won')
+            return winner.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _pick(self, exclude=None, height=None):
+        # lagging node answers state at a block it lacks with an error
+        healthy = [node for node in self._nodes
+                   if node.healthy and node is not exclude and (
+                       height is None or node is self._wallet or
+                       (node.head is not None and node.head >= height))]
+        if exclude is not None:
+            return min(healthy, key=lambda node: node.outstanding,
+                       default=None)
+        return min(healthy or [self._wallet],
+                   key=lambda node: node.outstanding)
+
+    def _observe(self, method, elapsed):
+        entry = self._latencies.get(method)
+        if entry is None:
+            entry = self._latencies[method] = [
+                deque(maxlen=self.hedge_window), 0, None]
+        window = entry[0]
+        window.append(elapsed)
+        entry[1] += 1
+        if entry[1] >= self.hedge_min_samples and (
+                entry[2] is None or entry[1] % self.hedge_refresh == 0):
+            latencies = sorted(window)
+            index = int(len(latencies) * self._hedge_percentile / 100)
+            entry[2] = latencies[min(index, len(latencies) - 1)]
+
+    def _hedge_delay(self, method):
+        if (not self._hedge_percentile or method not in IDEMPOTENT_METHODS or
+                len(self._nodes) < 2):
+            return None
+        entry = self._latencies.get(method)
+        return entry[2] if entry is not None else None
+
+    async def check(self):
+        heads = await asyncio.gather(*(
+            node.client.eth_blockNumber() for node in self._nodes),
+            loop=self._loop, return_exceptions=True)
+        best = max((head for head in heads if isinstance(head, int)),
+                   default=None)
+        for node, head in zip(self._nodes, heads):
+            if isinstance(head, Exception):
+                self._log.warning('Node %s check failed: %s', node.uri, head)
+                head = None
+            node.head = head
+            healthy = (head is not None and
+                       best - head <= self._max_lag)
+            if healthy != node.healthy:
+                self._log.warning('Node %s is %s (head %s, best %s)',
+                                  node.uri,
+                                  'back' if healthy else 'ejected',
+                                  head, best)
+            node.healthy = healthy
+
+    def close(self):
+        for node in self._nodes:
+            node.client.close()
@@ -0,0 +1,148 @@
+import fcntl
+import logging
+import os
+import signal
+import socket
+import stat
+import time
+
+
+def supervise(count, before_fork=None, after_fork=None, respawn_delay=1):
+    """Fork ``count`` worker processes and fork a new one whenever a
+    worker exits, until the master gets SIGTERM or SIGINT, then workers
+    are terminated and waited for.
+
+    Returns False in workers, which go on serving, and True in the master
+    once every worker exited. ``before_fork`` and ``after_fork`` are
+    called around every fork, the latter in both processes. A worker
+    exiting within ``respawn_delay`` seconds is forked again after that
+    delay, so a crashing worker doesn't spin the master.
+
+    Must be called before the event loop is used, workers have to
+    create their own loop because selector is shared with the master.
+    """
+    log = logging.getLogger('supervisor')
+    workers = {}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def spawn():
+        if before_fork is not None:
+            before_fork()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+        else:
+            workers[pid] = time.monotonic()
+        if after_fork is not None:
+            after_fork()
+        return pid
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(count):
+        if not spawn():
+            return False
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        log.warning('Worker %s exited with status %s, forking new one.',
+                    pid, status)
+        if time.monotonic() - started < respawn_delay:
+            time.sleep(respawn_delay)
+        if not stopping and not spawn():
+            return False
+    return True
+
+
+def bind_unix_socket(path, mode=0o660):
+    """Bind stream socket to ``path`` with file ``mode``. Bound once
+    before fork, the listening socket is shared by all workers.
+
+    A socket file left by a server which didn't exit cleanly is
+    replaced, the one of a running server is not.
+    """
+    try:
+        is_socket = stat.S_ISSOCK(os.stat(path).st_mode)
+    except FileNotFoundError:
+        is_socket = False
+    if is_socket:
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        os.chmod(path, mode)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class ElectionLock:
+    """Exclusive non-blocking ``flock`` on ``path`` electing the one
+    worker which runs the Poller.
+
+    The kernel drops the lock when its holder exits, so the next
+    ``acquire`` of another worker succeeds and it takes over polling.
+    The holder writes its pid and, through ``record``, the last notified
+    block height to the file. ``height`` is the one left by the previous
+    holder, so the new one resumes notifications from it.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+        self.height = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        state = os.read(fd, 64).split()
+        self.height = int(state[1]) if len(state) > 1 else None
+        self._fd = fd
+        self.record(self.height)
+        return True
+
+    def record(self, height):
+        """Write pid of holder and last notified ``height``."""
+        self.height = height
+        state = str(os.getpid())
+        if height is not None:
+            state += ' %s' % height
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, state.encode('utf-8'), 0)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
@@ -41,7 +41,7 @@ setup(
     author_email='bogdankurinniy.dev1@gmail.com',
     url='https://github.com/DeV1doR/ethereumd-proxy',
     license='MIT',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=True,
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -63,6 +63,9 @@ setup(
         'ujson==1.35',
         'aioethereum==0.1.0',
     ],
+    extras_require={
+        'orjson': ['orjson'],
+    },
     entry_points='''
     [console_scripts]
     ethereum-cli=ethereum_cli:cli
@@ -1,5 +1,89 @@
+import asyncio
+
+from asynctest.mock import CoroutineMock, Mock
 from aioethereum.errors import BadResponseError
 
+from ethereumd.upstream import UpstreamNode, UpstreamPool
+
+
+ACCOUNT = '0xf5041fe398062cd63b62bd9b5df9942d30c9b8ca'
+RECIPIENT = '0x85521e2663efd02fef594a9b90b0dbe3aec590ac'
+MINER = '0x%040x' % 0
+
+
+def fake_block(number, transactions=(), parent=None, bhash=None,
+               miner=MINER):
+    """Block of height ``number`` with ``transactions`` objects. Hashes
+    derive from height, a block with ``parent`` given is put on a side
+    branch with a hash of its own.
+    """
+    if bhash is None:
+        bhash = '0x%064x' % (number if parent is None else number + 10 ** 9)
+    return {
+        'number': hex(number),
+        'hash': bhash,
+        'parentHash': parent or '0x%064x' % (number - 1),
+        'timestamp': hex(1500000000 + number),
+        'miner': miner,
+        'transactions': list(transactions),
+    }
+
+
+def fake_tr(number, from_=ACCOUNT, to=RECIPIENT):
+    """Transaction mined in block ``number`` of :func:`fake_block`."""
+    return {
+        'hash': '0x%064x' % (number + 10 ** 6),
+        'from': from_,
+        'to': to,
+        'value': '0xde0b6b3a7640000',
+        'gas': '0x15f90',
+        'gasPrice': '0x0',
+        'blockNumber': hex(number),
+        'blockHash': '0x%064x' % number,
+        'input': '0x',
+    }
+
+
+def fake_chain_call(chain, balances, accounts=(), delay=0.01, *,
+                    loop=None):
+    """``_call`` of node with blocks ``chain`` answering in ``delay``
+    seconds. State at a block beyond its head is an error, as on geth.
+    """
+
+    async def _call(method, params=None, _id=None):
+        await asyncio.sleep(delay, loop=loop)
+        head = len(chain) - 1
+        if method == 'eth_blockNumber':
+            return hex(head)
+        elif method == 'eth_accounts':
+            return list(accounts)
+        elif method == 'eth_getBlockByNumber':
+            height = head if params[0] == 'latest' else int(params[0], 16)
+            return chain[height] if height <= head else None
+        elif method == 'eth_getBalance':
+            if params[1].startswith('0x') and int(params[1], 16) > head:
+                raise BadResponseError('header not found', code=-32000)
+            return hex(balances.get(params[0], 0))
+        raise BadResponseError(
+            'The method %s does not exist/is not available' % method,
+            code=-32601)
+    return _call
+
+
+def fake_chain_pool(chain, heads, balances, accounts=(), *, loop=None):
+    """UpstreamPool of nodes having ``chain`` up to ``heads``, the first
+    one is the wallet node. Blocks appended to ``client.chain`` of a node
+    are mined on it.
+    """
+    nodes = []
+    for i, head in enumerate(heads):
+        client = Mock(batches=0, deduplicated=0, chain=chain[:head + 1])
+        client._call = CoroutineMock(side_effect=fake_chain_call(
+            client.chain, balances, accounts, loop=loop))
+        client.eth_blockNumber = CoroutineMock(return_value=head)
+        nodes.append(UpstreamNode('http://node%s' % i, client))
+    return UpstreamPool(nodes, max_lag=3, loop=loop)
+
 
 def fake_call(methods='*'):
 
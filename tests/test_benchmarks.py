@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks import codec, listener
+from benchmarks.fakenode import FakeChain, RPCError
+from benchmarks.run import run
+
+from .base import BaseTestRunner
+
+
+class TestFakeNode(BaseTestRunner):
+
+    def test_chain(self):
+        chain = FakeChain(blocks=5, txs_per_block=4, accounts=2)
+        assert chain.call('eth_blockNumber', []) == '0x4'
+        block = chain.call('eth_getBlockByNumber', ['0x3', False])
+        assert len(block['transactions']) == 4
+        assert block['parentHash'] == chain.blocks[2]['hash']
+        full = chain.call('eth_getBlockByHash', [block['hash'], True])
+        tr = full['transactions'][0]
+        assert chain.call('eth_getTransactionByHash', [tr['hash']]) == tr
+        assert tr['to'] in chain.accounts
+        assert len(chain.wallet_transactions) == 10
+        with pytest.raises(RPCError):
+            chain.call('eth_unknown', [])
+
+    def test_filters(self):
+        chain = FakeChain(blocks=1)
+        filter_id = chain.call('eth_newBlockFilter', [])
+        block = chain.mine()
+        assert chain.call('eth_getFilterChanges', [filter_id]) == \
+            [block['hash']]
+        assert chain.call('eth_getFilterChanges', [filter_id]) == []
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('transport', ['http', 'ipc'])
+    async def test_benchmark_run(self, event_loop, transport):
+        chain = FakeChain(blocks=20, txs_per_block=4, accounts=2)
+        result = await run(chain, 0, transport, 5, 2,
+                           ('getblock', 'listsinceblock'), 0, event_loop)
+        assert set(result['methods']) == {'getblock', 'listsinceblock'}
+        assert result['methods']['getblock']['requests'] == 5
+        assert result['poller']['blocks'] == 20
+
+    def test_codec_benchmark(self, event_loop):
+        chain = FakeChain(blocks=10, txs_per_block=4, accounts=2)
+        result = codec.run(chain, 2, event_loop)
+        assert result['transactions'] == 20
+        assert result['backends']['json']['speedup'] == 1
+
+    def test_listener_benchmark(self, event_loop):
+        chain = FakeChain(blocks=10, txs_per_block=4, accounts=2)
+        result = listener.run(chain, 5, event_loop)
+        for transport in ('tcp', 'unix'):
+            for mode in ('keepalive', 'connect'):
+                assert result['transports'][transport][mode]['requests'] == 5
@@ -0,0 +1,202 @@
+import time
+
+from ethereumd import codec
+from ethereumd.cache import BlockCache, BalanceCache, ResponseCache
+from ethereumd.codec import RawJSON
+from ethereumd.dispatch import build_table, MethodSpec
+from ethereumd.proxy import EthereumProxy
+
+from .base import BaseTestRunner
+from .fakers import fake_block
+
+
+class TestBlockCache(BaseTestRunner):
+
+    def test_get_by_hash_hit_and_miss(self):
+        cache = BlockCache()
+        block = fake_block(10)
+        assert cache.get_by_hash(block['hash']) is None
+        cache.put(block)
+        assert cache.get_by_hash(block['hash']) is block
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 1
+
+    def test_get_by_hash_without_tx_objects_from_full_block(self):
+        cache = BlockCache()
+        block = fake_block(10, transactions=[{'hash': '0x1'}, {'hash': '0x2'}])
+        cache.put(block, tx_objects=True)
+        cached = cache.get_by_hash(block['hash'], tx_objects=False)
+        assert cached['transactions'] == ['0x1', '0x2']
+        assert block['transactions'][0] == {'hash': '0x1'}
+
+    def test_pending_block_not_cached(self):
+        cache = BlockCache()
+        cache.put({'number': None, 'hash': None, 'transactions': []})
+        cache.put(None)
+        assert cache.stats['size'] == 0
+
+    def test_lru_eviction(self):
+        cache = BlockCache(maxsize=2)
+        first, second, third = fake_block(1), fake_block(2), fake_block(3)
+        cache.put(first, canonical=True)
+        cache.put(second, canonical=True)
+        cache.get_by_hash(first['hash'])
+        cache.put(third, canonical=True)
+        assert cache.get_by_hash(second['hash']) is None
+        assert cache.get_by_number(2) is None
+        assert cache.get_by_hash(first['hash']) is first
+        assert cache.stats['size'] == 2
+
+    def test_height_index_only_for_canonical_blocks(self):
+        cache = BlockCache()
+        cache.put(fake_block(5))
+        assert cache.get_by_number(5) is None
+        cache.put(fake_block(6), canonical=True)
+        assert cache.get_by_number(6) is not None
+
+    def test_head_change_drops_recent_heights(self):
+        cache = BlockCache(depth=12)
+        cache.set_head(100)
+        deep, recent = fake_block(80), fake_block(95)
+        cache.put(deep, canonical=True)
+        cache.put(recent, canonical=True)
+        cache.set_head(101)
+        assert cache.get_by_number(80) is deep
+        assert cache.get_by_number(95) is None
+        # block content by hash never changes
+        assert cache.get_by_hash(recent['hash']) is recent
+
+    def test_reorg_at_same_height_drops_recent_heights(self):
+        cache = BlockCache(depth=12)
+        cache.set_head(100, '0xa')
+        cache.put(fake_block(100, bhash='0xa'), canonical=True)
+        cache.set_head(100, '0xa')
+        assert cache.get_by_number(100) is not None
+        cache.set_head(100, '0xb')
+        assert cache.get_by_number(100) is None
+        assert cache.head == 100
+
+
+class TestBalanceCache(BaseTestRunner):
+
+    def test_recent_balances_dropped_on_new_head(self):
+        cache = BalanceCache(depth=12)
+        cache.set_head(100, '0xa')
+        cache.put('0x1', 80, 5)
+        cache.put('0x1', 95, 7)
+        assert cache.get('0x1', 80) == 5
+        assert cache.get('0x1', 95) == 7
+        cache.set_head(100, '0xa')
+        assert cache.get('0x1', 95) == 7
+        cache.set_head(100, '0xb')
+        assert cache.get('0x1', 95) is None
+        assert cache.get('0x1', 80) == 5
+        cache.put('0x1', 95, 8)
+        cache.set_head(110)
+        assert cache.get('0x1', 95) == 8
+        cache.set_head(111)
+        assert cache.get('0x1', 95) == 8
+        assert cache.stats['hits'] == 6 and cache.stats['misses'] == 1
+
+    def test_lru_eviction(self):
+        cache = BalanceCache(maxsize=2)
+        cache.set_head(100)
+        for height in range(3):
+            cache.put('0x1', height, height + 1)
+        assert cache.get('0x1', 0) is None
+        assert cache.get('0x1', 2) == 3
+        assert cache.stats['size'] == 2
+
+
+class FakeHead:
+
+    def __init__(self, number, bhash, fresh=True):
+        self.number = number
+        self.hash = bhash
+        self.fresh = fresh
+
+
+class TestResponseCache(BaseTestRunner):
+
+    def setup_method(self, method):
+        self.table = build_table()
+
+    def test_head_policy(self, event_loop):
+        head = FakeHead(10, '0xa')
+        cache = ResponseCache(head, loop=event_loop)
+        spec = self.table['getblockcount']
+        assert cache.get(spec, []) is None
+        body = cache.put(spec, [], 10, cache.head_state())
+        assert isinstance(body, RawJSON) and body == b'10'
+        assert cache.get(spec, []) == b'10'
+        head.number, head.hash = 11, '0xb'
+        assert cache.get(spec, []) is None
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 2
+
+    def test_head_policy_needs_fresh_head(self, event_loop):
+        head = FakeHead(10, '0xa', fresh=False)
+        cache = ResponseCache(head, loop=event_loop)
+        spec = self.table['getbestblockhash']
+        cache.put(spec, [], '0xa', cache.head_state())
+        assert cache.get(spec, []) is None
+        assert cache.stats['size'] == 0
+
+    def test_ttl_policy(self, event_loop):
+        cache = ResponseCache(ttl=0.05, loop=event_loop)
+        spec = self.table['getdifficulty']
+        cache.put(spec, [], 1.5)
+        assert cache.get(spec, []) == b'1.5'
+        time.sleep(0.06)
+        assert cache.get(spec, []) is None
+
+    def test_pending_argument_gets_ttl_policy(self, event_loop):
+        head = FakeHead(10, '0xa')
+        cache = ResponseCache(head, ttl=0.05, loop=event_loop)
+        spec = MethodSpec('getbalance', EthereumProxy.getbalance,
+                          cache='head', pending='minconf')
+        assert spec.cache_policy([None, 1]) == 'head'
+        assert spec.cache_policy([None, 0]) == 'ttl'
+        cache.put(spec, [None, 1], 1.5, cache.head_state())
+        cache.put(spec, [None, 0], 2.5, cache.head_state())
+        time.sleep(0.06)
+        assert cache.get(spec, [None, 1]) == b'1.5'
+        assert cache.get(spec, [None, 0]) is None
+
+    def test_pending_balances_not_cached_per_head(self):
+        assert self.table['getbalance'].cache_policy(['*', 0]) == 'ttl'
+        assert self.table['getbalance'].cache_policy(['*', 6]) == 'head'
+        assert self.table['listaccounts'].cache_policy([0, True]) == 'ttl'
+        assert self.table['listaccounts'].cache_policy([1, True]) == 'head'
+
+    def test_confirmed_policy_splices_confirmations(self, event_loop):
+        head = FakeHead(100, '0xa')
+        cache = ResponseCache(head, depth=12, loop=event_loop)
+        spec = self.table['getblock']
+        args = ['0x1', True]
+        deep = {'hash': '0x1', 'confirmations': 20, 'tx': []}
+        cache.put(spec, args, deep, cache.head_state())
+        head.number, head.hash = 105, '0xb'
+        assert codec.loads(cache.get(spec, args)) == \
+            dict(deep, confirmations=25)
+
+        recent = {'hash': '0x2', 'confirmations': 3, 'tx': []}
+        cache.put(spec, ['0x2', True], recent, cache.head_state())
+        assert cache.get(spec, ['0x2', True]) is not None
+        head.number, head.hash = 106, '0xc'
+        assert cache.get(spec, ['0x2', True]) is None
+        assert cache.get(spec, args) is not None
+
+    def test_uncached_methods_and_eviction(self, event_loop):
+        head = FakeHead(10, '0xa')
+        cache = ResponseCache(head, maxsize=2, loop=event_loop)
+        assert cache.put(self.table['sendfrom'], [], '0xtx') == b'"0xtx"'
+        assert cache.stats['size'] == 0
+        spec = self.table['getblockhash']
+        for height in range(3):
+            cache.put(spec, [height], '0x%s' % height, cache.head_state())
+        assert cache.stats['size'] == 2
+        assert cache.get(spec, [0]) is None
+        assert cache.get(spec, [2]) == b'"0x2"'
+        cache.clear()
+        assert cache.stats['size'] == cache.stats['bytes'] == 0
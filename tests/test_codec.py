@@ -0,0 +1,51 @@
+import pytest
+
+from ethereumd import codec
+
+from .base import BaseTestRunner
+
+
+def installed_backends():
+    backends = []
+    for backend in codec.BACKENDS:
+        try:
+            codec.use(backend)
+        except ImportError:
+            continue
+        backends.append(backend)
+    codec.use()
+    return backends
+
+
+class TestCodec(BaseTestRunner):
+
+    def teardown_method(self, method):
+        codec.use()
+
+    @pytest.mark.parametrize('backend', installed_backends())
+    def test_roundtrip(self, backend):
+        codec.use(backend)
+        data = {'id': 1, 'result': [{'txid': '0x1', 'amount': 0.5,
+                                     'label': 'ünicode/'}], 'error': None}
+        encoded = codec.dumps(data)
+        assert isinstance(encoded, bytes)
+        assert codec.loads(encoded) == data
+        assert codec.loads(encoded.decode('utf-8')) == data
+
+    @pytest.mark.parametrize('backend', installed_backends())
+    def test_big_integers(self, backend):
+        codec.use(backend)
+        value = 2 ** 70
+        assert codec.loads(codec.dumps([value])) == [pytest.approx(value)]
+
+    @pytest.mark.parametrize('backend', installed_backends())
+    def test_invalid_json(self, backend):
+        codec.use(backend)
+        with pytest.raises(ValueError):
+            codec.loads(b'{"id": 1,')
+
+    def test_use(self):
+        assert codec.use() == installed_backends()[0]
+        assert codec.use('json') == codec.name == 'json'
+        with pytest.raises(ValueError):
+            codec.use('yaml')
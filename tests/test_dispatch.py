@@ -0,0 +1,98 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from ethereumd import codec
+from ethereumd.cache import ResponseCache
+from ethereumd.dispatch import build_table
+from ethereumd.server import RPCServer
+
+from .base import BaseTestRunner
+
+
+class TestDispatch(BaseTestRunner):
+
+    def test_table(self):
+        table = build_table()
+        assert 'help' in table
+        assert 'getblock' in table
+        assert '_get_confirmations' not in table
+        assert table['getblock'].readonly
+        assert table['getblock'].cache == 'confirmed'
+        assert table['getblockcount'].cache == 'head'
+        assert table['sendfrom'].cache is None
+        assert not table['sendfrom'].readonly
+        assert table['sendfrom'].concurrency == 'wallet'
+        assert table['getblockcount'].concurrency == 'parallel'
+
+    def test_bind_coerces_params(self):
+        table = build_table()
+        assert table['getblockhash'].bind(['5']) == ([5], None)
+        assert table['getblockhash'].bind([5.0]) == ([5], None)
+        assert table['getblockhash'].bind({'height': '7'}) == ([7], None)
+        assert table['getbalance'].bind([None, '6', 'false']) == \
+            ([None, 6, False], None)
+        assert table['sendtoaddress'].bind(['0x1', '0.1']) == \
+            (['0x1', 0.1, '', '', False], None)
+        assert table['getblock'].bind(['0x1']) == \
+            table['getblock'].bind({'blockhash': '0x1', 'verbose': 1})
+        assert table['listaccounts'].bind({}) == ([1, True], None)
+        assert table['getblockcount'].bind([]) == ([], None)
+
+    def test_bind_rejects_malformed_params(self):
+        table = build_table()
+        args, error = table['getblockhash'].bind(['tip'])
+        assert args is None and error['code'] == -3
+        assert table['getblockhash'].bind([True])[1]['code'] == -3
+        assert table['getblockhash'].bind([])[1]['code'] == -1
+        assert table['getblockhash'].bind([1, 2])[1]['code'] == -1
+        assert table['getblockhash'].bind({'number': 1})[1]['code'] == -1
+        assert table['getblockhash'].bind({})[1]['code'] == -1
+        assert table['getblockhash'].bind('1')[1]['code'] == -32602
+        assert table['gettransaction'].bind([1])[1]['code'] == -3
+
+    @pytest.mark.asyncio
+    async def test_server_dispatch(self, event_loop):
+        server = RPCServer(loop=event_loop)
+        server._proxy = Mock()
+        server._responses = ResponseCache(loop=event_loop)
+
+        async def getblockhash(height):
+            return '0x%x' % height
+        server._proxy.getblockhash = getblockhash
+
+        async def call(method, params):
+            return await server._dispatch({'jsonrpc': '2.0', 'id': 1,
+                                           'method': method,
+                                           'params': params})
+
+        response = await call('getblockhash', ['16'])
+        assert codec.loads(response['result']) == '0x10'
+        response = await call('_get_confirmations', [{}])
+        assert response['error']['code'] == -32601
+        response = await call(['getblockhash'], [])
+        assert response['error']['code'] == -32601
+        response = await call('getblockhash', ['tip'])
+        assert response['error']['code'] == -3
+
+    @pytest.mark.asyncio
+    async def test_wallet_methods_run_one_at_a_time(self, event_loop):
+        server = RPCServer(loop=event_loop)
+        server._proxy = Mock()
+        server._responses = ResponseCache(loop=event_loop)
+        running = []
+
+        async def walletlock(address):
+            running.append(address)
+            assert len(running) == 1
+            await asyncio.sleep(0.01, loop=event_loop)
+            running.remove(address)
+            return True
+        server._proxy.walletlock = walletlock
+
+        results = await asyncio.gather(*(
+            server._dispatch({'jsonrpc': '2.0', 'id': i,
+                              'method': 'walletlock', 'params': ['0x%s' % i]})
+            for i in range(3)), loop=event_loop)
+        assert [r['result'] for r in results] == [b'true'] * 3
@@ -0,0 +1,83 @@
+from asynctest.mock import patch, CoroutineMock, Mock
+import pytest
+
+from ethereumd.head import HeadTracker, RecentHeaders
+from ethereumd.proxy import EthereumProxy
+from ethereumd.cache import BlockCache
+
+from .base import BaseTestRunner
+
+
+BLOCK = {
+    'number': '0x63a',
+    'hash': ('0x6d18d84c577f99f8073c80ad5200c3da'
+             '0e5a64de98b4c07cb2d84a8786682360'),
+    'timestamp': '0x5981bf5e',
+    'transactions': [],
+}
+
+
+class TestHeadTracker(BaseTestRunner):
+
+    def test_set_block(self, event_loop):
+        tracker = HeadTracker(None, loop=event_loop)
+        assert tracker.fresh is False
+        tracker.set_block(BLOCK)
+        assert tracker.number == 0x63a
+        assert tracker.hash == BLOCK['hash']
+        assert tracker.timestamp == 0x5981bf5e
+        assert tracker.fresh is True
+
+    def test_stale_head(self, event_loop):
+        tracker = HeadTracker(None, max_staleness=3, loop=event_loop)
+        tracker.set_block(BLOCK)
+        with patch.object(event_loop, 'time',
+                          return_value=event_loop.time() + 4):
+            assert tracker.fresh is False
+
+    @pytest.mark.asyncio
+    async def test_proxy_answers_from_fresh_head(self, event_loop):
+        proxy = EthereumProxy(None, BlockCache())
+        proxy._head = HeadTracker(proxy, loop=event_loop)
+        proxy._head.set_block(BLOCK)
+        assert (await proxy.getblockcount()) == 0x63a
+        assert (await proxy.getbestblockhash()) == BLOCK['hash']
+
+    @pytest.mark.asyncio
+    async def test_head_never_moves_back(self, event_loop):
+        rpc = Mock()
+        rpc.eth_blockNumber = CoroutineMock(return_value=0x639)
+        proxy = EthereumProxy(rpc, BlockCache())
+        proxy._head = HeadTracker(proxy, max_staleness=-1, loop=event_loop)
+        proxy._set_head(BLOCK)
+        proxy._set_head(dict(BLOCK, number='0x639', hash='0x1'))
+        assert proxy._head.hash == BLOCK['hash']
+        assert (await proxy.getblockcount()) == 0x63a
+
+
+def header(height, bhash, parent):
+    return {'number': hex(height), 'hash': bhash, 'parentHash': parent}
+
+
+class TestRecentHeaders(BaseTestRunner):
+
+    def test_extends_chain(self):
+        headers = RecentHeaders(size=2)
+        assert headers.add(header(1, '0xa1', '0xa0')) == []
+        assert headers.add(header(2, '0xa2', '0xa1')) == []
+        assert headers.add(header(3, '0xa3', '0xa2')) == []
+        assert '0xa1' not in headers
+        assert '0xa3' in headers
+        assert headers.stats['size'] == 2
+        assert headers.stats['reorgs'] == 0
+
+    def test_reorg_by_parent_mismatch(self):
+        headers = RecentHeaders()
+        headers.add(header(1, '0xa1', '0xa0'))
+        headers.add(header(2, '0xa2', '0xa1'), ['0xt1'])
+        headers.add(header(3, '0xa3', '0xa2'))
+        orphaned = headers.add(header(3, '0xb3', '0xb2'))
+        assert orphaned == [('0xa3', ()), ('0xa2', ('0xt1',))]
+        assert headers.stats['reorgs'] == 1
+        assert headers.stats['orphaned'] == 2
+        assert headers.add(header(4, '0xb4', '0xb3')) == []
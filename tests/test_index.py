@@ -0,0 +1,116 @@
+import os
+import tempfile
+
+from asynctest.mock import Mock, CoroutineMock
+import pytest
+
+from ethereumd.index import TransactionIndex
+from ethereumd.proxy import EthereumProxy
+
+from .base import BaseTestRunner
+from .fakers import ACCOUNT, fake_block, fake_tr
+
+
+class TestTransactionIndex(BaseTestRunner):
+
+    def setup_method(self, method):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+    def teardown_method(self, method):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_add_block_and_resume(self):
+        index = TransactionIndex(self.path, start_height=10)
+        assert index.height == 9
+        index.add_block(fake_block(10), [fake_tr(10)])
+        index.close()
+
+        index = TransactionIndex(self.path, start_height=50)
+        assert index.start_height == 10
+        assert index.height == 10
+        assert index.hash == fake_block(10)['hash']
+        assert index.get(fake_tr(10)['hash'])['from'] == ACCOUNT
+        assert index.get('0x0') is None
+
+    def test_since(self):
+        index = TransactionIndex(self.path, start_height=1)
+        for number in range(1, 5):
+            index.add_block(fake_block(number), [fake_tr(number)])
+        rows = list(index.since(1, 3))
+        assert [tr['blockNumber'] for tr, _ in rows] == ['0x2', '0x3']
+        assert rows[0][1] == 1500000002
+
+    def test_rollback(self):
+        index = TransactionIndex(self.path, start_height=1)
+        for number in range(1, 5):
+            index.add_block(fake_block(number), [fake_tr(number)])
+        index.rollback(2)
+        assert index.height == 2
+        assert index.hash == fake_block(2)['hash']
+        assert index.get(fake_tr(3)['hash']) is None
+        assert index.covers(1) is True
+        assert index.covers(0) is False
+
+    @pytest.mark.asyncio
+    async def test_proxy_sync_index_with_reorg(self):
+        chain = [fake_block(n, transactions=[fake_tr(n)]) for n in range(6)]
+        index = TransactionIndex(self.path, start_height=1)
+
+        rpc = Mock()
+        rpc.eth_blockNumber = CoroutineMock(return_value=3)
+        rpc.eth_accounts = CoroutineMock(return_value=[ACCOUNT])
+        rpc.eth_getBlockByNumber = CoroutineMock(
+            side_effect=lambda height, tx_objects: chain[height])
+        rpc.eth_getTransactionReceipt = CoroutineMock(
+            return_value={'gasUsed': '0x5208'})
+        proxy = EthereumProxy(rpc, index=index)
+
+        assert (await proxy._sync_index()) == 3
+        assert index.get(fake_tr(3)['hash'])['gasUsed'] == '0x5208'
+
+        # block 3 orphaned by new branch
+        chain[3] = fake_block(3, parent=chain[2]['hash'])
+        chain[4] = fake_block(4, parent=chain[3]['hash'])
+        proxy._cache.clear()
+        rpc.eth_blockNumber = CoroutineMock(return_value=4)
+        assert (await proxy._sync_index()) == 4
+        assert index.hash == chain[4]['hash']
+        assert index.get(fake_tr(3)['hash']) is None
+
+    @pytest.mark.asyncio
+    async def test_proxy_indexes_fetched_blocks(self):
+        chain = [fake_block(n, transactions=[fake_tr(n)]) for n in range(6)]
+        index = TransactionIndex(self.path, start_height=1)
+        index.add_block(chain[1], [])
+
+        rpc = Mock()
+        rpc.eth_accounts = CoroutineMock(return_value=[ACCOUNT])
+        rpc.eth_getBlockByNumber = CoroutineMock()
+        rpc.eth_getTransactionReceipt = CoroutineMock(
+            return_value={'gasUsed': '0x5208'})
+        proxy = EthereumProxy(rpc, index=index)
+
+        await proxy._index_blocks([chain[3], chain[2]])
+        assert index.height == 3
+        assert index.get(fake_tr(2)['hash'])['gasUsed'] == '0x5208'
+        # gap is left to background sync
+        await proxy._index_blocks([chain[5]])
+        assert index.height == 3
+        assert rpc.eth_getBlockByNumber.call_count == 0
+
+    @pytest.mark.asyncio
+    async def test_rescanblockchain_resets_index(self):
+        index = TransactionIndex(self.path, start_height=1)
+        for number in range(1, 5):
+            index.add_block(fake_block(number), [fake_tr(number)])
+
+        rpc = Mock()
+        rpc.eth_blockNumber = CoroutineMock(return_value=4)
+        proxy = EthereumProxy(rpc, index=index)
+        assert (await proxy.rescanblockchain(2)) == {'start_height': 2,
+                                                     'stop_height': 4}
+        assert index.height == 1
+        assert index.get(fake_tr(3)['hash']) is None
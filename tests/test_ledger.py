@@ -0,0 +1,155 @@
+from asynctest.mock import Mock, CoroutineMock
+import pytest
+
+from ethereumd.ledger import BalanceLedger
+from ethereumd.proxy import EthereumProxy
+from ethereumd.utils import wei_to_ether
+
+from .base import BaseTestRunner
+from .fakers import fake_block, fake_chain_pool, fake_tr
+
+
+ACCOUNTS = ['0x%040x' % i for i in range(1, 6)]
+OUTSIDER = '0x%040x' % 999
+
+
+class FakeNode:
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.balances = {address: i * 10 ** 18
+                         for i, address in enumerate(ACCOUNTS, 1)}
+        self.accounts = list(ACCOUNTS)
+        self.balance_calls = []
+        self.rpc = Mock()
+        self.rpc.eth_blockNumber = CoroutineMock(
+            side_effect=lambda: len(self.chain) - 1)
+        self.rpc.eth_accounts = CoroutineMock(
+            side_effect=lambda: self.accounts)
+        self.rpc.eth_getBlockByNumber = CoroutineMock(
+            side_effect=lambda height, tx_objects: self.chain[height])
+        self.rpc.eth_getBalance = CoroutineMock(side_effect=self.get_balance)
+
+    def get_balance(self, address, block='latest'):
+        self.balance_calls.append((address, block))
+        return self.balances.get(address, 0)
+
+
+class TestBalanceLedger(BaseTestRunner):
+
+    def test_touched_accounts(self):
+        ledger = BalanceLedger()
+        ledger.reset(fake_block(1), {address: 0 for address in ACCOUNTS[:4]})
+        block = fake_block(2, [fake_tr(2, ACCOUNTS[0], OUTSIDER),
+                               fake_tr(2, OUTSIDER, ACCOUNTS[1])],
+                           miner=ACCOUNTS[2])
+        assert ledger.touched(block, ACCOUNTS) == ACCOUNTS[:3] + ACCOUNTS[4:]
+
+    def test_add_block_drops_removed_accounts(self):
+        ledger = BalanceLedger()
+        ledger.reset(fake_block(1), {address: 0 for address in ACCOUNTS})
+        ledger.add_block(fake_block(2), {ACCOUNTS[0]: 5}, ACCOUNTS[:3])
+        assert ledger.balances == {ACCOUNTS[0]: 5, ACCOUNTS[1]: 0,
+                                   ACCOUNTS[2]: 0}
+        assert ledger.stats == {'accounts': 3, 'height': 2, 'loads': 1,
+                                'updates': 1}
+
+
+class TestProxyLedger(BaseTestRunner):
+
+    @pytest.mark.asyncio
+    async def test_updates_only_touched_accounts(self):
+        node = FakeNode([fake_block(n) for n in range(3)])
+        proxy = EthereumProxy(node.rpc, ledger=BalanceLedger(),
+                              balance_concurrency=2)
+
+        assert (await proxy.getbalance()) == wei_to_ether(15 * 10 ** 18)
+        assert len(node.balance_calls) == len(ACCOUNTS)
+        assert set(block for _, block in node.balance_calls) == {2}
+
+        node.balance_calls.clear()
+        assert (await proxy.listaccounts())[ACCOUNTS[0]] == 1
+        assert node.balance_calls == []
+
+        node.balances[ACCOUNTS[0]] = 0
+        node.balances[ACCOUNTS[3]] += 10 ** 18
+        node.chain.append(
+            fake_block(3, [fake_tr(3, ACCOUNTS[0], ACCOUNTS[3])]))
+        accounts = await proxy.listaccounts()
+        assert sorted(node.balance_calls) == [(ACCOUNTS[0], 3),
+                                              (ACCOUNTS[3], 3)]
+        assert accounts[ACCOUNTS[0]] == 0
+        assert accounts[ACCOUNTS[3]] == 5
+        assert (await proxy.getbalance(ACCOUNTS[3])) == 5
+
+    @pytest.mark.asyncio
+    async def test_reloads_on_reorg_and_refresh(self):
+        node = FakeNode([fake_block(n) for n in range(3)])
+        ledger = BalanceLedger()
+        proxy = EthereumProxy(node.rpc, ledger=ledger)
+        await proxy.getbalance()
+
+        node.chain[2] = fake_block(2, parent=node.chain[1]['hash'])
+        node.chain.append(fake_block(3, parent=node.chain[2]['hash']))
+        await proxy.getbalance()
+        assert ledger.loads == 2
+        assert ledger.hash == node.chain[3]['hash']
+
+        node.balances[ACCOUNTS[0]] = 0
+        assert (await proxy.listaccounts())[ACCOUNTS[0]] == 1
+        assert (await proxy.refreshbalances()) == {'accounts': 5,
+                                                   'height': 3}
+        assert (await proxy.listaccounts())[ACCOUNTS[0]] == 0
+
+    @pytest.mark.asyncio
+    async def test_without_ledger(self):
+        node = FakeNode([fake_block(n) for n in range(3)])
+        proxy = EthereumProxy(node.rpc)
+        assert (await proxy.getbalance()) == 15
+        assert (await proxy.getbalance()) == 15
+        # balances at head are cached until it moves
+        assert len(node.balance_calls) == len(ACCOUNTS)
+        node.chain.append(fake_block(3))
+        assert (await proxy.getbalance()) == 15
+        assert len(node.balance_calls) == 2 * len(ACCOUNTS)
+
+    @pytest.mark.asyncio
+    async def test_minconf_reads_balances_at_height(self):
+        node = FakeNode([fake_block(n) for n in range(10)])
+        proxy = EthereumProxy(node.rpc, ledger=BalanceLedger())
+        await proxy.listaccounts()
+
+        node.balance_calls.clear()
+        assert (await proxy.getbalance(None, 6)) == 15
+        assert set(block for _, block in node.balance_calls) == {4}
+        node.balance_calls.clear()
+        await proxy.listaccounts(6)
+        await proxy.getbalance(ACCOUNTS[0], 6)
+        assert node.balance_calls == []
+
+        assert (await proxy.getbalance(OUTSIDER, 3)) == 0
+        assert node.balance_calls == [(OUTSIDER, 7)]
+        assert (await proxy.getbalance(None, 11)) == 0
+        assert (await proxy.getbalance('*', 6)) == 15
+
+        node.balance_calls.clear()
+        await proxy.listaccounts(0)
+        assert set(block for _, block in node.balance_calls) == {'pending'}
+
+    @pytest.mark.asyncio
+    async def test_syncs_over_pool_with_lagging_node(self, event_loop):
+        balances = {address: 10 ** 18 for address in ACCOUNTS}
+        pool = fake_chain_pool([fake_block(n) for n in range(11)], (10, 9),
+                               balances, ACCOUNTS, loop=event_loop)
+        await pool.check()
+        ledger = BalanceLedger()
+        proxy = EthereumProxy(pool, ledger=ledger)
+        assert (await proxy.getbalance()) == 5
+
+        # read node stays behind the block balances are updated at
+        balances[ACCOUNTS[0]] = 0
+        pool._nodes[0].client.chain.append(
+            fake_block(11, [fake_tr(11, ACCOUNTS[0], OUTSIDER)]))
+        assert (await proxy.getbalance(ACCOUNTS[0])) == 0
+        assert ledger.stats == {'accounts': 5, 'height': 11, 'loads': 1,
+                                'updates': 1}
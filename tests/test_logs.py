@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+from ethereumd.logs import LogPipeline
+
+from .base import BaseTestRunner
+
+
+def attach(pipeline, name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [pipeline._queue_handler or pipeline.handler]
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+class TestLogPipeline(BaseTestRunner):
+
+    def test_plain_file_without_colors(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'ethereumd.log')
+        pipeline = LogPipeline(logging.INFO, fname)
+        pipeline.start()
+        logger = attach(pipeline, 'tests.plain')
+        logger.debug('skipped')
+        logger.info('block %s', '0x1')
+        pipeline.stop()
+        with open(fname) as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 1
+        assert lines[0].endswith('block 0x1')
+        assert 'INFO' in lines[0] and '\x1b[' not in lines[0]
+
+    def test_json_format(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'ethereumd.log')
+        pipeline = LogPipeline(logging.INFO, fname, 'json')
+        pipeline.start()
+        logger = attach(pipeline, 'tests.json')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed %s', 'call')
+        pipeline.stop()
+        with open(fname) as f:
+            record = json.loads(f.readline())
+        assert record['message'] == 'failed call'
+        assert record['level'] == 'ERROR'
+        assert record['logger'] == 'tests.json'
+        assert 'ValueError: boom' in record['exc']
+
+    def test_overflow_drops_without_blocking(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'ethereumd.log')
+        pipeline = LogPipeline(logging.DEBUG, fname, queue_size=10)
+        emit = pipeline.handler.emit
+
+        def slow_emit(record):
+            time.sleep(0.01)
+            emit(record)
+        pipeline.handler.emit = slow_emit
+        pipeline.start()
+        logger = attach(pipeline, 'tests.storm')
+        started = time.perf_counter()
+        for i in range(1000):
+            logger.debug('storm %s', i)
+        elapsed = time.perf_counter() - started
+        pipeline.stop()
+        assert elapsed < 0.5
+        assert pipeline.dropped > 900
+        with open(fname) as f:
+            written = len(f.readlines())
+        assert written + pipeline.dropped == 1000
+
+    def test_size_rotation(self):
+        fname = os.path.join(tempfile.mkdtemp(), 'ethereumd.log')
+        pipeline = LogPipeline(logging.INFO, fname, queue_size=0,
+                               max_bytes=1000, backups=2)
+        logger = attach(pipeline, 'tests.rotation')
+        for i in range(100):
+            logger.info('line %s', i)
+        pipeline.stop()
+        assert os.path.exists(fname + '.1')
+        assert os.path.exists(fname + '.2')
+        assert not os.path.exists(fname + '.3')
+        assert os.path.getsize(fname) <= 1000
@@ -0,0 +1,66 @@
+import asyncio
+
+from asynctest.mock import patch
+from aioethereum import AsyncIOHTTPClient
+import pytest
+
+from ethereumd import metrics
+from ethereumd.upstream import UpstreamClient, UPSTREAM_CALLS
+
+from .base import BaseTestRunner
+from .fakers import fake_call
+
+
+class TestMetrics(BaseTestRunner):
+
+    def test_counter_expose(self):
+        registry = metrics.Registry()
+        counter = registry.register(
+            metrics.Counter('calls_total', 'Calls.', ['method']))
+        counter.inc('getblock')
+        counter.inc('getblock')
+        counter.inc('get"info')
+        text = registry.expose()
+        assert '# TYPE calls_total counter' in text
+        assert 'calls_total{method="getblock"} 2' in text
+        assert 'calls_total{method="get\\"info"} 1' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Registry()
+        histogram = registry.register(
+            metrics.Histogram('latency_seconds', 'Latency.',
+                              buckets=(0.1, 1)))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        lines = registry.expose().splitlines()
+        assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{le="1"} 2' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+        assert 'latency_seconds_count 3' in lines
+        assert 'latency_seconds_sum 5.55' in lines
+
+    def test_gauge(self):
+        registry = metrics.Registry()
+        registry.register(metrics.Gauge('depth', 'Depth.', lambda: 7))
+        assert 'depth 7' in registry.expose().splitlines()
+
+    @pytest.mark.asyncio
+    async def test_upstream_calls_recorded(self, event_loop):
+        rpc = UpstreamClient(AsyncIOHTTPClient(loop=event_loop),
+                             loop=event_loop)
+        before = UPSTREAM_CALLS.get('eth_accounts', 'ok')
+        with patch.object(UpstreamClient, '_request',
+                          side_effect=fake_call()):
+            await rpc.eth_accounts()
+        assert UPSTREAM_CALLS.get('eth_accounts', 'ok') == before + 1
+
+    @pytest.mark.asyncio
+    async def test_loop_lag_monitor(self, event_loop):
+        before = metrics.LOOP_LAG.count()
+        task = asyncio.ensure_future(
+            metrics.monitor_loop_lag(0.01, loop=event_loop),
+            loop=event_loop)
+        await asyncio.sleep(0.05, loop=event_loop)
+        task.cancel()
+        assert metrics.LOOP_LAG.count() > before
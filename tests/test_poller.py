@@ -1,9 +1,16 @@
+import asyncio
+import json
+import os
+import tempfile
+
 from asynctest import return_once
-from asynctest.mock import patch, CoroutineMock
+from asynctest.mock import patch, CoroutineMock, Mock
 import pytest
 
 from ethereumd.poller import Poller, alertnotify
-from aioethereum import AsyncIOHTTPClient
+from ethereumd.proxy import EthereumProxy
+from ethereumd.sinks import create_sink
+from ethereumd.upstream import UpstreamClient
 from aioethereum.errors import BadResponseError
 
 from .base import BaseTestRunner, setup_proxies
@@ -21,6 +28,7 @@ class FakePoller(Poller):
         if alertnotify:
             cmds['alertnotify'] = alertnotify
         self._cmds = cmds
+        self._sinks = {name: create_sink(spec) for name, spec in cmds.items()}
 
 
 class TestPoller(BaseTestRunner):
@@ -78,19 +86,36 @@ class TestPoller(BaseTestRunner):
     async def test_call_blocknotify_and_has_block(self):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy, cmds={'blocknotify': 'echo "%s"'})
-        with patch.object(AsyncIOHTTPClient, '_call', side_effect=fake_call()):
+        with patch.object(UpstreamClient, '_request', side_effect=fake_call()):
             with patch.object(Poller, '_exec_command',
                               side_effect=lambda x, y: None) as exec_mock:
                 assert exec_mock.call_count == 0
                 await poller.blocknotify()
                 assert exec_mock.call_count == 1
 
+    @pytest.mark.asyncio
+    @setup_proxies
+    async def test_call_blocknotify_fetches_block_once(self):
+        with patch('ethereumd.poller.Poller.poll'):
+            poller = Poller(self.rpc_proxy, cmds={'blocknotify': 'echo "%s"',
+                                                  'walletnotify': 'echo "%s"'})
+        with patch.object(UpstreamClient, '_request',
+                          side_effect=fake_call()) as call_mock:
+            with patch.object(Poller, '_exec_command',
+                              side_effect=lambda x, y: None):
+                await poller.blocknotify()
+        methods = [c[0][0] for c in call_mock.call_args_list]
+        assert methods.count('eth_getBlockByHash') == 1
+        assert 'eth_getTransactionByHash' not in methods
+        assert poller.stats['blocks'] == 1
+        assert poller.stats['upstream_calls_per_block'] == 3
+
     @pytest.mark.asyncio
     @setup_proxies
     async def test_call_blocknotify_and_has_no_block(self):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy, cmds={'blocknotify': 'echo "%s"'})
-        with patch.object(AsyncIOHTTPClient, '_call',
+        with patch.object(UpstreamClient, '_request',
                           side_effect=fake_call(['-eth_getFilterChanges'])):
             with patch.object(Poller, '_exec_command',
                               side_effect=lambda x, y: None) as exec_mock:
@@ -103,7 +128,7 @@ class TestPoller(BaseTestRunner):
     async def test_call_walletnotify_and_has_trans(self):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy, cmds={'walletnotify': 'echo "%s"'})
-        with patch.object(AsyncIOHTTPClient, '_call', side_effect=fake_call()):
+        with patch.object(UpstreamClient, '_request', side_effect=fake_call()):
             with patch.object(Poller, '_exec_command',
                               side_effect=lambda x, y: None) as exec_mock:
                 assert exec_mock.call_count == 0
@@ -115,7 +140,7 @@ class TestPoller(BaseTestRunner):
     async def test_call_walletnotify_and_has_no_trans(self):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy, cmds={'walletnotify': 'echo "%s"'})
-        with patch.object(AsyncIOHTTPClient, '_call',
+        with patch.object(UpstreamClient, '_request',
                           side_effect=fake_call(['-eth_getFilterChanges'])):
             with patch.object(Poller, '_exec_command',
                               side_effect=lambda x, y: None) as exec_mock:
@@ -160,8 +185,9 @@ class TestPoller(BaseTestRunner):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy)
 
-        with patch.object(AsyncIOHTTPClient, '_call', side_effect=fake_call()):
-            txid = '0x9c864dd0e7fdcfb3bd7197020ac311cbacef1aa29b49791223427bbedb6d36ad'
+        with patch.object(UpstreamClient, '_request', side_effect=fake_call()):
+            txid = ('0x9c864dd0e7fdcfb3bd7197020ac311cb'
+                    'acef1aa29b49791223427bbedb6d36ad')
             is_account_trans = await poller._is_account_trans(txid)
         assert is_account_trans is True
 
@@ -171,9 +197,10 @@ class TestPoller(BaseTestRunner):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy)
 
-        with patch.object(AsyncIOHTTPClient, '_call',
+        with patch.object(UpstreamClient, '_request',
                           side_effect=fake_call('-')):
-            txid = '0x9c864dd0e7fdcfb3bd7197020ac311cbacef1aa29b49791223427bbedb6d36ad'
+            txid = ('0x9c864dd0e7fdcfb3bd7197020ac311cb'
+                    'acef1aa29b49791223427bbedb6d36ad')
             is_account_trans = await poller._is_account_trans(txid)
         assert is_account_trans is False
 
@@ -183,7 +210,7 @@ class TestPoller(BaseTestRunner):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy)
 
-        with patch.object(AsyncIOHTTPClient, '_call', side_effect=fake_call()):
+        with patch.object(UpstreamClient, '_request', side_effect=fake_call()):
             # latest filter for blocks
             assert hasattr(poller, '_latest') is False, \
                 'Poller must not have here _latest attr'
@@ -204,7 +231,7 @@ class TestPoller(BaseTestRunner):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy)
 
-        with patch.object(AsyncIOHTTPClient, '_call',
+        with patch.object(UpstreamClient, '_request',
                           side_effect=fake_call('-')):
             with pytest.raises(KeyError) as excinfo:
                 await poller._build_filter('doesnotexists')
@@ -216,7 +243,7 @@ class TestPoller(BaseTestRunner):
         with patch('ethereumd.poller.Poller.poll'):
             poller = Poller(self.rpc_proxy)
 
-        with patch.object(AsyncIOHTTPClient, '_call',
+        with patch.object(UpstreamClient, '_request',
                           side_effect=return_once(
                               lambda: BadResponseError('test', code=-99999999),
                               then=fake_call())):
@@ -251,3 +278,191 @@ class TestPoller(BaseTestRunner):
 
         cmd_result = await poller._exec_command('alernotify', 'Some error')
         assert cmd_result is False
+
+
+class TestPollerWorkers(BaseTestRunner):
+
+    def make_poller(self, loop, **kwargs):
+        proxy = EthereumProxy(None)
+        return Poller(proxy, cmds={'walletnotify': 'sleep %s'},
+                      loop=loop, **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_same_key_runs_in_order(self, event_loop):
+        poller = self.make_poller(event_loop, workers=4)
+        order = []
+
+        async def hook(name, data):
+            await asyncio.sleep(0.01 if data == 'first' else 0)
+            order.append(data)
+
+        with patch.object(Poller, '_exec_command', side_effect=hook):
+            await poller._notify('walletnotify', 'first', key='tx')
+            await poller._notify('walletnotify', 'second', key='tx')
+            await asyncio.sleep(0.05)
+        poller.stop()
+        assert order == ['first', 'second']
+        assert poller._keys == {}
+        stats = poller.stats
+        assert stats['workers'] == 4
+        assert stats['queue'] == 0
+        assert stats['inflight'] == 0
+        assert stats['latency']['walletnotify']['count'] == 2
+
+    @pytest.mark.asyncio
+    async def test_different_keys_run_concurrently(self, event_loop):
+        poller = self.make_poller(event_loop, workers=2)
+        order = []
+
+        async def hook(name, data):
+            await asyncio.sleep(0.01 if data == 'first' else 0)
+            order.append(data)
+
+        with patch.object(Poller, '_exec_command', side_effect=hook):
+            await poller._notify('walletnotify', 'first', key='tx1')
+            await poller._notify('walletnotify', 'second', key='tx2')
+            await asyncio.sleep(0.05)
+        poller.stop()
+        assert order == ['second', 'first']
+
+    @pytest.mark.asyncio
+    async def test_busy_key_does_not_park_workers(self, event_loop):
+        poller = self.make_poller(event_loop, workers=2)
+        order = []
+
+        async def hook(name, data):
+            await asyncio.sleep(0.02 if name == 'blocknotify' else 0)
+            order.append(data)
+
+        with patch.object(Poller, '_exec_command', side_effect=hook):
+            for i in range(3):
+                await poller._notify('blocknotify', 'block%s' % i,
+                                     key='blocknotify')
+            await poller._notify('walletnotify', 'tx', key='tx')
+            await asyncio.sleep(0.01)
+            assert order == ['tx']
+            assert poller.stats['pending'] == 2
+            await asyncio.sleep(0.1)
+        poller.stop()
+        assert order == ['tx', 'block0', 'block1', 'block2']
+        assert poller._keys == {}
+
+    @pytest.mark.asyncio
+    async def test_pending_of_key_capped(self, event_loop):
+        poller = self.make_poller(event_loop, workers=2, max_pending=2)
+        order = []
+
+        async def hook(name, data):
+            await asyncio.sleep(0.02)
+            order.append(data)
+
+        with patch.object(Poller, '_exec_command', side_effect=hook):
+            for i in range(5):
+                await poller._notify('blocknotify', 'block%s' % i,
+                                     key='blocknotify')
+            await asyncio.sleep(0.01)
+            assert poller.stats['pending'] == 2
+            assert poller.stats['dropped'] == 2
+            await asyncio.sleep(0.1)
+        poller.stop()
+        assert order == ['block0', 'block3', 'block4']
+
+    @pytest.mark.asyncio
+    async def test_hung_command_killed(self, event_loop):
+        poller = self.make_poller(event_loop, timeout=0.1)
+        poller.stop()
+        started = event_loop.time()
+        assert await poller._exec_command('walletnotify', '10') is False
+        assert event_loop.time() - started < 5
+
+
+class TestPollerFollow(BaseTestRunner):
+
+    @pytest.mark.asyncio
+    async def test_watch_backs_off_while_idle(self, event_loop):
+        poller = Poller(EthereumProxy(None), loop=event_loop)
+        poller.stop()
+        job = CoroutineMock(side_effect=[1, 0, 0, 0, 0, 0])
+        with patch('asyncio.sleep', side_effect=[None] * 5 +
+                   [asyncio.CancelledError]) as sleep_mock:
+            with pytest.raises(asyncio.CancelledError):
+                await poller.watch(job, 0.1, 0.5)
+        intervals = [c[0][0] for c in sleep_mock.call_args_list]
+        assert intervals == [0.1, 0.2, 0.4, 0.5, 0.5, 0.5]
+
+    @pytest.mark.asyncio
+    async def test_subscribe_over_ipc(self, event_loop):
+        header = {'number': '0x1', 'hash': '0xb1', 'timestamp': '0x1'}
+
+        async def node(reader, writer):
+            request = json.loads((await reader.readline()).decode('utf-8'))
+            assert request['method'] == 'eth_subscribe'
+            assert request['params'] == ['newHeads']
+            writer.write(json.dumps({'jsonrpc': '2.0', 'id': request['id'],
+                                     'result': '0xs1'}).encode() + b'\n')
+            writer.write(json.dumps({
+                'jsonrpc': '2.0',
+                'method': 'eth_subscription',
+                'params': {'subscription': '0xs1', 'result': header},
+            }).encode() + b'\n')
+            writer.close()
+
+        path = os.path.join(tempfile.mkdtemp(), 'geth.ipc')
+        server = await asyncio.start_unix_server(node, path, loop=event_loop)
+        rpc = Mock(unix_path=path)
+        proxy = EthereumProxy(rpc)
+        poller = Poller(proxy, cmds={'blocknotify': 'echo "%s"'},
+                        loop=event_loop)
+        poller.stop()
+        with patch.object(Poller, '_process_blocks') as process_mock, \
+                patch.object(EthereumProxy, '_set_head') as head_mock:
+            with pytest.raises(ConnectionError):
+                await poller._subscribe({'newHeads': poller._on_head})
+        server.close()
+        process_mock.assert_called_once_with(['0xb1'])
+        head_mock.assert_called_once_with(header)
+
+    @pytest.mark.asyncio
+    async def test_rollbacknotify_on_reorg(self, event_loop):
+        def block(height, bhash, parent, txs=()):
+            return {'number': hex(height), 'hash': bhash,
+                    'parentHash': parent,
+                    'transactions': [{'hash': txid, 'from': '0xme',
+                                      'to': '0xother'} for txid in txs]}
+
+        rpc = Mock(eth_accounts=CoroutineMock(return_value=['0xme']))
+        poller = Poller(EthereumProxy(rpc),
+                        cmds={'rollbacknotify': 'echo "%s"'},
+                        loop=event_loop)
+        poller.stop()
+        blocks = [block(1, '0xa1', '0xa0'),
+                  block(2, '0xa2', '0xa1', ['0xt1']),
+                  block(2, '0xb2', '0xa1')]
+        with patch.object(Poller, '_get_blocks',
+                          side_effect=lambda bhashes: [blocks.pop(0)]), \
+                patch.object(Poller, '_notify') as notify_mock:
+            for bhash in ('0xa1', '0xa2', '0xb2'):
+                await poller._process_blocks([bhash])
+        notify_mock.assert_any_call('rollbacknotify', '0xa2 0xt1',
+                                    key='blocknotify')
+        assert poller.stats['headers']['reorgs'] == 1
+
+    @pytest.mark.asyncio
+    async def test_blocks_missed_after_last_height_notified(self, event_loop):
+        chain = [{'number': hex(height), 'hash': '0xa%s' % height,
+                  'parentHash': '0xa%s' % (height - 1), 'transactions': []}
+                 for height in range(10)]
+        rpc = Mock(eth_accounts=CoroutineMock(return_value=[]),
+                   eth_getBlockByHash=CoroutineMock(
+                       side_effect=lambda bhash: chain[int(bhash[3:])]),
+                   eth_getBlockByNumber=CoroutineMock(
+                       side_effect=lambda height, tx_objects: chain[height]))
+        poller = Poller(EthereumProxy(rpc), cmds={'blocknotify': 'echo'},
+                        loop=event_loop)
+        poller.stop()
+        poller.height = 5
+        with patch.object(Poller, '_notify') as notify_mock:
+            await poller._process_blocks(['0xa8'])
+        assert [c[0][1] for c in notify_mock.call_args_list] == [
+            '0xa6', '0xa7', '0xa8']
+        assert poller.height == 8
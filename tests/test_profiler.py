@@ -0,0 +1,48 @@
+import asyncio
+import pstats
+import tempfile
+import threading
+import time
+
+import pytest
+
+from ethereumd.profiler import SamplingProfiler
+
+from .base import BaseTestRunner
+
+
+async def busy_handler():
+    deadline = time.monotonic() + 0.2
+    while time.monotonic() < deadline:
+        sum(range(1000))
+        await asyncio.sleep(0)
+
+
+class TestSamplingProfiler(BaseTestRunner):
+
+    @pytest.mark.asyncio
+    async def test_samples_attributed_to_task(self, event_loop):
+        profiler = SamplingProfiler(threading.get_ident(), 0.001,
+                                    loop=event_loop)
+        task = asyncio.ensure_future(busy_handler(), loop=event_loop)
+        await event_loop.run_in_executor(None, profiler.run, 0.1)
+        await task
+        assert profiler.count > 0
+        collapsed = profiler.collapsed()
+        assert 'task busy_handler;' in collapsed
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            assert int(count) > 0
+
+    @pytest.mark.asyncio
+    async def test_pstats_output(self, event_loop):
+        profiler = SamplingProfiler(threading.get_ident(), 0.001,
+                                    loop=event_loop)
+        task = asyncio.ensure_future(busy_handler(), loop=event_loop)
+        await event_loop.run_in_executor(None, profiler.run, 0.1)
+        await task
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(profiler.pstats())
+            f.flush()
+            stats = pstats.Stats(f.name)
+        assert ('~', 0, 'task busy_handler') in stats.stats
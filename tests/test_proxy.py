@@ -1,12 +1,15 @@
+import asyncio
 from collections import Mapping
 
+from asynctest.mock import Mock, CoroutineMock
 import pytest
 
-from ethereumd.proxy import DEFAUT_FEE, GAS_PRICE
+from ethereumd.proxy import EthereumProxy, DEFAUT_FEE, GAS_PRICE
 from ethereumd.utils import hex_to_dec, gwei_to_ether
 from aioethereum.errors import BadResponseError
 
 from .base import BaseTestRunner, is_hex, setup_proxies, quick_unlock_account
+from .fakers import fake_block, fake_tr
 
 
 class TestBaseProxy(BaseTestRunner):
@@ -193,3 +196,35 @@ class TestBaseProxy(BaseTestRunner):
             response = await proxy.getblock(block['hash'])
             assert response['hash'] == block['hash'], \
                 'Hash not belongs to requested block'
+
+
+class TestProxyRangeScan(BaseTestRunner):
+
+    @pytest.mark.asyncio
+    async def test_listsinceblock_scans_by_chunks(self):
+        account = '0xf5041fe398062cd63b62bd9b5df9942d30c9b8ca'
+        blocks = [fake_block(n, [fake_tr(n, '0x1', account)])
+                  for n in range(26)]
+        in_flight, peak = [0], [0]
+
+        async def _get_block_by_number(block='latest', tx_objects=True):
+            if block == 'latest':
+                return blocks[-1]
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            await asyncio.sleep(0)
+            in_flight[0] -= 1
+            return blocks[block]
+
+        rpc = Mock()
+        rpc.eth_getBlockByNumber = CoroutineMock(
+            side_effect=_get_block_by_number)
+        rpc.eth_getBlockByHash = CoroutineMock(return_value=blocks[5])
+        rpc.eth_accounts = CoroutineMock(return_value=[account])
+        proxy = EthereumProxy(rpc, scan_chunk_size=7, scan_concurrency=3)
+
+        response = await proxy.listsinceblock(blocks[5]['hash'])
+        assert [tr['blockhash'] for tr in response['transactions']] == \
+            [b['hash'] for b in blocks[5:]]
+        assert response['lastblock'] == blocks[-1]['hash']
+        assert peak[0] == 3
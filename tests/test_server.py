@@ -11,7 +11,11 @@ from aioethereum.errors import BadResponseError
 from .base import BaseTestRunner
 
 
-Request = namedtuple('Request', ['json'])
+class Request(namedtuple('Request', ['json'])):
+
+    @property
+    def body(self):
+        return json.dumps(self.json).encode('utf-8')
 
 
 class TestServer(BaseTestRunner):
@@ -116,3 +120,38 @@ class TestServer(BaseTestRunner):
         assert parsed['error']['code'] == -99999999
         assert parsed['error']['message'] == 'test'
         assert parsed['result'] is None
+
+    @pytest.mark.asyncio
+    async def test_server_handler_index_batch_call(self, event_loop):
+        server = await self.init_server(event_loop)
+        data = [{
+            'jsonrpc': '2.0',
+            'method': 'getblockcount',
+            'params': [],
+            'id': 'first',
+        }, {
+            'jsonrpc': '2.0',
+            'method': 'getblockcount',
+            'id': 'second',
+        }, {
+            'jsonrpc': '2.0',
+            'method': 'getbestblockhash',
+            'params': [],
+            'id': 'third',
+        }]
+        request = Request(json=data)
+        response = await server.handler_index(request)
+        parsed = json.loads(response.body)
+        assert [r['id'] for r in parsed] == ['first', 'second', 'third']
+        assert isinstance(parsed[0]['result'], int)
+        assert parsed[1]['error']['code'] == -32602
+        assert parsed[2]['error'] is None
+
+    @pytest.mark.asyncio
+    async def test_server_handler_index_empty_batch_call(self, event_loop):
+        server = await self.init_server(event_loop)
+        request = Request(json=[])
+        response = await server.handler_index(request)
+        parsed = json.loads(response.body)
+        assert parsed['error']['code'] == -32602
+        assert parsed['result'] is None
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+
+from aiohttp import web
+import pytest
+
+from ethereumd.sinks import (create_sink, CommandSink, CallableSink,
+                             WebhookSink, UnixSocketSink)
+
+from .base import BaseTestRunner
+
+
+received = []
+
+
+def record(name, data):
+    received.append((name, data))
+
+
+class TestSinks(BaseTestRunner):
+
+    def test_create_sink(self, event_loop):
+        assert isinstance(create_sink('echo "%s"', loop=event_loop),
+                          CommandSink)
+        assert isinstance(create_sink('http://127.0.0.1:8000/hook',
+                                      loop=event_loop), WebhookSink)
+        assert isinstance(create_sink('unix:/tmp/notify.sock',
+                                      loop=event_loop), UnixSocketSink)
+        assert isinstance(create_sink('python:tests.test_sinks:record',
+                                      loop=event_loop), CallableSink)
+
+    @pytest.mark.asyncio
+    async def test_callable_sink(self, event_loop):
+        sink = create_sink('python:tests.test_sinks.record', loop=event_loop)
+        del received[:]
+        await sink.send('blocknotify', '0x1')
+        assert received == [('blocknotify', '0x1')]
+
+    @pytest.mark.asyncio
+    async def test_unix_socket_sink(self, event_loop):
+        lines = []
+
+        async def handle(reader, writer):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                lines.append(line)
+
+        path = os.path.join(tempfile.mkdtemp(), 'notify.sock')
+        server = await asyncio.start_unix_server(handle, path,
+                                                 loop=event_loop)
+        sink = UnixSocketSink(path, loop=event_loop)
+        await sink.send('blocknotify', '0x1')
+        await sink.send('walletnotify', '0x2')
+        sink.close()
+        await asyncio.sleep(0.05)
+        server.close()
+        assert lines == [b'blocknotify 0x1\n', b'walletnotify 0x2\n']
+
+    @pytest.mark.asyncio
+    async def test_webhook_sink_batches(self, event_loop, unused_tcp_port):
+        requests = []
+
+        async def hook(request):
+            requests.append(await request.json())
+            return web.Response(text='ok')
+
+        app = web.Application(loop=event_loop)
+        app.router.add_post('/hook', hook)
+        handler = app.make_handler()
+        server = await event_loop.create_server(handler, '127.0.0.1',
+                                                unused_tcp_port)
+        sink = WebhookSink('http://127.0.0.1:%s/hook' % unused_tcp_port,
+                           loop=event_loop)
+        # sent one at a time, as by single notification worker
+        await sink.send('blocknotify', '0x1')
+        await sink.send('walletnotify', '0x2')
+        await sink._flusher
+        await sink.send('blocknotify', '0x3')
+        await sink._flusher
+        sink.close()
+        server.close()
+        assert sink.batches == 2
+        assert requests == [
+            [{'event': 'blocknotify', 'data': '0x1'},
+             {'event': 'walletnotify', 'data': '0x2'}],
+            [{'event': 'blocknotify', 'data': '0x3'}],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_webhook_sink_logs_failures(self, event_loop,
+                                              unused_tcp_port):
+        sink = WebhookSink('http://127.0.0.1:%s/hook' % unused_tcp_port,
+                           timeout=1, loop=event_loop)
+        await sink.send('blocknotify', '0x1')
+        await sink._flusher
+        sink.close()
+        assert sink.failed == 1
@@ -0,0 +1,321 @@
+import asyncio
+
+from aiohttp import web
+from asynctest.mock import patch, CoroutineMock, Mock
+import pytest
+
+from ethereumd.proxy import EthereumProxy
+from ethereumd.upstream import UpstreamClient, UpstreamNode, UpstreamPool
+from aioethereum import AsyncIOHTTPClient, AsyncIOIPCClient
+from aioethereum.errors import BadResponseError, BadStatusError
+
+from .base import BaseTestRunner
+from .fakers import fake_block, fake_call, fake_chain_pool
+
+
+ACCOUNTS = ['0x%040x' % i for i in range(1, 6)]
+
+
+def fake_batch(data):
+    fake = fake_call()
+    responses = []
+    for item in data:
+        try:
+            result = fake(item['method'], item['params'])
+        except BadResponseError as e:
+            responses.append({'id': item['id'], 'jsonrpc': '2.0',
+                              'error': {'message': e.msg, 'code': e.code}})
+        else:
+            responses.append({'id': item['id'], 'jsonrpc': '2.0',
+                              'result': result})
+    return list(reversed(responses))
+
+
+class TestUpstreamClient(BaseTestRunner):
+
+    def make_client(self, loop, **kwargs):
+        return UpstreamClient(AsyncIOHTTPClient(loop=loop), loop=loop,
+                              **kwargs)
+
+    @pytest.mark.asyncio
+    async def test_single_call_sent_as_object(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=lambda data: fake_batch(
+            [data])[0])
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            accounts = await rpc.eth_accounts()
+            with pytest.raises(BadResponseError):
+                await rpc._call('eth_getTransactionByHash')
+        assert accounts == ['0xf5041fe398062cd63b62bd9b5df9942d30c9b8ca']
+        assert post_mock.call_args_list[0][0][0] == {
+            'jsonrpc': '2.0', 'method': 'eth_accounts', 'params': [],
+            'id': 1}
+        assert rpc.batches == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_packed_in_batch(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            accounts, trans, block = await asyncio.gather(
+                rpc.eth_accounts(),
+                rpc.eth_getTransactionByHash('0x1'),
+                rpc.eth_getBlockByHash('0x2'),
+                loop=event_loop)
+        assert post_mock.call_count == 1
+        assert len(post_mock.call_args[0][0]) == 3
+        assert accounts == ['0xf5041fe398062cd63b62bd9b5df9942d30c9b8ca']
+        assert trans['hash'] == '0x1'
+        assert block['hash'] == '0x2'
+
+    @pytest.mark.asyncio
+    async def test_batch_split_by_max_size(self, event_loop):
+        rpc = self.make_client(event_loop, batch_size=2)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            await asyncio.gather(*(rpc.eth_getTransactionByHash(hex(i))
+                                   for i in range(4)),
+                                 loop=event_loop)
+        assert post_mock.call_count == 2
+        assert rpc.batches == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_member_error_raised_to_caller(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            accounts, error = await asyncio.gather(
+                rpc.eth_accounts(),
+                rpc._call('eth_unknown'),
+                loop=event_loop, return_exceptions=True)
+        assert accounts == ['0xf5041fe398062cd63b62bd9b5df9942d30c9b8ca']
+        assert isinstance(error, BadResponseError)
+        assert error.code == -32601
+
+    @pytest.mark.asyncio
+    async def test_batch_transport_error_raised_to_all(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=ConnectionError('refused'))
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            results = await asyncio.gather(
+                rpc.eth_accounts(), rpc.eth_accounts(),
+                loop=event_loop, return_exceptions=True)
+        assert all(isinstance(r, ConnectionError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_identical_calls_deduplicated(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_request',
+                          side_effect=fake_call()) as call_mock:
+            with patch.object(UpstreamClient, '_post_http', post_mock):
+                results = await asyncio.gather(
+                    *(rpc.eth_getTransactionByHash('0x1') for _ in range(5)),
+                    loop=event_loop)
+        assert call_mock.call_count == 1
+        assert post_mock.call_count == 0
+        assert rpc.deduplicated == 4
+        assert all(r['hash'] == '0x1' for r in results)
+
+    @pytest.mark.asyncio
+    async def test_different_params_not_deduplicated(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            first, second = await asyncio.gather(
+                rpc.eth_getTransactionByHash('0x1'),
+                rpc.eth_getTransactionByHash('0x2'),
+                loop=event_loop)
+        assert rpc.deduplicated == 0
+        assert len(post_mock.call_args[0][0]) == 2
+        assert (first['hash'], second['hash']) == ('0x1', '0x2')
+
+    @pytest.mark.asyncio
+    async def test_non_idempotent_calls_not_deduplicated(self, event_loop):
+        rpc = self.make_client(event_loop)
+        post_mock = CoroutineMock(side_effect=fake_batch)
+        with patch.object(UpstreamClient, '_post_http', post_mock):
+            await asyncio.gather(rpc.eth_newBlockFilter(),
+                                 rpc.eth_newBlockFilter(),
+                                 loop=event_loop)
+        assert rpc.deduplicated == 0
+        assert len(post_mock.call_args[0][0]) == 2
+
+    @pytest.mark.asyncio
+    async def test_inflight_released_after_call(self, event_loop):
+        rpc = self.make_client(event_loop)
+        with patch.object(UpstreamClient, '_request',
+                          side_effect=fake_call()) as call_mock:
+            await rpc.eth_accounts()
+            await rpc.eth_accounts()
+        assert call_mock.call_count == 2
+        assert rpc.deduplicated == 0
+
+    async def serve(self, loop, port, handler):
+        app = web.Application(loop=loop)
+        app.router.add_post('/', handler)
+        return await loop.create_server(app.make_handler(), '127.0.0.1',
+                                        port)
+
+    @pytest.mark.asyncio
+    async def test_bad_status_releases_connection(self, event_loop,
+                                                  unused_tcp_port):
+        async def handler(request):
+            # body still streamed while client gives up on the status
+            response = web.StreamResponse(status=500)
+            await response.prepare(request)
+            response.write(b'error')
+            await asyncio.sleep(0.1, loop=event_loop)
+            return response
+
+        server = await self.serve(event_loop, unused_tcp_port, handler)
+        client = UpstreamClient(AsyncIOHTTPClient(port=unused_tcp_port,
+                                                  loop=event_loop),
+                                batch_size=1, loop=event_loop)
+        with pytest.raises(BadStatusError):
+            await client._call('eth_blockNumber')
+        assert not client._session.connector._acquired
+        client.close()
+        server.close()
+
+    @pytest.mark.asyncio
+    async def test_timeout_covers_body(self, event_loop, unused_tcp_port):
+        async def handler(request):
+            response = web.StreamResponse()
+            await response.prepare(request)
+            response.write(b'{"jsonrpc": "2.0", ')
+            await asyncio.sleep(1, loop=event_loop)
+            response.write(b'"id": 1, "result": "0x1"}')
+            return response
+
+        server = await self.serve(event_loop, unused_tcp_port, handler)
+        client = UpstreamClient(AsyncIOHTTPClient(port=unused_tcp_port,
+                                                  timeout=0.1,
+                                                  loop=event_loop),
+                                batch_size=1, loop=event_loop)
+        with pytest.raises(asyncio.TimeoutError):
+            await client._call('eth_blockNumber')
+        client.close()
+        server.close()
+
+    def test_unix_path_from_ipc_uri(self, event_loop):
+        client = AsyncIOIPCClient(None, None, 'unix:///tmp/geth.ipc',
+                                  loop=event_loop)
+        assert UpstreamClient(client, loop=event_loop).unix_path == \
+            '/tmp/geth.ipc'
+        assert self.make_client(event_loop).unix_path is None
+
+
+class TestUpstreamPool(BaseTestRunner):
+
+    def make_pool(self, loop, heads=(10, 10, 10)):
+        nodes = []
+        for i, head in enumerate(heads):
+            client = Mock(batches=i, deduplicated=0)
+            client._call = CoroutineMock(return_value='node%s' % i)
+            client.eth_blockNumber = CoroutineMock(return_value=head)
+            nodes.append(UpstreamNode('http://node%s' % i, client))
+        return UpstreamPool(nodes, max_lag=2, loop=loop)
+
+    @pytest.mark.asyncio
+    async def test_wallet_methods_pinned(self, event_loop):
+        pool = self.make_pool(event_loop)
+        pool._nodes[0].outstanding = 5
+        assert (await pool._call('eth_sendTransaction', [{}])) == 'node0'
+        assert (await pool._call('personal_unlockAccount', [])) == 'node0'
+        assert (await pool._call('eth_getFilterChanges', ['0x1'])) == \
+            'node0'
+        assert (await pool._call('eth_getBlockByNumber', ['0x9'])) == \
+            'node1'
+
+    @pytest.mark.asyncio
+    async def test_head_reads_pinned(self, event_loop):
+        pool = self.make_pool(event_loop)
+        pool._nodes[0].outstanding = 5
+        assert (await pool._call('eth_blockNumber')) == 'node0'
+        assert (await pool._call('eth_getBlockByNumber',
+                                 ['latest', False])) == 'node0'
+        assert (await pool._call('eth_getBalance',
+                                 ['0x1', 'pending'])) == 'node0'
+
+    @pytest.mark.asyncio
+    async def test_missing_lookup_retried_on_wallet_node(self, event_loop):
+        pool = self.make_pool(event_loop)
+        pool._nodes[0].outstanding = 5
+        pool._nodes[1].client._call.return_value = None
+        assert (await pool._call('eth_getTransactionByHash', ['0x1'])) == \
+            'node0'
+        await pool.check()
+        assert (await pool._call('eth_getBalance', ['0x1', '0x9'])) is None
+        assert pool.retries == 1
+
+    @pytest.mark.asyncio
+    async def test_least_outstanding(self, event_loop):
+        pool = self.make_pool(event_loop)
+        pool._nodes[0].outstanding = 2
+        pool._nodes[1].outstanding = 1
+        assert (await pool._call('eth_getBalance', ['0x1'])) == 'node2'
+        assert pool._nodes[2].outstanding == 0
+        assert pool.batches == 3
+
+    @pytest.mark.asyncio
+    async def test_check_ejects_lagging_node(self, event_loop):
+        pool = self.make_pool(event_loop, heads=(10, 5, 9))
+        pool._nodes[0].outstanding = 1
+        await pool.check()
+        assert [node.healthy for node in pool._nodes] == [True, False, True]
+        assert (await pool._call('eth_getBalance', ['0x1', '0x9'])) == \
+            'node2'
+        pool._nodes[1].client.eth_blockNumber.return_value = 10
+        pool._nodes[2].client.eth_blockNumber.side_effect = \
+            ConnectionError('down')
+        await pool.check()
+        assert [node.healthy for node in pool._nodes] == [True, True, False]
+        assert pool.stats[2]['head'] is None
+
+    @pytest.mark.asyncio
+    async def test_state_read_only_on_node_with_block(self, event_loop):
+        chain = [fake_block(n) for n in range(101)]
+        pool = fake_chain_pool(chain, (100, 99), {
+            account: 10 ** 18 for account in ACCOUNTS}, ACCOUNTS,
+            loop=event_loop)
+        await pool.check()
+        proxy = EthereumProxy(pool)
+        # read node one block behind would answer "header not found"
+        assert (await proxy.getbalance()) == 5
+        assert pool._nodes[1].client._call.call_count == 0
+        assert (await proxy.getbalance(None, 2)) == 5
+        assert pool._nodes[1].client._call.call_count > 0
+        assert (await pool._call('eth_getBalance', [ACCOUNTS[0], '0x64'])) \
+            == hex(10 ** 18)
+
+    def make_slow_pool(self, loop, **kwargs):
+        pool = self.make_pool(loop, heads=(10, 10))
+
+        async def slow_call(method, params=None, _id=None):
+            await asyncio.sleep(0.1, loop=loop)
+            return 'node0'
+
+        pool._nodes[0].client._call = CoroutineMock(side_effect=slow_call)
+        pool.__init__(pool._nodes, loop=loop, **kwargs)
+        for _ in range(pool.hedge_min_samples):
+            pool._observe('eth_getBalance', 0.001)
+        return pool
+
+    @pytest.mark.asyncio
+    async def test_hedged_read_won_by_backup(self, event_loop):
+        pool = self.make_slow_pool(event_loop)
+        assert (await pool._call('eth_getBalance', ['0x1'])) == 'node1'
+        assert pool.hedge_stats == {'reads': 1, 'fired': 1, 'won': 1}
+        # cancelled loser releases its node on next loop iteration
+        await asyncio.sleep(0, loop=event_loop)
+        assert pool._nodes[0].outstanding == 0
+        # writes are never hedged
+        assert (await pool._call('eth_sendTransaction', [{}])) == 'node0'
+        assert pool.hedges == 1
+
+    @pytest.mark.asyncio
+    async def test_hedge_budget(self, event_loop):
+        pool = self.make_slow_pool(event_loop, hedge_budget=0)
+        assert (await pool._call('eth_getBalance', ['0x1'])) == 'node0'
+        assert pool.hedge_stats == {'reads': 1, 'fired': 0, 'won': 0}
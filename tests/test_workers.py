@@ -0,0 +1,106 @@
+import logging
+import os
+import signal
+import stat
+import tempfile
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from ethereumd.server import RPCServer
+from ethereumd.workers import supervise, bind_unix_socket, ElectionLock
+
+from .base import BaseTestRunner
+
+
+class TestWorkers(BaseTestRunner):
+
+    def test_supervise_respawns_workers(self):
+        tmpdir = tempfile.mkdtemp()
+        handlers = [signal.getsignal(signum)
+                    for signum in (signal.SIGTERM, signal.SIGINT)]
+        # master stops itself once workers had time to be respawned
+        signal.setitimer(signal.ITIMER_REAL, 0.5)
+        signal.signal(signal.SIGALRM,
+                      lambda *args: os.kill(os.getpid(), signal.SIGTERM))
+        try:
+            if not supervise(2, respawn_delay=0):
+                open(os.path.join(tmpdir, str(os.getpid())), 'w').close()
+                # first two workers die at once, respawned ones serve
+                if len(os.listdir(tmpdir)) > 2:
+                    time.sleep(10)
+                os._exit(0)
+        finally:
+            signal.signal(signal.SIGTERM, handlers[0])
+            signal.signal(signal.SIGINT, handlers[1])
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        assert len(os.listdir(tmpdir)) == 4
+
+    def test_election_lock(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ethereumd.lock')
+        first, second = ElectionLock(path), ElectionLock(path)
+        assert first.acquire()
+        assert first.acquire()
+        assert not second.acquire()
+        with open(path) as f:
+            assert f.read() == str(os.getpid())
+        first.record(42)
+        with open(path) as f:
+            assert f.read() == '%s 42' % os.getpid()
+        first.release()
+        assert second.acquire()
+        assert second.held and not first.held
+        # new holder resumes from height recorded by the previous one
+        assert second.height == 42
+        second.release()
+
+    @pytest.mark.asyncio
+    async def test_single_worker_elected_with_failover(self, event_loop):
+        path = os.path.join(tempfile.mkdtemp(), 'ethereumd.lock')
+        servers = [RPCServer(workers=2, workerlock=path, loop=event_loop)
+                   for _ in range(2)]
+        for server in servers:
+            server._poller = Mock(has_txindex=False, height=None)
+            server._scheduler = Mock()
+            await server._elect()
+        assert [s._leader for s in servers] == [True, False]
+        assert not servers[1]._poller.start.called
+
+        servers[0]._poller.height = 7
+        await servers[0]._elect()
+        # lock of exited worker is released by the kernel
+        servers[0]._lock.release()
+        await servers[1]._elect()
+        assert servers[1]._leader
+        assert servers[1]._poller.height == 7
+        servers[1]._poller.start.assert_called_once_with(0.1, 1)
+        servers[1]._lock.release()
+
+    def test_bind_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ethereumd.sock')
+        sock = bind_unix_socket(path)
+        sock.listen(1)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o660
+        with pytest.raises(OSError):
+            bind_unix_socket(path)
+        sock.close()
+        # socket file of server which exited is replaced
+        bind_unix_socket(path).close()
+
+    def test_listener_required(self):
+        with pytest.raises(ValueError):
+            RPCServer(ethpport=0)
+
+    def test_logging_installed_by_run(self, event_loop):
+        root = logging.getLogger()
+        handlers = root.handlers[:]
+        RPCServer(logfile=os.devnull, loop=event_loop)
+        assert root.handlers == handlers
+
+    def test_log_rotation_off_with_workers(self, event_loop):
+        server = RPCServer(logfile=os.devnull, loop=event_loop)
+        assert server._logging.handler.maxBytes == 10485760
+        server = RPCServer(workers=2, workerlock=os.devnull,
+                           logfile=os.devnull, loop=event_loop)
+        assert server._logging.handler.maxBytes == 0